@@ -1,20 +1,8 @@
 import argparse
 import re
 
-from resolvers import (
-  PointerResolver,
-  StackResolver,
-  TableResolver,
-  OrderTableResolver,
-)
-
-from printers import (
-  HexPrinter,
-  BarPrinter,
-  LinePrinter,
-  MappedPrinter,
-)
-
+from registry import RESOLVERS, PRINTERS
+from triggers import Trigger
 from util import int_autobase
 
 
@@ -38,6 +26,11 @@ def subargs_parser(tokens):
 
 
 def parse_addr(tokens):
+  # Address is to be found by RAM locator at startup, only offset is known
+  if tokens.startswith('auto'):
+    offset = tokens[4:]
+    return 'auto', 0, 64, int_autobase(offset) if offset else 0
+
   regex = (
     r'(@)?'                          # is this a pointer to addr?
     r'((?:0x)?[0-9a-fA-F]+)'         # what's the addr?
@@ -56,6 +49,25 @@ def parse_addr(tokens):
   return resolve, addr, width, offset
 
 
+def parse_strides(value):
+  return [int_autobase(x) for x in value.split(',') if x]
+
+
+def parse_printer(tokens):
+  '''CLASS[:SETTINGS] into (label, printer instance)
+  '''
+  name, _sep, settings = tokens.partition(':')
+  if name not in PRINTERS:
+    raise ValueError(f'Unknown printer {name}')
+  s_args, s_kwargs = subargs_parser(settings)
+  return tokens, PRINTERS[name](*s_args, **s_kwargs)
+
+
+def parse_window(tokens):
+  start, size = tokens.split(':')
+  return int_autobase(start), int_autobase(size)
+
+
 class CustomFormatter(
   argparse.RawTextHelpFormatter,
   argparse.ArgumentDefaultsHelpFormatter,):
@@ -65,59 +77,6 @@ class CustomFormatter(
     self._max_help_position = 8
 
 
-RESOLVER_MAP = {
-  'ptr': (
-    PointerResolver,
-    'Read single pointer, optionally add offset it by index.\n'
-    '    Format: POINTER[:INDEX][:FLAGS], e.g. 0xfc,v,5:0xfe\n'
-    '    Flags: m - Combine offset and pointer address in output\n'
-    '    Defaults: pointer: w , index: b\n'),
-
-  'table': (
-    TableResolver,
-    'Get the data pointer from lookup table, \n'
-    '  index in this table and offset inside that data index.\n'
-    '  Table is assumed to contain WORD LE pointers.\n'
-    '    Format: TABLE_POINTER:TABLE_INDEX:OFFSET_POINTER[:FLAGS]\n'
-    '    Flags: w - Index is word, W - Offset is word, d - Index is pointer\n'
-    '           o - Print final offset\n'
-    '    Example: 0x66ec:0xef:0xf3:d will read data for CH1 of Outrun Europa.\n'),
-
-  'order': (
-    OrderTableResolver,
-    'Get the data pointer from order lookup table, data lookup table, \n'
-    '  index in this table and offset inside that data index.\n'
-    '  Table is assumed to contain WORD LE pointers.\n'
-    '    Format: ORDER_TABLE:DATA_TABLE:ORDER_INDEX:OFFSET_POINTER[:FLAGS]\n'
-    '    Flags: W - Offset is word, o - Print final offset in info\n'),
-
-  'stack': (
-    StackResolver,
-    'Read data inside stack pointer that is offset by stack depth\n'
-    '    Format: STACK:DEPTH[:FLAGS][:SHIFT][:LOW:HIGH], e.g. 0x5ba:0x528::1\n'
-    '    Defaults: stack: w , depth: b\n'
-    '    Flags: n - substract depth value instead of adding\n'
-    '    SHIFT: Offset pointer by this many bytes. Useful when reference\n'
-    '           points at loop counter followed by pointer\n'
-    '    LOW/HIGH: Shift only if discovered pointer is outside this region\n'),
-}
-
-PRINTER_MAP = {
-  'hex': (
-    HexPrinter,
-    ' Generic hex dump printer, uses global arguments'),
-  'bar': (
-    BarPrinter,
-    ' Hex printer extension, plots values below 0x20 as a bar'),
-  'line': (
-    LinePrinter,
-    'Hex printer extension, plots both positive and negative values'),
-  'map': (
-    MappedPrinter,
-    ' Prints parsed commands from definition file, falls back to hex\n')
-}
-
-
 def get_parser():
 
   parser = argparse.ArgumentParser(
@@ -128,30 +87,30 @@ def get_parser():
   parser.add_argument(
     'filename',
     type=str,
-    help='Memory file to read from (can be mmap too)')
+    help='Memory file to read from (can be mmap too),\n'
+         'or gdb://HOST:PORT, gdb:///SOCKET to read through gdb stub,\n'
+         'or .gz/.xz/.bz2 dump, FILE?frame=SIZE to replay frame archive')
   parser.add_argument(
     'ram_ptr',
     type=parse_addr,
     help='Emulator/Player/Program RAM offset used for analysis.\n'
          'Should point to internal address 0x0 or segment start\n'
-         'Format: [@]0x123123[,d|q][[+-]offset]\n'
+         'Format: [@]0x123123[,d|q][[+-]offset] or auto[[+-]offset]\n'
          '  @ - resolve actual address from this pointer\n'
+         '  auto - locate RAM using --signature and/or --ram-size\n'
          '  q - pointer is 64 bits (default)\n'
          '  d - pointer is 32 bits\n'
          '  +/- - add this much after resolving address OR add offset to static pointer\n'
          'Example: @0x1025100,d+0x100\n')
 
-  resolver_help = '\n'.join(
-    f'{key}: {value[1]}' for key, value in RESOLVER_MAP.items())
-
-  printer_help = '\n'.join(
-    f'{key}: {value[1]}' for key, value in PRINTER_MAP.items())
+  resolver_help = RESOLVERS.describe()
+  printer_help = PRINTERS.describe()
 
   parser.add_argument(
     '-M', '--resolve-method',
     type=str,
     default='ptr',
-    choices=RESOLVER_MAP,
+    choices=RESOLVERS,
     help='Class for resolving driver-specific data into memory offset.\n'
         + resolver_help + (
         '\nAll pointer values support configurable TYPE:\n'
@@ -171,7 +130,7 @@ def get_parser():
     '-P', '--printer-class',
     type=str,
     default='hex',
-    choices=PRINTER_MAP,
+    choices=PRINTERS,
     help=f'Class used to provide per-row result printout:\n'
          + printer_help)
   parser.add_argument(
@@ -207,5 +166,93 @@ def get_parser():
     type=int_autobase,
     default=120,
     help='Polling rate in Hz')
+  parser.add_argument(
+    '-x', '--xref',
+    type=int_autobase,
+    metavar='SIZE',
+    help='Index pointers inside first SIZE bytes of data segment and show\n'
+         'which of them point to where the pointer jumped')
+  parser.add_argument(
+    '--xref-strides',
+    type=parse_strides,
+    default=[],
+    help='Comma separated strides to also index split lo/hi pointers (vword)')
+  parser.add_argument(
+    '--prefetch',
+    type=int_autobase,
+    default=0,
+    metavar='SCAN',
+    help='Look this many bytes ahead of pointer for final commands with addr\n'
+         'parameter and decode their targets in background, needs map printer')
+  parser.add_argument(
+    '--start-when',
+    type=Trigger,
+    metavar='COND',
+    help='Hold output back until condition is met, e.g. "ptr in 0x8200..0x8300"')
+  parser.add_argument(
+    '--stop-when',
+    type=Trigger,
+    metavar='COND',
+    help='Exit once condition is met, e.g. "ram[0xf5] -> 3"')
+  parser.add_argument(
+    '--mark-when',
+    type=Trigger,
+    metavar='COND',
+    help='Print mark line every time condition becomes true.\n'
+         'See triggers.py for condition syntax')
+  parser.add_argument(
+    '--signature',
+    type=str,
+    help='Comma separated hex bytes to search for when ram_ptr is auto,\n'
+         '?? matches any byte. Found location is cached per emulator build')
+  parser.add_argument(
+    '--signature-offset',
+    type=int_autobase,
+    default=0,
+    help='Internal RAM address where signature is located')
+  parser.add_argument(
+    '--ram-size',
+    type=int_autobase,
+    help='Emulated RAM size, limits auto search to mappings this big,\n'
+         'without --signature mapping has to be exactly this big')
+  parser.add_argument(
+    '--shm',
+    type=str,
+    metavar='NAME',
+    help='Publish RAM snapshot of every tick into shared memory ring NAME')
+  parser.add_argument(
+    '--shm-window',
+    type=parse_window,
+    metavar='START:SIZE',
+    help='RAM window to publish, defaults to what resolver reads')
+  parser.add_argument(
+    '--shm-slots',
+    type=int_autobase,
+    default=64,
+    help='Number of frames kept in shared memory ring')
+  parser.add_argument(
+    '--coverage',
+    type=str,
+    dest='coverage_file',
+    metavar='FILE',
+    help='Save which data bytes pointer walked over and jumped to into FILE\n'
+         '(.npz, merged with existing), see data_coverage.py')
+  parser.add_argument(
+    '--coverage-size',
+    type=int_autobase,
+    default=0,
+    help='Data segment size for coverage, grows as needed anyway')
+  parser.add_argument(
+    '--profile',
+    type=str,
+    metavar='FILE',
+    help='Time resolve, read, render and write stages. Report is printed on\n'
+         'SIGUSR1 and on exit, then saved to FILE: *.speedscope.json for\n'
+         'speedscope, *.json for Chrome trace, text otherwise. Use - to skip saving')
+  parser.add_argument(
+    '--profile-sample',
+    type=int_autobase,
+    default=16,
+    help='Put every N-th call of a stage into histogram and trace')
 
   return parser
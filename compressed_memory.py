@@ -0,0 +1,274 @@
+#!/usr/bin/env -S python3 -u
+'''Memory reader for compressed dumps.
+gzip, xz/lzma and bz2 streams can't be seeked, so the first open decompresses
+the dump once and stores it as independently zlib-compressed blocks in cache
+directory. Any offset is then one block decompression away, and recently used
+blocks stay decompressed in a small LRU. Cache directory is trimmed to
+CACHE_LIMIT bytes, least recently opened dumps go first.
+
+Frame archives (concatenated per-frame RAM dumps) are opened with frame size
+appended to filename, each tick() moves to the next frame:
+
+  ram_frames.bin.xz?frame=0x800
+  ram_frames.bin.xz?frame=0x800&start=600
+
+Uncompressed archives work the same way and are read in place, without cache.
+Capture saved by scanner.py / table_solver.py (.npz) is a frame archive too.
+'''
+
+import argparse
+import bz2
+import gzip
+import hashlib
+import lzma
+import os
+import struct
+import zlib
+from array import array
+from collections import OrderedDict
+from sys import stdout
+from urllib.parse import parse_qs
+
+from memory_reader import Memory
+from util import int_autobase
+
+
+CACHE_DIR = os.path.join(
+  os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+  'ptr_log', 'blocks')
+CACHE_LIMIT = 1 << 30
+
+OPENERS = {
+  '.gz': gzip.open,
+  '.xz': lzma.open,
+  '.lzma': lzma.open,
+  '.bz2': bz2.open,
+}
+
+MAGIC = b'PTRBLK01'
+HEADER = struct.Struct('<8sQQQ')  # magic, block size, total size, block count
+BLOCK_SIZE = 0x10000
+
+
+def index_file(filename, block_size):
+  '''Cache file name, changes whenever the dump does
+  '''
+  info = os.stat(filename)
+  key = f'{os.path.abspath(filename)}:{info.st_size}:{info.st_mtime_ns}:{block_size}'
+  return os.path.join(CACHE_DIR, hashlib.sha1(key.encode()).hexdigest() + '.blocks')
+
+
+def stream_chunks(filename, block_size):
+  if filename.endswith('.npz'):
+    from snapshot import load_capture
+    frames, _start = load_capture(filename)
+    data = frames.tobytes()
+    for pos in range(0, len(data), block_size):
+      yield data[pos:pos + block_size]
+    return
+
+  opener = OPENERS[os.path.splitext(filename)[1]]
+  with opener(filename, 'rb') as handle:
+    while chunk := handle.read(block_size):
+      yield chunk
+
+
+def prune_cache(keep):
+  '''Remove least recently used block files until cache fits in CACHE_LIMIT
+  '''
+  files = [os.path.join(CACHE_DIR, x) for x in os.listdir(CACHE_DIR) if x.endswith('.blocks')]
+  files.sort(key=os.path.getmtime, reverse=True)
+
+  total = 0
+  for name in files:
+    total += os.path.getsize(name)
+    if total > CACHE_LIMIT and name != keep:
+      os.remove(name)
+
+
+def build_index(filename, block_size=BLOCK_SIZE):
+  '''Recompress whole dump into seekable block file, return its name
+  '''
+  target = index_file(filename, block_size)
+  if os.path.exists(target):
+    # Modification time doubles as last use for pruning
+    os.utime(target)
+    return target
+
+  os.makedirs(CACHE_DIR, exist_ok=True)
+  offsets = array('Q')
+  total = 0
+  temporary = target + '.tmp'
+
+  with open(temporary, 'wb') as handle:
+    handle.write(bytes(HEADER.size))
+    for chunk in stream_chunks(filename, block_size):
+      offsets.append(handle.tell())
+      handle.write(zlib.compress(chunk, 1))
+      total += len(chunk)
+    offsets.append(handle.tell())
+    handle.write(offsets.tobytes())
+    handle.seek(0)
+    handle.write(HEADER.pack(MAGIC, block_size, total, len(offsets) - 1))
+
+  os.replace(temporary, target)
+  prune_cache(target)
+  return target
+
+
+def frame_settings(filename):
+  '''Split frame archive settings off filename
+  '''
+  path, _sep, query = filename.partition('?')
+  settings = {key: int_autobase(value[-1]) for key, value in parse_qs(query).items()}
+
+  if path.endswith('.npz') and 'frame' not in settings:
+    from snapshot import load_capture
+    frames, _start = load_capture(path)
+    settings['frame'] = frames.shape[1]
+
+  return path, settings.get('frame', 0), settings.get('start', 0)
+
+
+class CompressedMemory(Memory):
+
+  base = None
+  handle = None
+  block_size = None
+  size = None
+  offsets = None
+  block_count = None
+  cache = None
+  cache_blocks = None
+  frame_size = 0
+  frame = 0
+  frame_count = 1
+
+  def __init__(self, filename, base_offset, cache_blocks=32, block_size=BLOCK_SIZE):
+    path, self.frame_size, self.frame = frame_settings(filename)
+
+    if os.path.splitext(path)[1] in (*OPENERS, '.npz'):
+      self.handle = open(build_index(path, block_size), 'rb')
+      _magic, self.block_size, self.size, count = HEADER.unpack(self.handle.read(HEADER.size))
+      self.handle.seek(-8 * (count + 1), os.SEEK_END)
+      self.offsets = array('Q', self.handle.read(8 * (count + 1)))
+    else:
+      # Uncompressed archive is already seekable, blocks are read from it as is
+      self.handle = open(path, 'rb')
+      self.block_size = block_size
+      self.size = os.path.getsize(path)
+      count = -(-self.size // block_size)
+
+    self.block_count = count
+
+    self.base = base_offset
+    self.cache = OrderedDict()
+    self.cache_blocks = cache_blocks
+    if self.frame_size:
+      self.frame_count = self.size // self.frame_size
+
+  def block(self, number):
+    if number in self.cache:
+      self.cache.move_to_end(number)
+      return self.cache[number]
+
+    if self.offsets is None:
+      self.handle.seek(number * self.block_size)
+      data = self.handle.read(self.block_size)
+    else:
+      start, end = self.offsets[number], self.offsets[number + 1]
+      self.handle.seek(start)
+      data = zlib.decompress(self.handle.read(end - start))
+
+    self.cache[number] = data
+    if len(self.cache) > self.cache_blocks:
+      self.cache.popitem(last=False)
+    return data
+
+  def read(self, pos, amount):
+    '''Read from decompressed stream at absolute position
+    '''
+    amount = min(amount, self.size - pos)
+    if amount <= 0:
+      return b''
+
+    first, last = pos // self.block_size, (pos + amount - 1) // self.block_size
+    offset = pos - first * self.block_size
+    if first == last:
+      return self.block(first)[offset:offset + amount]
+
+    data = b''.join(self.block(x) for x in range(first, last + 1))
+    return data[offset:offset + amount]
+
+  def __getitem__(self, index):
+
+    if type(index) == slice:
+      amount = index.stop - index.start
+      offset = index.start
+    else:
+      amount = 1
+      offset = index
+
+    if amount < 1:
+      raise IndexError('Can\'t read nothing!')
+
+    return self.read(self.frame * self.frame_size + self.base + offset, amount)
+
+  def seek_frame(self, frame):
+    self.frame = max(0, min(frame, self.frame_count - 1))
+
+  def tick(self):
+    '''Frame archives advance by one frame per poll and hold the last one
+    '''
+    if self.frame_size:
+      self.seek_frame(self.frame + 1)
+
+
+def get_parser():
+
+  parser = argparse.ArgumentParser(
+    description='Build seek index for compressed dump and print bytes from it.')
+
+  parser.add_argument(
+    'filename',
+    type=str,
+    help='Compressed dump (.gz, .xz, .lzma, .bz2, .npz) or any file with ?frame=SIZE')
+  parser.add_argument(
+    'offset',
+    type=int_autobase,
+    nargs='?',
+    default=0,
+    help='Offset to read from')
+  parser.add_argument(
+    'length',
+    type=int_autobase,
+    nargs='?',
+    default=0x40,
+    help='Amount of bytes to show')
+  parser.add_argument(
+    '-F', '--frame',
+    type=int_autobase,
+    default=None,
+    help='Frame to read from, for frame archives')
+
+  return parser
+
+
+def main():
+
+  args = get_parser().parse_args()
+  memory = CompressedMemory(args.filename, 0)
+  if args.frame is not None:
+    memory.seek_frame(args.frame)
+
+  stdout.write(
+    f'{memory.size} bytes in {memory.block_count} blocks'
+    + (f', {memory.frame_count} frames' if memory.frame_size else '') + '\n')
+  data = memory[args.offset:args.offset + args.length]
+  for pos in range(0, len(data), 16):
+    stdout.write(f'{args.offset + pos:08x}: {data[pos:pos + 16].hex(" ")}\n')
+  memory.close()
+
+
+if __name__ == '__main__':
+  main()
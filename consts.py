@@ -17,3 +17,8 @@ BJMP = 3
 REST = 4
 PREV = 5  # Preview mode
 LKUP = 6  # Preview for backward lookup
+
+ACTION_NAMES = {
+  FWRD: 'FWRD', BKWD: 'BKWD', FJMP: 'FJMP', BJMP: 'BJMP',
+  REST: 'REST', PREV: 'PREV', LKUP: 'LKUP',
+}
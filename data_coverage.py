@@ -0,0 +1,155 @@
+#!/usr/bin/env -S python3 -u
+'''Data segment coverage.
+One byte per data byte: CONSUMED is set for every range pointer walked over,
+TARGET for every address pointer jumped to. Marking is a slice assignment, so
+cost depends on range length only. Map grows as needed.
+
+Saved as .npz with both maps bit-packed. Existing file is merged with the
+new session, so coverage can be collected over several runs.
+'''
+
+import argparse
+import os
+from sys import stdout
+
+import numpy as np
+
+from consts import GRAY, GOLD, RESET
+from util import int_autobase
+
+
+CONSUMED = 1
+TARGET = 2
+
+
+class Coverage:
+
+  size = None
+  bitmap = None
+
+  def __init__(self, size=0):
+    self.size = size
+    self.bitmap = np.zeros(max(size, 0x100), dtype=np.uint8)
+
+  def grow(self, end):
+    size = len(self.bitmap)
+    while size < end:
+      size *= 2
+    bitmap = np.zeros(size, dtype=np.uint8)
+    bitmap[:len(self.bitmap)] = self.bitmap
+    self.bitmap = bitmap
+
+  def mark(self, start, end, flag=CONSUMED):
+    start = max(start, 0)
+    if end <= start:
+      return
+    if end > len(self.bitmap):
+      self.grow(end)
+    self.bitmap[start:end] |= flag
+    self.size = max(self.size, end)
+
+  def mark_target(self, addr):
+    self.mark(addr, addr + 1, TARGET)
+
+  def covered(self, flag=CONSUMED):
+    return int(np.count_nonzero(self.bitmap[:self.size] & flag))
+
+  def regions(self, flag=CONSUMED, touched=False, min_size=1):
+    '''(start, end) runs of bytes that have flag set, or not set
+    '''
+    mask = (self.bitmap[:self.size] & flag) != 0
+    if not touched:
+      mask = ~mask
+    edges = np.flatnonzero(np.diff(mask.astype(np.int8), prepend=0, append=0))
+    runs = edges.reshape(-1, 2)
+    runs = runs[runs[:, 1] - runs[:, 0] >= min_size]
+    return [(int(start), int(end)) for start, end in runs]
+
+  def targets(self):
+    return np.flatnonzero(self.bitmap[:self.size] & TARGET)
+
+  def save(self, filename):
+    '''Write coverage, merging with what file already has
+    '''
+    if os.path.exists(filename):
+      self.merge(load(filename))
+    bitmap = self.bitmap[:self.size]
+    np.savez_compressed(
+      filename,
+      size=self.size,
+      consumed=np.packbits(bitmap & CONSUMED != 0),
+      targets=np.packbits(bitmap & TARGET != 0))
+
+  def merge(self, other):
+    if other.size > len(self.bitmap):
+      self.grow(other.size)
+    self.bitmap[:other.size] |= other.bitmap[:other.size]
+    self.size = max(self.size, other.size)
+
+
+def load(filename):
+  with np.load(filename) as archive:
+    size = int(archive['size'])
+    coverage = Coverage(size)
+    coverage.bitmap[:size] = np.unpackbits(archive['consumed'], count=size) * CONSUMED
+    coverage.bitmap[:size] |= np.unpackbits(archive['targets'], count=size) * TARGET
+  return coverage
+
+
+def get_parser():
+
+  parser = argparse.ArgumentParser(
+    description='Show data segment coverage saved by pointer_logger --coverage.')
+
+  parser.add_argument(
+    'filename',
+    type=str,
+    help='Coverage file (.npz)')
+  parser.add_argument(
+    '-s', '--start',
+    type=int_autobase,
+    default=0,
+    help='Only report regions after this offset')
+  parser.add_argument(
+    '-n', '--size',
+    type=int_autobase,
+    help='Treat data segment as this big, untouched tail is reported too')
+  parser.add_argument(
+    '-m', '--min-size',
+    type=int_autobase,
+    default=16,
+    help='Skip untouched regions smaller than this')
+  parser.add_argument(
+    '-t', '--targets',
+    action='store_true',
+    help='Also list jump targets')
+
+  return parser
+
+
+def main():
+
+  args = get_parser().parse_args()
+  coverage = load(args.filename)
+  if args.size is not None:
+    coverage.mark(0, args.size, 0)
+    coverage.size = args.size
+
+  covered = coverage.covered()
+  stdout.write(
+    f'{GOLD}{covered} of {coverage.size} bytes consumed '
+    f'({covered / max(coverage.size, 1):.1%}), '
+    f'{coverage.covered(TARGET)} jump targets{RESET}\n')
+
+  for start, end in coverage.regions(min_size=args.min_size):
+    if end > args.start:
+      stdout.write(f'{GRAY}untouched{RESET} {start:06x}-{end:06x} {end - start:6d}\n')
+
+  if args.targets:
+    for addr in coverage.targets():
+      if addr >= args.start:
+        stdout.write(f'{GRAY}target{RESET}    {addr:06x}\n')
+
+
+if __name__ == '__main__':
+  main()
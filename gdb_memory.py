@@ -0,0 +1,321 @@
+#!/usr/bin/env -S python3 -u
+'''Memory reader over GDB remote serial protocol.
+For emulators that expose gdb stub instead of letting us at /proc/PID/mem.
+Filename is gdb://HOST:PORT for TCP or gdb:///PATH for Unix socket.
+
+Connection is kept open and shared by all readers of the same target (code
+and data windows), reads are `m ADDR,LEN` packets. Resolvers read about the
+same addresses every tick, so ranges that were read during both previous
+ticks are merged and requested all at once on first read after tick(): every
+request is sent before the first reply is read, which makes whole poll cost
+one round-trip however many readers there are. Reads inside the tick are then
+served from what was fetched. Anything else, like previews at wherever the
+pointer moved or static data, is fetched on the spot and only once.
+
+Running this file serves a plain file over the same protocol, which is enough
+to try the backend without an emulator.
+'''
+
+import argparse
+import socket
+import socketserver
+from urllib.parse import urlsplit
+
+from memory_reader import Memory
+from util import merge_regions
+
+
+class GdbError(OSError):
+  pass
+
+
+def checksum(payload):
+  return b'%02x' % (sum(payload) & 0xff)
+
+
+def packet(payload):
+  return b'$' + payload + b'#' + checksum(payload)
+
+
+def unescape(payload):
+  '''Undo binary escaping and run-length encoding of reply
+  '''
+  if b'}' not in payload and b'*' not in payload:
+    return payload
+
+  result = bytearray()
+  pos = 0
+  while pos < len(payload):
+    char = payload[pos]
+    if char == 0x7d:  # }
+      pos += 1
+      result.append(payload[pos] ^ 0x20)
+    elif char == 0x2a:  # *
+      pos += 1
+      result += result[-1:] * (payload[pos] - 29)
+    else:
+      result.append(char)
+    pos += 1
+  return bytes(result)
+
+
+def connect(url):
+  parts = urlsplit(url)
+  if parts.hostname:
+    sock = socket.create_connection((parts.hostname, parts.port or 1234))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+  else:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(parts.path)
+  return sock
+
+
+class GdbLink:
+  '''Stub connection with per-tick cache, addresses are absolute
+  '''
+
+  url = None
+  sock = None
+  buffer = b''
+  no_ack = False
+  max_read = 0x800
+  pad = None
+  cache = None
+  touched = None
+  previous = None
+  batch = None
+  stale = False
+  users = 0
+  round_trips = 0
+
+  def __init__(self, url, pad=16):
+    self.url = url
+    self.pad = pad
+    self.sock = connect(url)
+    self.cache = []
+    self.touched = []
+    self.previous = set()
+    self.batch = []
+    self.handshake()
+
+  def handshake(self):
+    self.send([b'qSupported:multiprocess+'])
+    features = self.receive().split(b';')
+
+    for feature in features:
+      if feature.startswith(b'PacketSize='):
+        # Reply is hex encoded, two characters per byte, plus framing
+        self.max_read = max(0x10, (int(feature[11:], 16) - 8) // 2)
+
+    if b'QStartNoAckMode+' in features:
+      self.send([b'QStartNoAckMode'])
+      if self.receive() == b'OK':
+        self.no_ack = True
+
+  def send(self, payloads):
+    self.sock.sendall(b''.join(packet(x) for x in payloads))
+
+  def receive(self):
+    '''Read one reply packet, skipping acks
+    '''
+    while True:
+      start = self.buffer.find(b'$')
+      end = self.buffer.find(b'#', start) if start >= 0 else -1
+      if end >= 0 and len(self.buffer) >= end + 3:
+        break
+      chunk = self.sock.recv(0x10000)
+      if not chunk:
+        raise GdbError('gdb stub closed connection')
+      self.buffer += chunk
+
+    payload = self.buffer[start + 1:end]
+    self.buffer = self.buffer[end + 3:]
+    if not self.no_ack:
+      self.sock.sendall(b'+')
+    return unescape(payload)
+
+  def fetch(self, ranges):
+    '''Read (address, size) ranges with all requests pipelined,
+    returns list of (address, bytes)
+    '''
+    requests = []
+    for address, size in ranges:
+      for pos in range(address, address + size, self.max_read):
+        requests.append((pos, min(self.max_read, address + size - pos)))
+
+    self.send([b'm%x,%x' % (pos, size) for pos, size in requests])
+    self.round_trips += 1
+
+    result = []
+    for pos, _size in requests:
+      reply = self.receive()
+      if reply.startswith(b'E') and len(reply) == 3:
+        raise GdbError(f'gdb stub refused to read 0x{pos:x}: {reply.decode()}')
+      result.append((pos, bytes.fromhex(reply.decode())))
+    return result
+
+  def tick(self):
+    '''Start of new poll, every reader calls it but only the first call
+    after some reads counts. Fetching waits for the first read.
+    '''
+    if self.stale:
+      return
+    touched = set(self.touched)
+    self.batch = merge_regions(touched & self.previous, self.pad)
+    self.previous = touched
+    self.touched = []
+    self.cache = []
+    self.stale = True
+
+  def read(self, address, amount):
+    if self.stale:
+      self.stale = False
+      self.cache = self.fetch(self.batch) if self.batch else []
+
+    self.touched.append((address, amount))
+
+    for start, data in self.cache:
+      if start <= address and address + amount <= start + len(data):
+        return data[address - start:address - start + amount]
+
+    parts = self.fetch([(address, amount)])
+    self.cache.extend(parts)
+    return b''.join(data for _start, data in parts)
+
+  def close(self):
+    self.users -= 1
+    if not self.users:
+      self.sock.close()
+
+
+class GdbMemory(Memory):
+
+  link = None
+
+  def __init__(self, filename, base_offset, pad=16, link=None):
+    self.base = base_offset
+    self.link = GdbLink(filename, pad) if link is None else link
+    self.link.users += 1
+
+  @property
+  def round_trips(self):
+    return self.link.round_trips
+
+  def window(self, base_offset):
+    '''Reader at another base over the same connection
+    '''
+    return GdbMemory(self.link.url, base_offset, link=self.link)
+
+  def tick(self):
+    self.link.tick()
+
+  def __getitem__(self, index):
+
+    if type(index) == slice:
+      amount = index.stop - index.start
+      offset = index.start
+    else:
+      amount = 1
+      offset = index
+
+    if amount < 1:
+      raise IndexError('Can\'t read nothing!')
+
+    return self.link.read(self.base + offset, amount)
+
+  def close(self):
+    self.link.close()
+
+
+class StubHandler(socketserver.BaseRequestHandler):
+  '''Bare bones gdb stub serving memory reads from server.filename
+  '''
+
+  def handle(self):
+    memory = open(self.server.filename, 'rb', buffering=0)
+    no_ack = False
+    buffer = b''
+
+    while True:
+      chunk = self.request.recv(0x10000)
+      if not chunk:
+        break
+      buffer += chunk
+
+      replies = []
+      while True:
+        start = buffer.find(b'$')
+        end = buffer.find(b'#', start) if start >= 0 else -1
+        if end < 0 or len(buffer) < end + 3:
+          break
+        payload = buffer[start + 1:end]
+        buffer = buffer[end + 3:]
+
+        if not no_ack:
+          replies.append(b'+')
+
+        if payload.startswith(b'qSupported'):
+          reply = b'PacketSize=4000;QStartNoAckMode+'
+        elif payload == b'QStartNoAckMode':
+          reply = b'OK'
+          no_ack = True
+        elif payload == b'?':
+          reply = b'S05'
+        elif payload.startswith(b'm'):
+          addr, size = (int(x, 16) for x in payload[1:].split(b','))
+          memory.seek(addr)
+          data = memory.read(size)
+          reply = data.hex().encode() if data else b'E01'
+        else:
+          reply = b''
+        replies.append(packet(reply))
+
+      self.request.sendall(b''.join(replies))
+
+    memory.close()
+
+
+def serve(filename, url):
+  parts = urlsplit(url)
+  if parts.hostname:
+    server = socketserver.ThreadingTCPServer((parts.hostname, parts.port or 1234), StubHandler)
+  else:
+    server = socketserver.ThreadingUnixStreamServer(parts.path, StubHandler)
+  server.filename = filename
+  server.daemon_threads = True
+  return server
+
+
+def get_parser():
+
+  parser = argparse.ArgumentParser(
+    description='Serve file as memory over gdb remote protocol, for testing gdb:// targets.')
+
+  parser.add_argument(
+    'filename',
+    type=str,
+    help='File to serve')
+  parser.add_argument(
+    'url',
+    type=str,
+    nargs='?',
+    default='gdb://localhost:1234',
+    help='gdb://HOST:PORT or gdb:///PATH to listen on')
+
+  return parser
+
+
+def main():
+
+  args = get_parser().parse_args()
+  server = serve(args.filename, args.url)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env -S python3 -u
+'''Grammar fitness check.
+Decodes data segment with MappedPrinter grammars the same way format_vcmds
+does (command, then note, then range, hex otherwise) and reports how much of
+it makes sense. Right grammar for the driver covers most of the sequence data
+and leaves few hex fallbacks, wrong one falls apart quickly.
+
+Every byte is classified, statistics are counted over class array with NumPy.
+Whole segment is split in chunks decoded by process pool, each chunk starts
+decoding LEAD_IN bytes early so it is in step with command boundaries by the
+time it reaches its own first byte. With track starts given, decoding runs
+from each start to the final command and follows addr parameters instead.
+'''
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+from sys import stdout
+
+import numpy as np
+
+from cmd_parser import parse_strides
+from consts import GRAY, GOLD, RESET
+from memory_reader import open_memory
+from printers import MappedPrinter
+from util import int_autobase
+
+
+# Byte classes
+HEX = 0
+OPCODE = 1
+ARGUMENT = 2
+NOTE = 3
+RANGED = 4
+TRUNCATED = 5
+DEAD_END = 6
+CLASS_COUNT = 7
+
+LEAD_IN = 64
+# Extra bytes after each chunk for arguments of its last command
+TAIL = 0x100
+
+
+def grammar_tables(printer):
+  '''Per opcode class, length and final flag, in format_vcmds priority order
+  '''
+  kinds = bytearray(256)
+  lengths = bytearray(b'\1' * 256)
+  finals = bytearray(256)
+  addrs = [None] * 256
+
+  for lo_hi, kind in (
+      ([(x.lo, x.hi) for x in printer.ranges or ()], RANGED),
+      ([(printer.notes.lo, printer.notes.hi)] if printer.notes else [], NOTE)):
+    for lo, hi in lo_hi:
+      kinds[lo:hi + 1] = bytes([kind]) * (hi + 1 - lo)
+
+  for code, command in printer.commands.items():
+    kinds[code] = OPCODE
+    lengths[code] = command.length
+    finals[code] = command.is_final
+    pos = 1
+    for parameter in command.parameters:
+      if parameter.name == 'addr':
+        addrs[code] = pos
+      pos += parameter.length
+
+  return kinds, lengths, finals, addrs
+
+
+def decode(data, start, stop, tables, classes, follow=False):
+  '''Classify bytes from start up to stop. With follow, stop at first final
+  command and return addr targets met on the way.
+  '''
+  kinds, lengths, finals, addrs = tables
+  end = len(data)
+  targets = []
+  pos = start
+
+  while pos < stop:
+    code = data[pos]
+    kind = kinds[code]
+
+    if kind == OPCODE:
+      length = lengths[code]
+      if pos + length > end:
+        classes[pos:end] = bytes([TRUNCATED]) * (end - pos)
+        break
+      classes[pos] = OPCODE
+      classes[pos + 1:pos + length] = bytes([ARGUMENT]) * (length - 1)
+      if follow:
+        if addrs[code] is not None:
+          targets.append(int.from_bytes(data[pos + addrs[code]:pos + addrs[code] + 2], 'little'))
+        if finals[code]:
+          break
+      pos += length
+
+    elif kind:
+      classes[pos] = kind
+      pos += 1
+
+    else:
+      if follow:
+        classes[pos] = DEAD_END
+        break
+      pos += 1
+
+  return pos, targets
+
+
+def check_chunk(grammar, data, lead_in, size):
+  '''Class array of data[lead_in:lead_in + size], decoding starts at data[0].
+  Data past that is there only for the last command arguments.
+  '''
+  tables = grammar_tables(MappedPrinter(grammar))
+  classes = bytearray(len(data))
+  decode(data, 0, lead_in + size, tables, classes)
+  return bytes(classes[lead_in:lead_in + size])
+
+
+def check_tracks(grammar, data, starts, shift):
+  '''Class array of everything reachable from track starts
+  '''
+  tables = grammar_tables(MappedPrinter(grammar))
+  classes = bytearray(len(data))
+  visited = set()
+  pending = list(starts)
+
+  while pending:
+    start = pending.pop()
+    if start in visited or not 0 <= start < len(data):
+      continue
+    visited.add(start)
+    _pos, targets = decode(data, start, len(data), tables, classes, follow=True)
+    pending.extend(x + shift for x in targets)
+
+  return bytes(classes)
+
+
+def runs(mask):
+  return int(np.count_nonzero(np.diff(mask.astype(np.int8), prepend=0) == 1))
+
+
+def summarize(grammar, data, classes, reached_only=False):
+  codes = np.frombuffer(data, dtype=np.uint8)
+  classes = np.frombuffer(classes, dtype=np.uint8)
+  counts = np.bincount(classes, minlength=CLASS_COUNT)
+
+  # Runs of hex bytes are what printer shows as fallback lines. When only
+  # reachable data was decoded, zero means not reached and each track that
+  # ran into unknown byte is one fallback.
+  if reached_only:
+    total = int(np.count_nonzero(classes))
+    hex_bytes = hex_runs = int(counts[DEAD_END])
+  else:
+    total = len(classes)
+    hex_bytes = int(counts[HEX])
+    hex_runs = runs(classes == HEX)
+
+  used = np.bincount(codes[classes == OPCODE], minlength=256)
+  defined = MappedPrinter(grammar).commands
+  unused = sorted(code for code in defined if not used[code])
+
+  known = counts[OPCODE] + counts[ARGUMENT] + counts[NOTE] + counts[RANGED]
+  return {
+    'grammar': grammar,
+    'coverage': known / max(total, 1),
+    'total': total,
+    'commands': int(counts[OPCODE]),
+    'notes': int(counts[NOTE]),
+    'ranges': int(counts[RANGED]),
+    'hex': hex_bytes,
+    'hex_runs': hex_runs,
+    'truncated': runs(classes == TRUNCATED),
+    'unused': unused,
+    'used': used,
+  }
+
+
+def check(grammars, data, starts=None, shift=0, chunk_size=0x10000, workers=None):
+  '''Decode data with every grammar, returns list of summaries, best first
+  '''
+  results = []
+  with ProcessPoolExecutor(workers) as pool:
+    jobs = {}
+    for grammar in grammars:
+      if starts:
+        jobs[grammar] = [pool.submit(check_tracks, grammar, data, starts, shift)]
+        continue
+      jobs[grammar] = [
+        pool.submit(
+          check_chunk, grammar, data[max(0, pos - LEAD_IN):pos + chunk_size + TAIL],
+          min(pos, LEAD_IN), min(chunk_size, len(data) - pos))
+        for pos in range(0, len(data), chunk_size)]
+
+    for grammar, futures in jobs.items():
+      classes = b''.join(x.result() for x in futures)
+      results.append(summarize(grammar, data, classes, reached_only=bool(starts)))
+
+  results.sort(key=lambda x: x['coverage'], reverse=True)
+  return results
+
+
+def print_results(results, verbose=False):
+  width = max(len(x['grammar']) for x in results)
+  stdout.write(
+    f'{GRAY}{"grammar":{width}s} coverage commands  notes ranges    hex  runs trunc unused{RESET}\n')
+
+  for result in results:
+    stdout.write(
+      f'{result["grammar"]:{width}s} {GOLD}{result["coverage"]:8.1%}{RESET}'
+      f' {result["commands"]:8d} {result["notes"]:6d} {result["ranges"]:6d}'
+      f' {result["hex"]:6d} {result["hex_runs"]:5d} {result["truncated"]:5d}'
+      f' {len(result["unused"]):6d}\n')
+
+    if verbose:
+      stdout.write(
+        f'{GRAY}  unused:{RESET} ' + ' '.join(f'{x:02x}' for x in result['unused']) + '\n')
+      top = np.argsort(result['used'], kind='stable')[::-1][:16]
+      stdout.write(
+        f'{GRAY}  most used:{RESET} '
+        + ' '.join(f'{x:02x}×{result["used"][x]}' for x in top if result['used'][x]) + '\n')
+
+
+def get_parser():
+
+  parser = argparse.ArgumentParser(
+    description='Score how well grammar files decode data segment.')
+
+  parser.add_argument(
+    'filename',
+    type=str,
+    help='Memory file to read from')
+  parser.add_argument(
+    'data_ptr',
+    type=int_autobase,
+    help='Data segment location in file')
+  parser.add_argument(
+    'size',
+    type=int_autobase,
+    help='Data segment size')
+  parser.add_argument(
+    'grammars',
+    type=str,
+    nargs='+',
+    help='Grammar files to compare')
+  parser.add_argument(
+    '-S', '--starts',
+    type=parse_strides,
+    help='Comma separated track starts, decode only what is reachable from them')
+  parser.add_argument(
+    '-e', '--shift',
+    type=int_autobase,
+    default=0,
+    help='Add this to addr parameters to get data offset, same as pointer_logger --shift')
+  parser.add_argument(
+    '-c', '--chunk-size',
+    type=int_autobase,
+    default=0x10000,
+    help='Bytes decoded per job')
+  parser.add_argument(
+    '-j', '--jobs',
+    type=int_autobase,
+    default=cpu_count(),
+    help='Worker processes')
+  parser.add_argument(
+    '-v', '--verbose',
+    action='store_true',
+    help='List unused and most used opcodes')
+
+  return parser
+
+
+def main():
+
+  args = get_parser().parse_args()
+  memory = open_memory(args.filename, args.data_ptr)
+  data = memory[0:args.size]
+  memory.close()
+
+  results = check(args.grammars, data, args.starts, args.shift, args.chunk_size, args.jobs)
+  print_results(results, args.verbose)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env -S python3 -u
+'''Draft grammar from recorded steps.
+Every FWRD step holds exactly the bytes driver consumed in one tick, which
+nearly always ends with something that takes time (note, rest, wait). So:
+
+  - bytes that often make up a whole step on their own are such terminals,
+    contiguous runs of them become note range and ranges;
+  - step minus its trailing terminal starts with an opcode, the shortest
+    common remainder is that opcode's length;
+  - with known lengths steps are split further and the next opcode inside
+    them gets counted the same way, for a few passes;
+  - opcode found at the start of most jumps is final, and if the landing
+    address sits in its bytes, that is its addr parameter.
+
+Everything is histograms over whole trace with NumPy. Result is a draft in
+MappedPrinter grammar format, meant to be edited by hand.
+'''
+
+import argparse
+import json
+from sys import stdout
+
+import numpy as np
+
+from consts import FWRD, FJMP, BJMP
+from trace_store import TraceReader
+from util import int_autobase
+
+
+MAX_LENGTH = 16
+PREFIXES = ['C-', 'C#', 'D-', 'D#', 'E-', 'F-', 'F#', 'G-', 'G#', 'A-', 'A#', 'B-']
+
+
+def load_steps(reader, channel=None):
+  '''Whole trace as NumPy columns: ptrs, diffs, actions, offsets into blob
+  and blob itself
+  '''
+  name = None if channel is None else reader.channels[reader.channel_code(channel)]
+  ptrs, diffs, actions, lengths, blobs = [], [], [], [], []
+
+  for number in range(len(reader.blocks)):
+    _times, channels, b_ptrs, b_diffs, b_actions, b_offsets, blob = reader.block(number)
+    b_offsets = np.frombuffer(b_offsets, dtype=np.int64)
+    b_lengths = np.diff(b_offsets)
+    blob = np.frombuffer(blob, dtype=np.uint8)
+
+    if name is not None:
+      mask = np.frombuffer(channels, dtype=np.uint8) == reader.channels.index(name)
+      keep = np.repeat(mask, b_lengths)
+    else:
+      mask = slice(None)
+      keep = slice(None)
+
+    ptrs.append(np.frombuffer(b_ptrs, dtype=np.int64)[mask])
+    diffs.append(np.frombuffer(b_diffs, dtype=np.int64)[mask])
+    actions.append(np.frombuffer(b_actions, dtype=np.uint8)[mask])
+    lengths.append(b_lengths[mask])
+    blobs.append(blob[keep])
+
+  lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64)
+  return {
+    'ptrs': np.concatenate(ptrs) if ptrs else np.zeros(0, dtype=np.int64),
+    'diffs': np.concatenate(diffs) if diffs else np.zeros(0, dtype=np.int64),
+    'actions': np.concatenate(actions) if actions else np.zeros(0, dtype=np.uint8),
+    'offsets': np.concatenate(([0], np.cumsum(lengths))),
+    'blob': np.concatenate(blobs) if blobs else np.zeros(0, dtype=np.uint8),
+  }
+
+
+def find_terminals(blob, starts, ends, min_share):
+  '''Opcodes that form one byte steps in at least min_share of their uses
+  as step start
+  '''
+  first = blob[starts]
+  single = ends - starts == 1
+  alone = np.bincount(first[single], minlength=256)
+  total = np.bincount(first, minlength=256)
+  return (alone >= min_share * np.maximum(total, 1)) & (alone > 0)
+
+
+def infer_lengths(blob, starts, ends, terminals, min_share, passes=4):
+  '''Length per opcode, 0 where unknown
+  '''
+  lengths = np.where(terminals, 1, 0)
+  histogram = np.zeros((256, MAX_LENGTH + 1), dtype=np.int64)
+  pos, stop = starts, ends
+
+  for _pass in range(passes):
+    valid = pos < stop
+    pos, stop = pos[valid], stop[valid]
+    if not len(pos):
+      break
+
+    codes = blob[pos]
+    # Trailing terminal is not part of the leading command
+    estimate = stop - pos - (terminals[blob[stop - 1]] & (stop - pos > 1)).astype(np.int64)
+    histogram += np.bincount(
+      codes.astype(np.int64) * (MAX_LENGTH + 1) + np.minimum(estimate, MAX_LENGTH),
+      minlength=256 * (MAX_LENGTH + 1)).reshape(256, MAX_LENGTH + 1)
+
+    # Shortest length seen in at least min_share of uses
+    common = histogram >= min_share * np.maximum(histogram.sum(axis=1, keepdims=True), 1)
+    common[:, 0] = False
+    found = common.any(axis=1) & (lengths == 0)
+    lengths[found] = common[found].argmax(axis=1)
+
+    step = lengths[codes]
+    known = step > 0
+    pos, stop = pos[known] + step[known], stop[known]
+
+  return lengths, histogram
+
+
+def find_jumps(steps, shift, min_share=0.75):
+  '''Opcodes starting jump steps, and position of addr parameter if landing
+  address is found in them
+  '''
+  actions, blob, offsets = steps['actions'], steps['blob'], steps['offsets']
+  sizes = np.diff(offsets)
+  jumps = np.flatnonzero(np.isin(actions, (FJMP, BJMP)) & (sizes > 0))
+  forward = np.flatnonzero((actions == FWRD) & (sizes > 0))
+
+  codes = blob[offsets[jumps]]
+  jump_codes = np.bincount(codes, minlength=256)
+  step_codes = np.bincount(blob[offsets[forward]], minlength=256)
+  finals = (jump_codes >= min_share * (jump_codes + step_codes)) & (jump_codes > 0)
+
+  # Look for landing address as LE word anywhere inside the jump preview
+  addrs = np.zeros(256, dtype=np.int64)
+  targets = (steps['ptrs'][jumps] - shift) & 0xffff
+  for pos in range(1, MAX_LENGTH - 1):
+    inside = np.flatnonzero(sizes[jumps] >= pos + 2)
+    if not len(inside):
+      break
+    start = offsets[jumps[inside]] + pos
+    words = blob[start].astype(np.int64) | blob[start + 1].astype(np.int64) << 8
+    hits = np.bincount(codes[inside][words == targets[inside]], minlength=256)
+    addrs[(hits >= min_share * np.maximum(jump_codes, 1)) & (addrs == 0) & (hits > 0)] = pos
+
+  return finals, addrs
+
+
+def runs_of(mask):
+  '''(lo, hi) inclusive runs of True in 256 entry mask
+  '''
+  edges = np.flatnonzero(np.diff(mask.astype(np.int8), prepend=0, append=0))
+  return [(int(lo), int(hi) - 1) for lo, hi in edges.reshape(-1, 2)]
+
+
+def draft_grammar(lengths, terminals, finals, addrs, min_notes=12):
+  '''Grammar dict in MappedPrinter.parse_configuration format
+  '''
+  grammar = {}
+  runs = sorted(runs_of(terminals & ~finals), key=lambda x: x[1] - x[0], reverse=True)
+
+  if runs and runs[0][1] - runs[0][0] + 1 >= min_notes:
+    lo, hi = runs.pop(0)
+    grammar['notes'] = {'lo': f'0x{lo:02x}', 'hi': f'0x{hi:02x}', 'prefixes': PREFIXES}
+
+  grammar['ranges'] = {
+    f'rng{lo:02X}': [f'0x{lo:02x}', f'0x{hi:02x}'] for lo, hi in sorted(runs)}
+
+  in_ranges = np.zeros(256, dtype=bool)
+  for lo, hi in runs_of(terminals & ~finals):
+    in_ranges[lo:hi + 1] = True
+
+  commands = {}
+  for code in range(256):
+    if in_ranges[code] or not (lengths[code] or finals[code]):
+      continue
+    length = max(int(lengths[code]), 1)
+    if addrs[code]:
+      length = max(length, int(addrs[code]) + 2)
+
+    params = []
+    pos = 1
+    while pos < length:
+      if pos == addrs[code]:
+        params.append('addr,wh')
+        pos += 2
+      else:
+        params.append('')
+        pos += 1
+
+    name = f'cmd{code:02X}' + (',e' if finals[code] else '')
+    commands[f'0x{code:02x}'] = [name, *params]
+
+  grammar['commands'] = commands
+  return grammar
+
+
+def format_grammar(grammar):
+  '''JSON laid out like files in grammars/, one command per line
+  '''
+  rows = ['{']
+  if 'notes' in grammar:
+    notes = grammar['notes']
+    rows += [
+      '  "notes": {',
+      f'    "lo": "{notes["lo"]}",',
+      f'    "hi": "{notes["hi"]}",',
+      f'    "prefixes": {json.dumps(notes["prefixes"])}',
+      '  },']
+  rows.append('  "ranges": {')
+  rows += [f'    "{k}": {json.dumps(v)},' for k, v in grammar['ranges'].items()]
+  rows[-1] = rows[-1].rstrip(',')
+  rows += ['  },', '  "commands" : {']
+  rows += [f'    "{k}": {json.dumps(v)},' for k, v in grammar['commands'].items()]
+  rows[-1] = rows[-1].rstrip(',')
+  rows += ['  }', '}']
+  return '\n'.join(rows) + '\n'
+
+
+def infer(steps, shift=0, min_share=0.1, passes=4):
+  blob, offsets = steps['blob'], steps['offsets']
+  forward = np.flatnonzero((steps['actions'] == FWRD) & (np.diff(offsets) > 0))
+  starts, ends = offsets[forward], offsets[forward + 1]
+
+  terminals = find_terminals(blob, starts, ends, 0.5)
+  lengths, histogram = infer_lengths(blob, starts, ends, terminals, min_share, passes)
+  finals, addrs = find_jumps(steps, shift)
+  return draft_grammar(lengths, terminals, finals, addrs), histogram
+
+
+def get_parser():
+
+  parser = argparse.ArgumentParser(
+    description='Infer draft grammar from trace recorded with session.py --record.')
+
+  parser.add_argument(
+    'filename',
+    type=str,
+    help='Trace file')
+  parser.add_argument(
+    '-c', '--channel',
+    type=str,
+    help='Only use steps of this channel, by name or number')
+  parser.add_argument(
+    '-e', '--shift',
+    type=int_autobase,
+    default=0,
+    help='Shift used while recording, to match addr parameters with landing address')
+  parser.add_argument(
+    '-m', '--min-share',
+    type=float,
+    default=0.1,
+    help='Length must be seen in this share of opcode uses to be accepted')
+  parser.add_argument(
+    '-H', '--histogram',
+    action='store_true',
+    help='Print opcode × length histogram before grammar')
+  parser.add_argument(
+    '-o', '--output',
+    type=str,
+    help='Write grammar here instead of stdout')
+
+  return parser
+
+
+def main():
+
+  args = get_parser().parse_args()
+  reader = TraceReader(args.filename)
+  steps = load_steps(reader, args.channel)
+  reader.close()
+
+  grammar, histogram = infer(steps, args.shift, args.min_share)
+
+  if args.histogram:
+    stdout.write('op  ' + ''.join(f'{x:>7d}' for x in range(1, MAX_LENGTH + 1)) + '\n')
+    for code in np.flatnonzero(histogram.sum(axis=1)):
+      stdout.write(f'{code:02x}  ' + ''.join(f'{x:7d}' for x in histogram[code, 1:]) + '\n')
+
+  text = format_grammar(grammar)
+  if args.output:
+    with open(args.output, 'w', encoding='utf-8') as handle:
+      handle.write(text)
+  else:
+    stdout.write(text)
+
+
+if __name__ == '__main__':
+  main()
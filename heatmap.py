@@ -0,0 +1,222 @@
+#!/usr/bin/env -S python3 -u
+'''RAM change heatmap.
+Compares successive snapshots of RAM window and keeps per-byte change counter
+and time of last change. Live view only shows rows that changed at all, which
+quickly narrows down addresses worth feeding into pointer_logger resolvers.
+'''
+
+import argparse
+import time
+from itertools import groupby
+from shutil import get_terminal_size
+from sys import stdout
+from time import sleep
+
+import numpy as np
+
+from cmd_parser import CustomFormatter, parse_addr
+from consts import GRAY, BRED, GOLD, RESET
+from memory_reader import Memory
+from pointer_logger import resolve_address
+from snapshot import open_snapshot
+from util import int_autobase
+
+
+# Change rate ramp, from never to every tick
+RAMP = np.array(list(' .:-=+*#%@'))
+
+
+class Heatmap:
+  '''Per-byte change statistics over a snapshot window
+  '''
+
+  start = None
+  ticks = 0
+  counts = None
+  last_change = None
+  previous = None
+  changed = None
+
+  def __init__(self, start, size):
+    self.start = start
+    self.counts = np.zeros(size, dtype=np.uint32)
+    self.last_change = np.full(size, -np.inf, dtype=np.float32)
+    self.previous = None
+    self.changed = np.zeros(size, dtype=bool)
+
+  def update(self, buffer, now):
+    if self.previous is None:
+      self.previous = buffer.copy()
+      return
+
+    np.not_equal(buffer, self.previous, out=self.changed)
+    self.counts += self.changed
+    self.last_change[self.changed] = now
+    self.previous[:] = buffer
+    self.ticks += 1
+
+  def rates(self):
+    return self.counts / max(self.ticks, 1)
+
+  def hottest(self, amount):
+    order = np.argsort(self.counts, kind='stable')[::-1][:amount]
+    return order[self.counts[order] > 0]
+
+  def render(self, width, height, now, recent=0.5):
+    '''Text rows for rows of window that ever changed, newest changes in red
+    '''
+    size = len(self.counts)
+    rows = -(-size // width)
+    counts = np.zeros(rows * width, dtype=np.uint32)
+    counts[:size] = self.counts
+    active = np.flatnonzero(counts.reshape(rows, width).any(axis=1))[:height]
+
+    rates = np.zeros(rows * width)
+    rates[:size] = self.rates()
+    level = np.ceil(rates * (len(RAMP) - 1)).astype(np.intp)
+    glyphs = RAMP[level]
+
+    hot = np.zeros(rows * width, dtype=bool)
+    hot[:size] = now - self.last_change < recent
+
+    result = []
+    for row in active:
+      cells = slice(row * width, (row + 1) * width)
+      line = ''.join(
+        (BRED if is_hot else GRAY) + ''.join(chars)
+        for is_hot, chars in (
+          (key, [x[1] for x in group])
+          for key, group in groupby(zip(hot[cells], glyphs[cells]), key=lambda x: x[0])))
+      result.append(f'{GOLD}{self.start + row * width:06x}{RESET}│{line}{RESET}')
+
+    return result
+
+  def export(self, filename):
+    if filename.endswith('.csv'):
+      rates = self.rates()
+      with open(filename, 'w', encoding='utf-8') as handle:
+        handle.write('address,changes,rate,last_change\n')
+        for idx in np.flatnonzero(self.counts):
+          handle.write(
+            f'0x{self.start + idx:x},{self.counts[idx]},{rates[idx]:.5f},{self.last_change[idx]:.4f}\n')
+    else:
+      np.savez_compressed(
+        filename, start=self.start, ticks=self.ticks,
+        counts=self.counts, last_change=self.last_change)
+
+
+def get_parser():
+
+  parser = argparse.ArgumentParser(
+    description='Show how often each byte of RAM window changes.',
+    formatter_class=CustomFormatter)
+
+  parser.add_argument(
+    'filename',
+    type=str,
+    help='Memory file to read from, same as for pointer_logger')
+  parser.add_argument(
+    'ram_ptr',
+    type=parse_addr,
+    help='Emulator RAM offset, same format as for pointer_logger')
+  parser.add_argument(
+    '-s', '--start',
+    type=int_autobase,
+    default=0,
+    help='Window start, relative to RAM offset')
+  parser.add_argument(
+    '-n', '--size',
+    type=int_autobase,
+    default=0x10000,
+    help='Window size in bytes')
+  parser.add_argument(
+    '-f', '--frequency',
+    type=int_autobase,
+    default=120,
+    help='Snapshot rate in Hz')
+  parser.add_argument(
+    '-d', '--duration',
+    type=float,
+    help='Stop after this many seconds, runs until interrupted otherwise')
+  parser.add_argument(
+    '-w', '--width',
+    type=int_autobase,
+    default=64,
+    help='Bytes per row in live view')
+  parser.add_argument(
+    '-R', '--redraw',
+    type=float,
+    default=0.25,
+    help='Live view refresh interval in seconds, 0 disables live view')
+  parser.add_argument(
+    '-t', '--top',
+    type=int_autobase,
+    default=16,
+    help='List this many most changing addresses on exit')
+  parser.add_argument(
+    '-D', '--soft-dirty',
+    action='store_true',
+    help='Only re-read pages the target wrote to since last snapshot.\n'
+         'Needs /proc/PID/mem target and kernel with soft-dirty tracking')
+  parser.add_argument(
+    '-o', '--export',
+    type=str,
+    help='Save counters on exit, .csv for text, .npz otherwise')
+
+  return parser
+
+
+def run(heatmap, snapshot, frequency, duration, width, redraw):
+
+  period = 1 / frequency
+  started = next_time = next_draw = time.perf_counter()
+
+  while duration is None or next_time - started < duration:
+    now = time.perf_counter()
+    heatmap.update(snapshot.refresh(), now - started)
+
+    if redraw and now >= next_draw:
+      next_draw = now + redraw
+      term_w, term_h = get_terminal_size()
+      rows = heatmap.render(width, term_h - 1, now - started)
+      stdout.write(
+        '\033[H\033[2J'
+        f'{GRAY}{heatmap.ticks} ticks, {np.count_nonzero(heatmap.counts)} bytes changed'
+        + (f', {snapshot.dirty_pages} dirty pages' if hasattr(snapshot, 'dirty_pages') else '')
+        + f'{RESET}\n'
+        + '\n'.join(rows))
+      stdout.flush()
+
+    next_time += period
+    while time.perf_counter() < next_time:
+      sleep(0)
+
+
+def main():
+
+  args = get_parser().parse_args()
+
+  ram_ptr = resolve_address(*args.ram_ptr, args.filename)
+  memory = Memory(args.filename, ram_ptr)
+  snapshot = open_snapshot(memory, args.start, args.size, args.soft_dirty)
+  heatmap = Heatmap(args.start, args.size)
+
+  try:
+    run(heatmap, snapshot, args.frequency, args.duration, args.width, args.redraw)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    snapshot.close()
+    memory.close()
+
+  rates = heatmap.rates()
+  stdout.write(f'\n{"address":>8s} {"changes":>8s} {"rate":>7s}\n')
+  for idx in heatmap.hottest(args.top):
+    stdout.write(f'{args.start + idx:8x} {heatmap.counts[idx]:8d} {rates[idx]:7.3f}\n')
+
+  if args.export:
+    heatmap.export(args.export)
+
+
+if __name__ == '__main__':
+  main()
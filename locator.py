@@ -0,0 +1,303 @@
+#!/usr/bin/env -S python3 -u
+'''Finds emulated RAM inside emulator process memory.
+Writable mappings from /proc/PID/maps are read in large chunks and searched for
+user-provided byte signature, or filtered by known RAM size. Result is cached
+per emulator binary (path + build ID), so next attach only has to verify it.
+'''
+
+import argparse
+import json
+import os
+import re
+import struct
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from util import int_autobase
+
+
+CACHE_FILE = os.path.join(
+  os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+  'ptr_log', 'ram_base.json')
+
+CHUNK = 0x400000
+
+Mapping = namedtuple('Mapping', 'start end perms offset path')
+
+# Kernel provided mappings, [heap] stays as emulators often malloc their RAM
+SPECIAL = ('[stack', '[vvar', '[vdso', '[vsyscall')
+
+
+def pid_from_filename(filename):
+  '''Extract PID from /proc/PID/mem style file name
+  '''
+  return int(filename.split('/')[2])
+
+
+def read_maps(pid):
+  mappings = []
+  with open(f'/proc/{pid}/maps', 'r', encoding='utf-8', errors='replace') as handle:
+    for line in handle:
+      parts = line.split(maxsplit=5)
+      start, end = (int(x, 16) for x in parts[0].split('-'))
+      path = parts[5].strip() if len(parts) > 5 else ''
+      mappings.append(Mapping(start, end, parts[1], int(parts[2], 16), path))
+  return mappings
+
+
+def build_id(path):
+  '''GNU build ID of ELF file as hex, falls back to size and mtime.
+  Only ELF header, program headers and note segments are read.
+  '''
+  try:
+    handle = open(path, 'rb')
+  except OSError:
+    return ''
+
+  with handle:
+    elf = handle.read(0x40)
+    if elf[:4] == b'\x7fELF' and len(elf) == 0x40:
+      is_64 = elf[4] == 2
+      endian = '<' if elf[5] == 1 else '>'
+      if is_64:
+        phoff, = struct.unpack_from(endian + 'Q', elf, 0x20)
+        phentsize, phnum = struct.unpack_from(endian + 'HH', elf, 0x36)
+      else:
+        phoff, = struct.unpack_from(endian + 'I', elf, 0x1c)
+        phentsize, phnum = struct.unpack_from(endian + 'HH', elf, 0x2a)
+
+      handle.seek(phoff)
+      headers = handle.read(phnum * phentsize)
+
+      for idx in range(len(headers) // phentsize if phentsize else 0):
+        header = idx * phentsize
+        p_type, = struct.unpack_from(endian + 'I', headers, header)
+        if p_type != 4:  # PT_NOTE
+          continue
+        if is_64:
+          offset, = struct.unpack_from(endian + 'Q', headers, header + 8)
+          size, = struct.unpack_from(endian + 'Q', headers, header + 32)
+        else:
+          offset, = struct.unpack_from(endian + 'I', headers, header + 4)
+          size, = struct.unpack_from(endian + 'I', headers, header + 16)
+
+        handle.seek(offset)
+        notes = handle.read(size)
+        pos = 0
+        while pos + 12 <= len(notes):
+          namesz, descsz, n_type = struct.unpack_from(endian + 'III', notes, pos)
+          name_at = pos + 12
+          desc_at = name_at + (namesz + 3 & ~3)
+          if n_type == 3 and notes[name_at:name_at + namesz].rstrip(b'\0') == b'GNU':
+            return notes[desc_at:desc_at + descsz].hex()
+          pos = desc_at + (descsz + 3 & ~3)
+
+  stat = os.stat(path)
+  return f'{stat.st_size:x}-{int(stat.st_mtime):x}'
+
+
+def compile_signature(signature):
+  '''Comma separated hex bytes, ?? matches any byte, e.g. a9,00,??,8d
+  '''
+  pattern = b''.join(
+    b'.' if x == '??' else re.escape(bytes.fromhex(x))
+    for x in signature.split(','))
+  return re.compile(pattern, re.DOTALL), len(signature.split(','))
+
+
+class Locator:
+
+  pid = None
+  pattern = None
+  pattern_size = None
+  signature = None
+  signature_offset = None
+  ram_size = None
+  cache_file = None
+  workers = None
+
+  def __init__(self, pid, signature=None, signature_offset=0, ram_size=None,
+               cache_file=CACHE_FILE, workers=8):
+    self.pid = pid
+    self.signature = signature
+    self.signature_offset = signature_offset
+    self.ram_size = ram_size
+    self.cache_file = cache_file
+    self.workers = workers
+
+    if signature:
+      self.pattern, self.pattern_size = compile_signature(signature)
+
+    if not signature and not ram_size:
+      raise ValueError('Either signature or RAM size is needed to locate RAM')
+
+  def cache_key(self):
+    exe = os.readlink(f'/proc/{self.pid}/exe')
+    return f'{exe}:{build_id(exe)}:{self.signature}:{self.signature_offset}:{self.ram_size}'
+
+  def candidates(self):
+    '''Writable mappings big enough to hold emulated RAM, exactly as big
+    without signature
+    '''
+    result = []
+    for mapping in read_maps(self.pid):
+      if mapping.perms[:2] != 'rw' or mapping.path.startswith(SPECIAL):
+        continue
+      size = mapping.end - mapping.start
+      if self.ram_size and size < self.ram_size:
+        continue
+      if self.pattern is None and size != self.ram_size:
+        continue
+      result.append(mapping)
+
+    # Exact size matches go first, emulators usually allocate RAM separately
+    if self.ram_size:
+      result.sort(key=lambda x: x.end - x.start != self.ram_size)
+    return result
+
+  @staticmethod
+  def describe(mappings, mapping):
+    '''Position of mapping among mappings with same path, permissions and size.
+    Addresses change between runs, this order usually does not.
+    '''
+    same = [
+      x for x in mappings
+      if (x.path, x.perms, x.end - x.start) == (mapping.path, mapping.perms, mapping.end - mapping.start)]
+    return {
+      'path': mapping.path,
+      'perms': mapping.perms,
+      'size': mapping.end - mapping.start,
+      'index': same.index(mapping),
+    }
+
+  def search_chunk(self, handle, start, end):
+    # Chunks overlap by signature length so matches on the edge are not lost
+    stop = min(end, start + CHUNK + self.pattern_size - 1)
+    try:
+      buffer = os.pread(handle, stop - start, start)
+    except OSError:
+      return None
+    match = self.pattern.search(buffer)
+    return start + match.start() if match else None
+
+  def verify(self, base):
+    if self.pattern is None:
+      return True
+
+    handle = os.open(f'/proc/{self.pid}/mem', os.O_RDONLY)
+    try:
+      at = base + self.signature_offset
+      buffer = os.pread(handle, self.pattern_size, at)
+    except OSError:
+      return False
+    finally:
+      os.close(handle)
+    return self.pattern.fullmatch(buffer) is not None
+
+  def scan(self):
+    mappings = self.candidates()
+
+    if self.pattern is None:
+      if not mappings:
+        return None, None
+      # Guess would be cached and reused, better to fail
+      if len(mappings) > 1:
+        raise LookupError(
+          f'{len(mappings)} mappings are 0x{self.ram_size:x} bytes, add --signature to tell them apart')
+      return mappings[0].start, mappings[0]
+
+    handle = os.open(f'/proc/{self.pid}/mem', os.O_RDONLY)
+    try:
+      jobs = [
+        (mapping, start)
+        for mapping in mappings
+        for start in range(mapping.start, mapping.end, CHUNK)]
+
+      pool = ThreadPoolExecutor(self.workers)
+      try:
+        found = pool.map(lambda job: self.search_chunk(handle, job[1], job[0].end), jobs)
+        for (mapping, _start), address in zip(jobs, found):
+          if address is not None:
+            return address - self.signature_offset, mapping
+      finally:
+        # First hit ends the scan, chunks not started yet are dropped
+        pool.shutdown(cancel_futures=True)
+    finally:
+      os.close(handle)
+
+    return None, None
+
+  def load_cache(self):
+    try:
+      with open(self.cache_file, 'r', encoding='utf-8') as handle:
+        return json.load(handle)
+    except (OSError, ValueError):
+      return {}
+
+  def store_cache(self, key, entry):
+    cache = self.load_cache()
+    cache[key] = entry
+    os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+    with open(self.cache_file, 'w', encoding='utf-8') as handle:
+      json.dump(cache, handle, indent=2)
+
+  def locate(self):
+    key = self.cache_key()
+    entry = self.load_cache().get(key)
+
+    # Cached location is relative to mapping, find that mapping again
+    if entry is not None:
+      mappings = read_maps(self.pid)
+      for mapping in mappings:
+        if self.describe(mappings, mapping) == entry['mapping']:
+          base = mapping.start + entry['offset']
+          if self.verify(base):
+            return base
+          break
+
+    base, mapping = self.scan()
+    if base is None:
+      raise LookupError('Could not locate emulated RAM in process memory')
+
+    self.store_cache(key, {
+      'mapping': self.describe(read_maps(self.pid), mapping),
+      'offset': base - mapping.start,
+    })
+    return base
+
+
+def get_parser():
+
+  parser = argparse.ArgumentParser(
+    description='Locate emulated RAM base address in emulator process.')
+
+  parser.add_argument(
+    'pid',
+    type=str,
+    help='Process ID or /proc/PID/mem file name')
+  parser.add_argument(
+    '-S', '--signature',
+    type=str,
+    help='Comma separated hex bytes known to be in RAM, ?? for any byte')
+  parser.add_argument(
+    '-o', '--signature-offset',
+    type=int_autobase,
+    default=0,
+    help='Internal address of signature in emulated RAM')
+  parser.add_argument(
+    '-n', '--ram-size',
+    type=int_autobase,
+    help='Emulated RAM size, used to filter mappings')
+
+  return parser
+
+
+def main():
+  args = get_parser().parse_args()
+  pid = int(args.pid) if args.pid.isdigit() else pid_from_filename(args.pid)
+  locator = Locator(pid, args.signature, args.signature_offset, args.ram_size)
+  print(f'0x{locator.locate():x}')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,91 @@
+'''Loop detection on stream of pointer steps.
+Keeps rolling hash over the last `window` (channel, pointer) steps of all
+channels. Once the same window shows up again the playback has returned to a
+previously seen state, i.e. the tune has looped.
+
+Repeated phrases inside the tune match as well, so loop is reported only
+after matches keep the same length for `confirm` more steps.
+
+Seen windows go into fixed size direct-mapped table (hash, step number,
+time), newer windows simply evict older ones sharing the slot. Cost per step
+is constant and memory is bounded by table size.
+'''
+
+from array import array
+from collections import namedtuple
+
+
+PRIME = (1 << 61) - 1
+BASE = 0x100000001b3
+
+Loop = namedtuple('Loop', 'start end start_time end_time length')
+
+
+class LoopDetector:
+
+  window = None
+  min_length = None
+  mask = None
+  hashes = None
+  steps = None
+  times = None
+  history = None
+  history_times = None
+  value = 0
+  count = 0
+  drop = None
+  confirm = None
+  streak = 0
+  candidate = None
+
+  def __init__(self, window=64, confirm=None, min_length=None, table_bits=16):
+    self.window = window
+    self.confirm = window if confirm is None else confirm
+    # Pattern repeating right away is a repeat inside the tune, not a loop
+    self.min_length = window * 2 if min_length is None else min_length
+    self.mask = (1 << table_bits) - 1
+    self.hashes = array('Q', bytes(8 << table_bits))
+    self.steps = array('q', bytes(8 << table_bits))
+    self.times = array('d', bytes(8 << table_bits))
+    self.history = array('Q', bytes(8 * window))
+    self.history_times = array('d', bytes(8 * window))
+    # Weight of the value leaving the window
+    self.drop = pow(BASE, window, PRIME)
+
+  def update(self, channel, ptr, now=0.0):
+    '''Feed one step. Returns Loop when current window was seen before.
+    Loop start and end refer to the first step of the matched windows.
+    '''
+    pos = self.count % self.window
+    value = (hash((channel, ptr)) & 0xffffffffffff) + 1
+    self.value = (self.value * BASE - self.history[pos] * self.drop + value) % PRIME
+    self.history[pos] = value
+    self.history_times[pos] = now
+    self.count += 1
+
+    # Step that opens current window sits where the next one will be written
+    first_time = self.history_times[self.count % self.window]
+
+    if self.count < self.window:
+      return None
+
+    slot = self.value & self.mask
+    start = self.count - self.window
+
+    if self.hashes[slot] == self.value and start - self.steps[slot] >= self.min_length:
+      length = start - self.steps[slot]
+      if self.candidate is None or self.candidate.length != length:
+        self.candidate = Loop(self.steps[slot], start, self.times[slot], first_time, length)
+        self.streak = 0
+      self.streak += 1
+      if self.streak > self.confirm:
+        return self.candidate
+      return None
+
+    self.candidate = None
+    if self.hashes[slot] != self.value:
+      self.hashes[slot] = self.value
+      self.steps[slot] = start
+      self.times[slot] = first_time
+
+    return None
@@ -69,6 +69,11 @@ class Memory:
   def qword_be(self, address):
     return int.from_bytes(self[address:address+8], 'big')
 
+  def tick(self):
+    '''Called once at the start of every poll, for readers that batch or cache
+    '''
+    pass
+
   def close(self):
     self.handle.close()
 
@@ -126,6 +131,20 @@ class MemoryReadV(Memory):
     return self.buf[:nread]
 
 
+def open_memory(filename, base_offset, share=None):
+  '''Reader for filename, backend is picked by filename pattern: gdb://HOST:PORT
+  and gdb:///PATH go to gdb stub, compressed dumps and frame archives get
+  seekable decompressing reader, see registry.py for adding more.
+  share is reader of the same target opened before, backends that hold
+  a connection open the new window over it.
+  '''
+  if share is not None and hasattr(share, 'window'):
+    return share.window(base_offset)
+
+  from registry import BACKENDS
+  return BACKENDS.for_filename(filename)(filename, base_offset)
+
+
 class Pointer():
   # Shorthands that will be passed into kind argument
   mapping = {
@@ -136,12 +155,15 @@ class Pointer():
     'q': ('qword_le', '{:08x}'), 'Q': ('qword_be', '{:08x}'),
     's': ('segment',  '{:05x}'),
   }
+  # Bytes read by each kind, vword also spans its stride
+  sizes = {'b': 1, 'w': 2, 'W': 2, 'v': 1, 'V': 1, 'd': 4, 'D': 4, 'q': 8, 'Q': 8, 's': 2}
 
   value = None
   partial = None
   reader = None
   address = None
   extra = None
+  size = None
   fmt = '{:x}'
 
   def __init__(self, reader, address_str, *args, default_kind="w", **kwargs):
@@ -167,6 +189,7 @@ class Pointer():
     self.reader = bound
     self.address = address
     self.extra = extra
+    self.size = self.sizes[kind] + sum(extra)
 
   def __invert__(self):
     '''Using ~pointer instead of pointer() will return last read value
@@ -0,0 +1,179 @@
+#!/usr/bin/env -S python3 -u
+'''Reverse pointer index of static data segment.
+Every LE/BE word, and every split lo/hi byte pair STRIDE bytes apart (vword),
+whose value points back into the segment is indexed by that value. Looking up
+jump landing address then lists table entries and commands that may reference
+it, without scanning anything at runtime.
+
+Random bytes point into segment too, so every reference carries number of
+neighbour entries (previous and next table slot) that are valid pointers as
+well. Real pointer tables score high, stray matches score zero.
+
+Building sorts segment positions by byte value once, which is a radix sort.
+Lookup takes positions of the address' low byte and checks high byte where
+each kind and stride would keep it, all at once, so neither build time nor
+memory grows with the number of kinds and strides.
+'''
+
+import argparse
+from collections import namedtuple
+from sys import stdout
+
+import numpy as np
+
+from cmd_parser import parse_strides
+from consts import GRAY, GOLD, RESET
+from memory_reader import open_memory
+from util import int_autobase
+
+
+KINDS = ('w', 'W', 'v', 'V')
+
+Ref = namedtuple('Ref', 'offset kind stride neighbours')
+
+
+class PointerIndex:
+
+  size = None
+  shift = 0
+  buf = None
+  layouts = None
+  positions = None
+  starts = None
+
+  def __init__(self, data, shift=0, kinds='wW', strides=()):
+    buf = np.frombuffer(data, dtype=np.uint8)
+    self.buf = buf
+    self.size = len(buf)
+    self.shift = shift
+
+    # (kind id, stride, where low and high byte are from entry offset, table step)
+    self.layouts = []
+    for kind_id, kind in enumerate(KINDS):
+      if kind not in kinds:
+        continue
+      pairs = [(1, 2)] if kind in 'wW' else [(stride, 1) for stride in strides]
+      for stride, step in pairs:
+        if stride >= self.size:
+          continue
+        if kind.isupper():
+          self.layouts.append((kind_id, stride, stride, 0, step))
+        else:
+          self.layouts.append((kind_id, stride, 0, stride, step))
+
+    # Positions of every byte value, stable sort of bytes is a radix sort
+    self.positions = np.argsort(buf, kind='stable').astype(np.int32)
+    self.starts = np.zeros(257, dtype=np.int64)
+    np.cumsum(np.bincount(buf, minlength=256), out=self.starts[1:])
+
+  def value_at(self, offsets, stride, big_endian):
+    '''Pointer values at offsets for layout, -1 where it runs out of segment
+    '''
+    inside = (offsets >= 0) & (offsets + stride < self.size)
+    first = self.buf[np.where(inside, offsets, 0)].astype(np.int64)
+    second = self.buf[np.where(inside, offsets + stride, 0)].astype(np.int64)
+    values = second << 8 | first if not big_endian else first << 8 | second
+    return np.where(inside, values, -1)
+
+  def lookup(self, target, limit=None):
+    '''References to target, most table-like first
+    '''
+    # Only raw values that land inside segment after shift are pointers
+    value = target - self.shift
+    low_value, high_value = max(0, -self.shift), min(0x10000, self.size - self.shift)
+    if not low_value <= value < high_value:
+      return []
+
+    lows = self.positions[self.starts[value & 0xff]:self.starts[(value & 0xff) + 1]].astype(np.int64)
+
+    refs = []
+    for kind_id, stride, low_at, high_at, step in self.layouts:
+      # Low byte at offset + low_at, high byte has to be at offset + high_at
+      offsets = lows - low_at
+      highs = offsets + high_at
+      ok = (offsets >= 0) & (offsets + stride < self.size)
+      ok[ok] = self.buf[highs[ok]] == value >> 8
+      offsets = offsets[ok]
+
+      neighbours = np.zeros(len(offsets), dtype=np.int64)
+      for side in (-step, step):
+        around = self.value_at(offsets + side, stride, low_at > 0)
+        neighbours += (around >= low_value) & (around < high_value)
+      refs.extend(zip(offsets.tolist(), [kind_id] * len(offsets), [stride] * len(offsets), neighbours.tolist()))
+
+    refs.sort(key=lambda x: -x[3])
+    return [Ref(offset, KINDS[kind_id], stride, count) for offset, kind_id, stride, count in refs[:limit]]
+
+
+def format_refs(refs):
+  '''Short one line description, e.g. 1a2c:w² 0840:v8
+  '''
+  parts = []
+  for ref in refs:
+    stride = ref.stride if ref.kind in 'vV' else ''
+    mark = '²' if ref.neighbours == 2 else '¹' if ref.neighbours == 1 else ''
+    parts.append(f'{ref.offset:04x}:{ref.kind}{stride}{mark}')
+  return ' '.join(parts)
+
+
+def get_parser():
+
+  parser = argparse.ArgumentParser(
+    description='List data segment locations that hold pointers to given addresses.')
+
+  parser.add_argument(
+    'filename',
+    type=str,
+    help='Memory file to read from')
+  parser.add_argument(
+    'data_ptr',
+    type=int_autobase,
+    help='Data segment location in file')
+  parser.add_argument(
+    'size',
+    type=int_autobase,
+    help='Data segment size')
+  parser.add_argument(
+    'targets',
+    type=int_autobase,
+    nargs='+',
+    help='Addresses to look up')
+  parser.add_argument(
+    '-e', '--shift',
+    type=int_autobase,
+    default=0,
+    help='Add this to pointer values, same as pointer_logger --shift')
+  parser.add_argument(
+    '-k', '--kinds',
+    type=str,
+    default='wW',
+    help='Pointer kinds to index: w/W - LE/BE word, v/V - LE/BE vword')
+  parser.add_argument(
+    '-s', '--strides',
+    type=parse_strides,
+    default=[],
+    help='Comma separated vword strides')
+  parser.add_argument(
+    '-n', '--limit',
+    type=int_autobase,
+    default=16,
+    help='Show at most this many references per address')
+
+  return parser
+
+
+def main():
+
+  args = get_parser().parse_args()
+  memory = open_memory(args.filename, args.data_ptr)
+  index = PointerIndex(memory[0:args.size], args.shift, args.kinds, args.strides)
+  memory.close()
+
+  for target in args.targets:
+    stdout.write(f'{GOLD}{target:04x}{RESET} ')
+    stdout.write(format_refs(index.lookup(target, args.limit)) or f'{GRAY}no references{RESET}')
+    stdout.write('\n')
+
+
+if __name__ == '__main__':
+  main()
@@ -8,33 +8,73 @@ The next step from here is to write down this information for later use.
 
 '''
 
+import signal
 import time
 from shutil import get_terminal_size
 from sys import stdout
 from time import sleep
 from traceback import print_exc
 
-from cmd_parser import get_parser, subargs_parser, RESOLVER_MAP, PRINTER_MAP
-from memory_reader import Memory
+from cmd_parser import get_parser, subargs_parser
+from locator import Locator, pid_from_filename
+from memory_reader import open_memory
 from consts import FWRD, BKWD, FJMP, BJMP, REST, PREV, LKUP
 from consts import GRAY, GOLD, RESET
+from prefetch import JumpPrefetcher
+from profiler import Profiler
+from registry import RESOLVERS, PRINTERS
+from triggers import Edge
+
+# numpy backed helpers (coverage, xref, shm ring) are imported only when their
+# option is given, numpy alone takes longer to import than everything else
 
 
 # Main processing loop
 def mainloop(filename, ram_ptr, data_ptr, resolve_method, resolver_settings, shift, jump_threshold,
-             preview, look_behind, frequency, printer):
+             preview, look_behind, frequency, printer, profiler=None, ring=None, coverage=None,
+             xref=None, start_when=None, stop_when=None, mark_when=None, prefetch=None):
 
   # Code block, read every time when resolving pointers
-  code = Memory(filename, ram_ptr)
+  code = open_memory(filename, ram_ptr)
   # Data block, static by default, defaults to code block
-  data = Memory(filename, data_ptr)
+  data = open_memory(filename, data_ptr, code)
+
+  # Hot path callables, swapped for timed versions only when profiling
+  write = stdout.write
+  render = printer
+  if profiler is not None:
+    code = profiler.memory(code)
+    data = profiler.memory(data)
+    write = profiler.wrap('write', write)
+    render = profiler.wrap('render', printer)
+    if hasattr(printer, 'format_vcmds'):
+      profiler.instrument(printer, 'render.decode', 'format_vcmds')
+    if printer.end_patterns:
+      profiler.instrument(printer, 'render.search', 'pattern_search')
 
   # Initialize resolver with our memory readers
   s_args, s_kwargs = subargs_parser(resolver_settings)
-  resolver = RESOLVER_MAP[resolve_method][0](code, *s_args, **s_kwargs)
+  resolver = RESOLVERS[resolve_method](code, *s_args, **s_kwargs)
+  resolve = resolver if profiler is None else profiler.wrap('resolve', resolver)
+
+  if xref is not None:
+    from pointer_index import format_refs
+
+  # Jump steps take pre-decoded result when prefetcher has one for these bytes
+  def render_jump(action, pos, tokens):
+    if prefetch is None or not prefetch.apply(printer, action, pos, tokens):
+      render(action, tokens)
+
+  # Trigger conditions, compiled once against code memory. Output is held
+  # back until start condition is met, stop condition ends the loop.
+  started = start_when is None
+  start = start_when.bind(code) if start_when is not None else None
+  stop = Edge(stop_when.bind(code)) if stop_when is not None else None
+  mark = Edge(mark_when.bind(code)) if mark_when is not None else None
+  triggers = start or stop or mark
 
   # Setup global state
-  ptr = resolver(code, data) + shift
+  ptr = resolve(code, data) + shift
   info = resolver.info
 
   old_ptr = ptr
@@ -48,10 +88,12 @@ def mainloop(filename, ram_ptr, data_ptr, resolve_method, resolver_settings, shi
   next_time = time.perf_counter()
 
   # Print preview line from the current location
-  printer(PREV, data[ptr:ptr + preview])
-  stdout.write(
+  render(PREV, data[ptr:ptr + preview])
+  write(
     f'{GRAY}{info}   **{RESET}│'
     f'{printer.prefix}{printer.result[0]}{printer.suffix}')
+  if prefetch is not None:
+    prefetch.submit(ptr)
 
   while True:
 
@@ -59,10 +101,28 @@ def mainloop(filename, ram_ptr, data_ptr, resolve_method, resolver_settings, shi
     # So, do this now, calling resolver will update printout information.
     old_info = resolver.info
 
+    code.tick()
+    if data is not code:
+      data.tick()
+
     # Calculate new pointer
-    ptr = resolver(code, data) + shift
+    ptr = resolve(code, data) + shift
     info = resolver.info
 
+    if ring is not None:
+      ring.write([code[pos:pos + size] for pos, size in ring.regions])
+
+    if triggers:
+      ptrs = {'ptr': ptr}
+      if not started and start(ptrs):
+        started = True
+        write(f'\033[2K\r{GOLD}── start: {start_when} ──{RESET}\n')
+      if mark is not None and mark(ptrs):
+        write(f'\033[2K\r{GOLD}── mark: {mark_when} ──{RESET}\n')
+      if stop is not None and stop(ptrs):
+        write(f'\033[2K\r{GOLD}── stop: {stop_when} ──{RESET}\n')
+        return
+
     # Wait for period before checking if something changes
     next_time += period
     if old_ptr == ptr:
@@ -70,26 +130,40 @@ def mainloop(filename, ram_ptr, data_ptr, resolve_method, resolver_settings, shi
         sleep(0)
       continue
 
+    if not started:
+      old_ptr = ptr
+      continue
+
     diff = ptr - old_ptr
     jump_detected = diff > jump_threshold or diff < 0
     jmp_dir = FJMP if diff > 0 else BJMP
 
+    if coverage is not None:
+      if jump_detected:
+        # Only the jump command start is known, its length is not
+        coverage.mark(old_ptr, old_ptr + 1)
+        coverage.mark_target(ptr)
+      else:
+        coverage.mark(old_ptr, ptr)
+
     #  Main print routine
     if jump_detected:
-      printer(jmp_dir, data[old_ptr: old_ptr+preview])
+      render_jump(jmp_dir, old_ptr, data[old_ptr: old_ptr+preview])
+      # Look-behind render below replaces it
+      jump_addr = printer.jump_addr
 
     else:
-      printer(FWRD, data[old_ptr: old_ptr+diff])
+      render(FWRD, data[old_ptr: old_ptr+diff])
 
     # Erase current line for the preview
-    stdout.write('\033[2K\r')
+    write('\033[2K\r')
 
     # Print what we have gathered from this pass
     prefix = f'{GOLD}{old_info}{GRAY}{diff:+5x}{RESET}'
     for idx, row in enumerate(printer.result):
       if idx:
         prefix = blanks
-      stdout.write(
+      write(
         f'{prefix}│'
         f'{printer.prefix}{row}{printer.suffix}\n')
 
@@ -99,26 +173,44 @@ def mainloop(filename, ram_ptr, data_ptr, resolve_method, resolver_settings, shi
       if printer.jump_addr is not None \
           and printer.jump_addr - ptr < 0 \
           and ptr - printer.jump_addr < preview:
-        printer(LKUP, data[printer.jump_addr:ptr])
+        render_jump(LKUP, printer.jump_addr, data[printer.jump_addr:ptr])
       else:
-        printer(LKUP, data[ptr - preview:ptr])
+        render_jump(LKUP, ptr - preview, data[ptr - preview:ptr])
       for row in printer.result:
-        stdout.write(
+        write(
           f'{blanks}│'
           f'{printer.prefix}{row}{printer.suffix}\n')
 
+    # If enabled, list data locations that hold pointer to where we landed
+    if jump_detected and xref is not None:
+      refs = format_refs(xref.lookup(ptr, 8))
+      write(f'{blanks}│  {GRAY}refs: {refs or "none"}{RESET}\n')
+
+    if coverage is not None and jump_detected and jump_addr is not None:
+      coverage.mark_target(jump_addr)
+
     # Print preview line from the current location
-    printer(PREV, data[ptr: ptr+preview])
-    stdout.write(
+    if jump_detected:
+      render_jump(PREV, ptr, data[ptr: ptr+preview])
+    else:
+      render(PREV, data[ptr: ptr+preview])
+    write(
       f'{GRAY}{info}   **{RESET}│'
       f'{printer.prefix}{printer.result[0]}{printer.suffix}')
 
+    if prefetch is not None:
+      prefetch.submit(ptr)
+
     old_ptr = ptr
 
-def resolve_address(resolve, addr, width, offset, filename):
+def resolve_address(resolve, addr, width, offset, filename, locator=None):
 
-  if resolve:
-    resolver = Memory(filename, 0)
+  if resolve == 'auto':
+    if locator is None:
+      raise ValueError('auto address needs --signature or --ram-size')
+    ptr = locator.locate()
+  elif resolve:
+    resolver = open_memory(filename, 0)
     if width == 32:
       ptr = resolver.dword_le(addr)
     else:
@@ -127,7 +219,18 @@ def resolve_address(resolve, addr, width, offset, filename):
   else:
     ptr = addr
 
-  return addr + offset
+  return ptr + offset
+
+
+def finish_profile(profiler, filename):
+
+  if profiler is None:
+    return
+
+  stdout.write('\n')
+  profiler.dump()
+  if filename != '-':
+    profiler.export(filename)
 
 
 # Prepare and parse arguments here
@@ -139,11 +242,72 @@ def main():
   # Pre-cook some more complex settings here
   args_dict['data_ptr'] = args.ram_ptr if args.data_ptr is None else args.data_ptr
 
-  args_dict['ram_ptr'] = resolve_address(*args_dict['ram_ptr'], args.filename)
-  args_dict['data_ptr'] = resolve_address(*args_dict['data_ptr'], args.filename)
+  locator = None
+  if args.signature or args.ram_size:
+    locator = Locator(
+      pid_from_filename(args.filename), args.signature, args.signature_offset, args.ram_size)
+
+  args_dict['ram_ptr'] = resolve_address(*args_dict['ram_ptr'], args.filename, locator)
+  args_dict['data_ptr'] = resolve_address(*args_dict['data_ptr'], args.filename, locator)
 
   s_args, s_kwargs = subargs_parser(args.printer_settings)
-  args_dict['printer'] = PRINTER_MAP[args.printer_class][0](*s_args, **s_kwargs)
+  args_dict['printer'] = PRINTERS[args.printer_class](*s_args, **s_kwargs)
+
+  # Profiler is only created on request, SIGUSR1 prints its report on demand
+  profiler = None
+  if args.profile is not None:
+    profiler = Profiler(args.profile_sample)
+    signal.signal(signal.SIGUSR1, profiler.dump)
+  args_dict['profiler'] = profiler
+
+  # Shared memory ring with RAM snapshot of every tick for other processes
+  ring = None
+  if args.shm is not None:
+    from shm_ring import SnapshotRing, record_regions
+    if args.shm_window is not None:
+      regions = [args.shm_window]
+    else:
+      r_args, r_kwargs = subargs_parser(args.resolver_settings)
+      code = open_memory(args.filename, args.ram_ptr)
+      data = open_memory(args.filename, args.data_ptr, code)
+
+      # Resolvers that read from moving addresses say where they can read
+      def probe(reader):
+        resolver = RESOLVERS[args.resolve_method](reader, *r_args, **r_kwargs)
+        resolver(reader, data)
+        return resolver.footprint() if hasattr(resolver, 'footprint') else None
+
+      regions = record_regions(code, probe)
+      code.close()
+      data.close()
+    ring = SnapshotRing(args.shm, regions, args.shm_slots, create=True)
+  args_dict['ring'] = ring
+
+  # Data bytes walked over by pointer, saved and merged into file on exit
+  coverage = None
+  if args.coverage_file is not None:
+    from data_coverage import Coverage
+    coverage = Coverage(args.coverage_size)
+  args_dict['coverage'] = coverage
+
+  # Reverse pointer index of data segment, built once for jump origin lookups
+  xref = None
+  if args.xref is not None:
+    from pointer_index import PointerIndex
+    data = open_memory(args.filename, args.data_ptr)
+    kinds = 'wWvV' if args.xref_strides else 'wW'
+    xref = PointerIndex(data[0:args.xref], args.shift, kinds, args.xref_strides)
+    data.close()
+  args_dict['xref'] = xref
+
+  # Background decoder of upcoming jump targets, with its own printer and reader
+  prefetch = None
+  if args.prefetch:
+    prefetch = JumpPrefetcher(
+      PRINTERS[args.printer_class](*s_args, **s_kwargs),
+      open_memory(args.filename, args.data_ptr),
+      args.preview, args.prefetch).start()
+  args_dict['prefetch'] = prefetch
 
   # Clear screen, disable cursor, disable wrap
   term_w, term_h = get_terminal_size()
@@ -160,19 +324,42 @@ def main():
   # We don't need these anymore
   args_dict.pop('printer_class')
   args_dict.pop('printer_settings')
+  profile_file = args_dict.pop('profile')
+  args_dict.pop('profile_sample')
+  args_dict.pop('signature')
+  args_dict.pop('signature_offset')
+  args_dict.pop('ram_size')
+  args_dict.pop('shm')
+  args_dict.pop('shm_window')
+  args_dict.pop('shm_slots')
+  coverage_file = args_dict.pop('coverage_file')
+  args_dict.pop('coverage_size')
+  args_dict.pop('xref_strides')
   # Start the main loop
   try:
     mainloop(**args_dict)
+    # Stop condition was met
+    stdout.write('\033[?25h\033[?7h')
+    finish_profile(profiler, profile_file)
 
   except KeyboardInterrupt:
     # Show cursor, enable wrapping
     stdout.write('\033[?25h\033[?7h')
+    finish_profile(profiler, profile_file)
     exit(0)
   except Exception:
     # Show cursor, enable wrapping
     stdout.write('\033[?25h\033[?7h')
     print_exc()
+    finish_profile(profiler, profile_file)
     exit(1)
+  finally:
+    if prefetch is not None:
+      prefetch.stop()
+    if ring is not None:
+      ring.close()
+    if coverage is not None:
+      coverage.save(coverage_file)
 
 
 if __name__ == '__main__':
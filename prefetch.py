@@ -0,0 +1,146 @@
+'''Jump target pre-decoding.
+While the pointer sits inside a block, background thread scans ahead of it for
+the first final (`e`) command with `addr` parameter, then decodes everything
+the logger is going to print when that jump happens: the jump step itself,
+look-behind before the target and preview at the target. When the jump comes,
+the logger only compares bytes it read with the ones that were decoded and
+takes ready result instead of running the grammar.
+
+Thread has its own printer and memory reader, so nothing is shared with the
+polling loop except the result cache.
+'''
+
+import threading
+from collections import OrderedDict
+
+from consts import FJMP, BJMP, PREV, LKUP
+
+
+def find_jump(commands, tokens):
+  '''Offset and target of the first final command with addr parameter, walking
+  commands the same way printer does. None if there is none in tokens.
+  '''
+  pos = 0
+  while pos < len(tokens):
+    command = commands.get(tokens[pos])
+    if command is None:
+      pos += 1
+      continue
+
+    if command.is_final:
+      offset = pos + 1
+      for parameter in command.parameters:
+        if parameter.name == 'addr':
+          raw = tokens[offset:offset + parameter.length]
+          if len(raw) < parameter.length:
+            return None
+          return pos, int.from_bytes(raw, 'little')
+        offset += parameter.length
+      return None
+
+    pos += command.length
+  return None
+
+
+class JumpPrefetcher:
+
+  printer = None
+  data = None
+  commands = None
+  preview = None
+  scan = None
+  cache = None
+  cache_size = None
+  lock = None
+  pending = None
+  wake = None
+  thread = None
+  running = False
+  hits = 0
+  misses = 0
+
+  def __init__(self, printer, data, preview, scan=0x40, cache_size=256):
+    '''printer and data are private copies for background thread,
+    printer needs grammar (map printer)
+    '''
+    self.printer = printer
+    self.data = data
+    self.commands = getattr(printer, 'commands', None) or {}
+    self.preview = preview
+    self.scan = scan
+    self.cache = OrderedDict()
+    self.cache_size = cache_size
+    self.lock = threading.Lock()
+    self.wake = threading.Event()
+
+  def start(self):
+    self.running = True
+    self.thread = threading.Thread(target=self.work, name='prefetch', daemon=True)
+    self.thread.start()
+    return self
+
+  def stop(self):
+    self.running = False
+    self.wake.set()
+    if self.thread is not None:
+      self.thread.join()
+    self.data.close()
+
+  def submit(self, ptr):
+    '''Pointer moved, only the latest position is worth looking ahead from
+    '''
+    self.pending = ptr
+    self.wake.set()
+
+  def apply(self, printer, action, pos, tokens):
+    '''Put pre-decoded result into printer if there is one for exactly these
+    bytes, return False when printer has to decode them itself
+    '''
+    with self.lock:
+      entry = self.cache.get((action, pos))
+      if entry is None or entry[0] != tokens:
+        self.misses += 1
+        return False
+      self.cache.move_to_end((action, pos))
+
+    _tokens, printer.result, printer.prefix, printer.suffix, printer.jump_addr = entry
+    printer.action = action
+    self.hits += 1
+    return True
+
+  def decode(self, action, pos, size):
+    if pos < 0:
+      return
+
+    # Sequence data in RAM can change under the same address, decode again then
+    tokens = bytes(self.data[pos:pos + size])
+    entry = self.cache.get((action, pos))
+    if entry is not None and entry[0] == tokens:
+      return
+
+    printer = self.printer
+    printer(action, tokens)
+    with self.lock:
+      self.cache[(action, pos)] = (
+        tokens, list(printer.result), printer.prefix, printer.suffix, printer.jump_addr)
+      self.cache.move_to_end((action, pos))
+      if len(self.cache) > self.cache_size:
+        self.cache.popitem(last=False)
+
+  def work(self):
+    while True:
+      self.wake.wait()
+      self.wake.clear()
+      if not self.running:
+        break
+
+      ptr = self.pending
+      found = find_jump(self.commands, self.data[ptr:ptr + self.scan])
+      if found is None:
+        continue
+      _offset, target = found
+
+      # Jump step is decoded from wherever the pointer was before jumping
+      self.decode(FJMP if target > ptr else BJMP, ptr, self.preview)
+      self.decode(LKUP, target - self.preview, self.preview)
+      self.decode(PREV, target, self.preview)
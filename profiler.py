@@ -0,0 +1,224 @@
+'''Opt-in timing of the polling loop stages.
+Nothing in here is touched unless profiling was requested: callers swap their
+callables for timed wrappers once at startup, so the disabled path keeps
+calling the original objects directly.
+
+Stages are timed with perf_counter_ns. Every call updates plain counters, every
+N-th call also lands in log2 histogram and in bounded event list, which is
+what gets exported as Chrome trace or speedscope file.
+'''
+
+import json
+import sys
+import time
+from collections import deque
+
+
+# Memory accessors that resolvers and Pointer objects bind to
+READERS = (
+  'byte', 'word_le', 'word_be', 'vword_le', 'vword_be', 'segment',
+  'dword_le', 'dword_be', 'qword_le', 'qword_be',
+)
+
+
+class Stage:
+  '''Counters for one named stage, histogram bucket N holds samples
+  shorter than 2**N nanoseconds.
+  '''
+
+  __slots__ = ('name', 'count', 'total', 'low', 'high', 'samples', 'histogram')
+
+  def __init__(self, name):
+    self.name = name
+    self.count = 0
+    self.total = 0
+    self.low = None
+    self.high = 0
+    self.samples = 0
+    self.histogram = [0] * 64
+
+  def percentile(self, fraction):
+    '''Upper bound of the bucket holding requested fraction of samples.
+    '''
+    if not self.samples:
+      return 0
+
+    wanted = self.samples * fraction
+    seen = 0
+    for bucket, amount in enumerate(self.histogram):
+      seen += amount
+      if seen >= wanted:
+        return min(1 << bucket, self.high)
+
+    return self.high
+
+
+class TimedMemory:
+  '''Stand-in for Memory object that times every access.
+  Anything not explicitly wrapped is forwarded to the original reader.
+  '''
+
+  def __init__(self, memory, getitem):
+    self._memory = memory
+    self._getitem = getitem
+
+  def __getitem__(self, index):
+    return self._getitem(index)
+
+  def __getattr__(self, name):
+    return getattr(self._memory, name)
+
+
+class Profiler:
+
+  stages = None
+  events = None
+  sample_every = None
+  origin = None
+
+  def __init__(self, sample_every=16, event_limit=200000):
+    self.stages = {}
+    self.events = deque(maxlen=event_limit)
+    self.sample_every = max(1, sample_every)
+    self.origin = time.perf_counter_ns()
+
+  def stage(self, name):
+    if name not in self.stages:
+      self.stages[name] = Stage(name)
+    return self.stages[name]
+
+  def wrap(self, name, func):
+    '''Return callable that behaves as func but accounts its run time to stage
+    '''
+    stage = self.stage(name)
+    events = self.events
+    every = self.sample_every
+    clock = time.perf_counter_ns
+
+    def timed(*args, **kwargs):
+      start = clock()
+      try:
+        return func(*args, **kwargs)
+      finally:
+        elapsed = clock() - start
+        stage.count += 1
+        stage.total += elapsed
+        if elapsed > stage.high: stage.high = elapsed
+        if stage.low is None or elapsed < stage.low: stage.low = elapsed
+
+        # Sampled part, only every N-th call pays for this
+        if not stage.count % every:
+          stage.samples += 1
+          stage.histogram[min(elapsed.bit_length(), 63)] += 1
+          events.append((name, start, elapsed))
+
+    return timed
+
+  def instrument(self, obj, name, *attrs):
+    '''Replace bound methods on object instance with timed versions
+    '''
+    for attr in attrs:
+      setattr(obj, attr, self.wrap(name, getattr(obj, attr)))
+    return obj
+
+  def memory(self, memory, name='read'):
+    '''Wrap Memory reader so both slicing and typed reads are timed.
+    Must be done before the reader is handed over to resolvers, as Pointer
+    objects bind reader methods at construction time.
+    '''
+    proxy = TimedMemory(memory, self.wrap(name, memory.__getitem__))
+    for attr in READERS:
+      if hasattr(memory, attr):
+        setattr(proxy, attr, self.wrap(name, getattr(memory, attr)))
+    return proxy
+
+  def report(self):
+    rows = [
+      '{:<14s}{:>10s}{:>12s}{:>10s}{:>10s}{:>10s}{:>10s}'.format(
+        'stage', 'calls', 'total ms', 'mean µs', 'p50 µs', 'p99 µs', 'max µs')]
+
+    for stage in sorted(self.stages.values(), key=lambda x: -x.total):
+      if not stage.count:
+        continue
+      rows.append(
+        '{:<14s}{:>10d}{:>12.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}'.format(
+          stage.name,
+          stage.count,
+          stage.total / 1e6,
+          stage.total / stage.count / 1e3,
+          stage.percentile(0.5) / 1e3,
+          stage.percentile(0.99) / 1e3,
+          stage.high / 1e3))
+
+    return '\n'.join(rows)
+
+  def dump(self, *_args, stream=None):
+    '''Print current report, signature allows using this as signal handler
+    '''
+    stream = stream or sys.stderr
+    stream.write(self.report() + '\n')
+    stream.flush()
+
+  def chrome_trace(self):
+    return {
+      'displayTimeUnit': 'ns',
+      'traceEvents': [
+        {
+          'name': name,
+          'cat': name.split('.')[0],
+          'ph': 'X',
+          'ts': (start - self.origin) / 1e3,
+          'dur': elapsed / 1e3,
+          'pid': 1,
+          'tid': 1,
+        }
+        for name, start, elapsed in self.events],
+    }
+
+  def speedscope(self):
+    frames = {}
+    opened = []
+    result = []
+
+    # Stages run on a single thread, so intervals are either nested or disjoint.
+    # Sorting by start and longest first yields parents before their children.
+    for name, start, elapsed in sorted(self.events, key=lambda x: (x[1], -x[2])):
+      start -= self.origin
+      while opened and opened[-1][1] <= start:
+        frame, end = opened.pop()
+        result.append({'type': 'C', 'frame': frame, 'at': end})
+
+      frame = frames.setdefault(name, len(frames))
+      opened.append((frame, start + elapsed))
+      result.append({'type': 'O', 'frame': frame, 'at': start})
+
+    while opened:
+      frame, end = opened.pop()
+      result.append({'type': 'C', 'frame': frame, 'at': end})
+
+    return {
+      '$schema': 'https://www.speedscope.app/file-format-schema.json',
+      'shared': {'frames': [{'name': name} for name in frames]},
+      'profiles': [{
+        'type': 'evented',
+        'name': 'pointer_logger',
+        'unit': 'nanoseconds',
+        'startValue': result[0]['at'] if result else 0,
+        'endValue': result[-1]['at'] if result else 0,
+        'events': result,
+      }],
+    }
+
+  def export(self, filename):
+    '''Write collected data, format is picked by file name:
+    *.speedscope.json - speedscope, *.json - Chrome trace, text report otherwise
+    '''
+    if filename.endswith('.speedscope.json'):
+      payload = json.dumps(self.speedscope())
+    elif filename.endswith('.json'):
+      payload = json.dumps(self.chrome_trace())
+    else:
+      payload = self.report() + '\n'
+
+    with open(filename, 'w', encoding='utf-8') as handle:
+      handle.write(payload)
@@ -0,0 +1,276 @@
+'''Registry of resolvers, printers and memory backends.
+Entries are "module:Class" strings with help text, the module is imported only
+when its entry is actually used, so startup doesn't pay for every driver
+specific class there is.
+
+Besides built-ins below, entries come from:
+  - entry points of installed packages, groups ptr_log.resolvers,
+    ptr_log.printers and ptr_log.backends, NAME = module:Class. Backend
+    classes list their filename patterns in `patterns` class attribute.
+  - .py files in plugin directories: $PTR_LOG_PLUGINS (path list),
+    ~/.config/ptr_log/plugins and plugins/ next to this file. Files are only
+    parsed, not imported, looking for module level dicts of names to classes:
+
+      RESOLVERS = {'mydriver': 'MyDriverResolver'}
+      PRINTERS = {'mydriver': 'MyDriverPrinter'}
+      BACKENDS = {'myemu': ('MyEmuMemory', 'myemu://*')}
+
+    Class docstring is the help text, backends also give filename patterns.
+
+Later sources override earlier ones with the same name. Scanning installed
+packages takes longer than importing all built-ins, so what was found is
+cached until any sys.path directory or plugin file changes.
+'''
+
+import importlib
+import json
+import os
+import sys
+from collections import namedtuple
+from collections.abc import Mapping
+from fnmatch import fnmatch
+
+
+Entry = namedtuple('Entry', 'target help patterns')
+
+GROUPS = ('resolvers', 'printers', 'backends')
+
+CACHE_FILE = os.path.join(
+  os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+  'ptr_log', 'plugins.json')
+
+PLUGIN_DIRS = [
+  *os.environ.get('PTR_LOG_PLUGINS', '').split(os.pathsep),
+  os.path.join(
+    os.environ.get('XDG_CONFIG_HOME', os.path.expanduser('~/.config')), 'ptr_log', 'plugins'),
+  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plugins'),
+]
+
+
+def load_target(target):
+  '''Import "module:Class" or "/path/to/file.py:Class"
+  '''
+  module_name, _sep, attr = target.rpartition(':')
+
+  if module_name.endswith('.py'):
+    from importlib.util import module_from_spec, spec_from_file_location
+    name = 'ptr_log_plugin_' + os.path.splitext(os.path.basename(module_name))[0]
+    module = sys.modules.get(name)
+    if module is None:
+      spec = spec_from_file_location(name, module_name)
+      module = module_from_spec(spec)
+      sys.modules[name] = module
+      spec.loader.exec_module(module)
+  else:
+    module = importlib.import_module(module_name)
+
+  return getattr(module, attr)
+
+
+def scan_plugin(path, variable):
+  '''Entries a plugin file declares in variable, read with ast
+  '''
+  import ast
+  with open(path, 'r', encoding='utf-8') as handle:
+    tree = ast.parse(handle.read(), path)
+
+  docs = {
+    node.name: ast.get_docstring(node) or ''
+    for node in tree.body if isinstance(node, ast.ClassDef)}
+
+  result = {}
+  for node in tree.body:
+    if not isinstance(node, ast.Assign):
+      continue
+    if not any(isinstance(x, ast.Name) and x.id == variable for x in node.targets):
+      continue
+
+    for name, value in ast.literal_eval(node.value).items():
+      cls, *patterns = (value,) if isinstance(value, str) else value
+      result[name] = Entry(f'{path}:{cls}', ' ' + docs.get(cls, path).strip(), tuple(patterns))
+
+  return result
+
+
+def plugin_files():
+  for directory in PLUGIN_DIRS:
+    if directory and os.path.isdir(directory):
+      for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.py'):
+          yield os.path.join(directory, filename)
+
+
+def discover_all():
+  '''Group -> name -> Entry from entry points and plugin files, cached
+  '''
+  files = list(plugin_files())
+  key = [[x, os.stat(x).st_mtime_ns] for x in [*sys.path, *files] if x and os.path.exists(x)]
+
+  try:
+    with open(CACHE_FILE, 'r', encoding='utf-8') as handle:
+      cached = json.load(handle)
+    if cached['key'] == key:
+      return {
+        group: {name: Entry(target, help, tuple(patterns)) for name, (target, help, patterns) in entries.items()}
+        for group, entries in cached['groups'].items()}
+  except (OSError, ValueError, KeyError):
+    pass
+
+  from importlib.metadata import entry_points
+  groups = {}
+  for group in GROUPS:
+    found = {}
+    for point in entry_points(group=f'ptr_log.{group}'):
+      # Backend can't be picked without its patterns, so it is loaded here,
+      # which the cache makes a one-off
+      patterns = tuple(getattr(load_target(point.value), 'patterns', ())) if group == 'backends' else ()
+      found[point.name] = Entry(point.value, f' From {point.value}', patterns)
+    for path in files:
+      found.update(scan_plugin(path, group.upper()))
+    groups[group] = found
+
+  # Cache is only a speedup, read-only home is fine
+  try:
+    os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+    with open(CACHE_FILE, 'w', encoding='utf-8') as handle:
+      json.dump({'key': key, 'groups': groups}, handle)
+  except OSError:
+    pass
+
+  return groups
+
+
+class Registry(Mapping):
+  '''Name -> class mapping that imports classes on first lookup
+  '''
+
+  group = None
+  entries = None
+  loaded = None
+  discovered = False
+
+  def __init__(self, group, builtin):
+    self.group = group
+    self.entries = {}
+    self.loaded = {}
+    for name, value in builtin.items():
+      self.register(name, *value)
+
+  def register(self, name, target, help='', patterns=()):
+    self.entries[name] = Entry(target, help, tuple(patterns))
+    self.loaded.pop(name, None)
+
+  def discover(self):
+    if self.discovered:
+      return
+    self.discovered = True
+    for name, entry in discover_all()[self.group].items():
+      self.register(name, *entry)
+
+  def __getitem__(self, name):
+    if name not in self.loaded:
+      if name not in self.entries:
+        self.discover()
+      if name not in self.entries:
+        raise KeyError(f'Unknown {self.group[:-1]} {name}')
+      self.loaded[name] = load_target(self.entries[name].target)
+    return self.loaded[name]
+
+  def __contains__(self, name):
+    if name not in self.entries:
+      self.discover()
+    return name in self.entries
+
+  def __iter__(self):
+    self.discover()
+    return iter(self.entries)
+
+  def __len__(self):
+    self.discover()
+    return len(self.entries)
+
+  def help(self, name):
+    return self.entries[name].help
+
+  def describe(self):
+    '''Help text of every entry, without importing any of them
+    '''
+    return '\n'.join(f'{name}: {self.entries[name].help}' for name in self)
+
+  def for_filename(self, filename):
+    '''Backend whose pattern matches filename with or without query part,
+    the latest registered wins
+    '''
+    self.discover()
+    path = filename.split('?')[0]
+    for name in reversed(self.entries):
+      if any(fnmatch(path, x) or fnmatch(filename, x) for x in self.entries[name].patterns):
+        return self[name]
+    raise KeyError(f'No {self.group[:-1]} for {filename}')
+
+
+RESOLVERS = Registry('resolvers', {
+  'ptr': (
+    'resolvers:PointerResolver',
+    'Read single pointer, optionally add offset it by index.\n'
+    '    Format: POINTER[:INDEX][:FLAGS], e.g. 0xfc,v,5:0xfe\n'
+    '    Flags: m - Combine offset and pointer address in output\n'
+    '    Defaults: pointer: w , index: b\n'),
+
+  'table': (
+    'resolvers:TableResolver',
+    'Get the data pointer from lookup table, \n'
+    '  index in this table and offset inside that data index.\n'
+    '  Table is assumed to contain WORD LE pointers.\n'
+    '    Format: TABLE_POINTER:TABLE_INDEX:OFFSET_POINTER[:FLAGS]\n'
+    '    Flags: w - Index is word, W - Offset is word, d - Index is pointer\n'
+    '           o - Print final offset\n'
+    '    Example: 0x66ec:0xef:0xf3:d will read data for CH1 of Outrun Europa.\n'),
+
+  'order': (
+    'resolvers:OrderTableResolver',
+    'Get the data pointer from order lookup table, data lookup table, \n'
+    '  index in this table and offset inside that data index.\n'
+    '  Table is assumed to contain WORD LE pointers.\n'
+    '    Format: ORDER_TABLE:DATA_TABLE:ORDER_INDEX:OFFSET_POINTER[:FLAGS]\n'
+    '    Flags: W - Offset is word, o - Print final offset in info\n'),
+
+  'stack': (
+    'resolvers:StackResolver',
+    'Read data inside stack pointer that is offset by stack depth\n'
+    '    Format: STACK:DEPTH[:FLAGS][:SHIFT][:LOW:HIGH], e.g. 0x5ba:0x528::1\n'
+    '    Defaults: stack: w , depth: b\n'
+    '    Flags: n - substract depth value instead of adding\n'
+    '    SHIFT: Offset pointer by this many bytes. Useful when reference\n'
+    '           points at loop counter followed by pointer\n'
+    '    LOW/HIGH: Shift only if discovered pointer is outside this region\n'),
+})
+
+PRINTERS = Registry('printers', {
+  'hex': (
+    'printers:HexPrinter',
+    ' Generic hex dump printer, uses global arguments'),
+  'bar': (
+    'printers:BarPrinter',
+    ' Hex printer extension, plots values below 0x20 as a bar'),
+  'line': (
+    'printers:LinePrinter',
+    'Hex printer extension, plots both positive and negative values'),
+  'map': (
+    'printers:MappedPrinter',
+    ' Prints parsed commands from definition file, falls back to hex\n'),
+})
+
+# Plain file is the fallback, so it goes first: later entries are tried first
+BACKENDS = Registry('backends', {
+  'file': (
+    'memory_reader:Memory',
+    'Plain file, /proc/PID/mem or mmap', ('*',)),
+  'gdb': (
+    'gdb_memory:GdbMemory',
+    'GDB remote protocol stub', ('gdb://*',)),
+  'compressed': (
+    'compressed_memory:CompressedMemory',
+    'Compressed dump or frame archive',
+    ('*.gz', '*.xz', '*.lzma', '*.bz2', '*.npz', '*[?&]frame=*')),
+})
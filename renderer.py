@@ -0,0 +1,255 @@
+'''Full screen view for sessions: one pane per channel and a shared timeline.
+Every repaint composes the screen into a grid of cells (character and color),
+compares it with what terminal already shows and writes only cells that
+differ. Cost of a repaint depends on how much changed rather than on screen
+size, and repaints are capped at fps no matter how fast channels are polled,
+steps in between only update pane contents.
+'''
+
+import re
+from collections import deque
+from shutil import get_terminal_size
+from sys import stdout
+
+from consts import GRAY, GOLD, BBLUE, BRED, RESET, FWRD
+
+
+SGR = re.compile(r'\033\[([0-9;]*)m')
+BLANK = (' ', '')
+BARS = ' ▁▂▃▄▅▆▇█'
+
+# Narrowest pane before channels are stacked into more rows
+PANE_WIDTH = 40
+
+
+def parse_cells(text, style=''):
+  '''Split colored text into (character, color) cells. Printers only use single
+  color codes followed by reset, so last code seen is the whole style.
+  '''
+  cells = []
+  pos = 0
+  for match in SGR.finditer(text):
+    cells.extend((char, style) for char in text[pos:match.start()])
+    style = '' if match.group(1) in ('', '0') else match.group(0)
+    pos = match.end()
+  cells.extend((char, style) for char in text[pos:])
+  return cells
+
+
+class Screen:
+  '''Cell grid and copy of what terminal currently displays
+  '''
+
+  width = None
+  height = None
+  cells = None
+  shown = None
+
+  def __init__(self, width, height):
+    self.width = width
+    self.height = height
+    self.shown = [[None] * width for _ in range(height)]
+    self.clear()
+
+  def clear(self):
+    self.cells = [[BLANK] * self.width for _ in range(self.height)]
+
+  def put(self, row, col, text, width, style=''):
+    '''Draw text at position, clipped to width and padded with blanks
+    '''
+    self.put_cells(row, col, parse_cells(text, style), width)
+
+  def put_cells(self, row, col, cells, width):
+    if not 0 <= row < self.height:
+      return
+    width = min(width, self.width - col)
+    cells = cells[:width]
+    if len(cells) < width:
+      cells += [BLANK] * (width - len(cells))
+    self.cells[row][col:col + width] = cells
+
+  def diff(self):
+    '''Escape sequence turning shown screen into composed one
+    '''
+    out = []
+    style = None
+    for row_idx, (row, shown) in enumerate(zip(self.cells, self.shown)):
+      if row == shown:
+        continue
+
+      cursor = None
+      for col, cell in enumerate(row):
+        if cell == shown[col]:
+          continue
+        if cursor != col:
+          out.append(f'\033[{row_idx + 1};{col + 1}H')
+        if cell[1] != style:
+          style = cell[1]
+          out.append(RESET + style)
+        out.append(cell[0])
+        cursor = col + 1
+
+      self.shown[row_idx] = row[:]
+
+    if out:
+      out.append(RESET)
+    return ''.join(out)
+
+
+class Pane:
+  '''Scrolling output of one channel, lines are kept already split into cells
+  '''
+
+  name = None
+  ptr = None
+  steps = 0
+  jumps = 0
+  lines = None
+
+  def __init__(self, name, keep=256):
+    self.name = str(name)
+    self.lines = deque(maxlen=keep)
+
+  def add(self, event):
+    self.ptr = event.ptr
+    self.steps += 1
+    self.jumps += event.action != FWRD
+    prefix = f'{GOLD}{event.info}{GRAY}{event.diff:+5x}{RESET}'
+    blanks = ' ' * (len(event.info) + 5)
+    for idx, row in enumerate(event.lines or ('',)):
+      self.lines.append(parse_cells(f'{blanks if idx else prefix}│{event.prefix or ""}{row}{event.suffix or ""}'))
+
+  def title(self):
+    ptr = '----' if self.ptr is None else f'{self.ptr:04x}'
+    return f'{BBLUE}{self.name}{GRAY} @{GOLD}{ptr}{GRAY} {self.steps} steps, {self.jumps} jumps'
+
+
+class Timeline:
+  '''Activity of all channels over the last span seconds, one column per slice:
+  bar height is how many channels stepped, red when any of them jumped.
+  Steps are merged into fine time slots as they come, so repaint cost does
+  not grow with poll rate.
+  '''
+
+  span = None
+  slot = None
+  bits = None
+  slots = None
+
+  def __init__(self, span, names, resolution=1024):
+    self.span = span
+    self.slot = span / resolution
+    self.bits = {name: 1 << idx for idx, name in enumerate(names)}
+    # [slot number, mask of channels that moved, any jump]
+    self.slots = deque()
+
+  def add(self, event):
+    number = int(event.time / self.slot)
+    if not self.slots or self.slots[-1][0] != number:
+      self.slots.append([number, 0, False])
+    entry = self.slots[-1]
+    entry[1] |= self.bits[str(event.channel)]
+    entry[2] |= event.action != FWRD
+
+  def render(self, width, now):
+    start = now - self.span
+    while self.slots and self.slots[0][0] * self.slot < start:
+      self.slots.popleft()
+
+    masks = [0] * width
+    jumped = [False] * width
+    scale = self.slot * width / self.span
+    for number, mask, jump in self.slots:
+      col = min(int(number * scale - start * width / self.span), width - 1)
+      masks[col] |= mask
+      jumped[col] |= jump
+
+    top = len(BARS) - 1
+    count = max(len(self.bits), 1)
+    result = []
+    for mask, jump in zip(masks, jumped):
+      level = -(-mask.bit_count() * top // count)
+      result.append((BRED if jump else GRAY) + BARS[level])
+    return ''.join(result) + RESET
+
+
+class PaneRenderer:
+  '''Session view, feed it events with update() and call draw() every poll
+  '''
+
+  panes = None
+  timeline = None
+  screen = None
+  period = None
+  next_draw = 0
+  status = ''
+
+  def __init__(self, channels, fps=30, span=4.0):
+    self.panes = {str(x.name): Pane(x.name) for x in channels}
+    self.timeline = Timeline(span, self.panes)
+    self.period = 1 / fps
+
+  def update(self, event):
+    self.panes[str(event.channel)].add(event)
+    self.timeline.add(event)
+
+  def mark(self, text):
+    self.status = text
+
+  def invalidate(self):
+    '''Terminal was drawn over, next draw repaints everything
+    '''
+    self.screen = None
+    self.next_draw = 0
+
+  def start(self):
+    # Alternate screen, no cursor, no wrap
+    stdout.write('\033[?1049h\033[?25l\033[?7l')
+
+  def stop(self):
+    stdout.write('\033[?7h\033[?25h\033[?1049l')
+    stdout.flush()
+
+  def compose(self, now):
+    screen = self.screen
+    screen.clear()
+    width, height = screen.width, screen.height
+
+    panes = list(self.panes.values())
+    columns = max(1, min(len(panes), width // PANE_WIDTH))
+    rows = -(-len(panes) // columns)
+    pane_w = width // columns
+    pane_h = max(2, (height - 2) // rows)
+
+    for idx, pane in enumerate(panes):
+      top = idx // columns * pane_h
+      left = idx % columns * pane_w
+      # Last column takes the remainder, others get a separator
+      inner = width - left if idx % columns == columns - 1 else pane_w - 1
+      screen.put(top, left, pane.title(), inner)
+      body = list(pane.lines)[-(pane_h - 1):]
+      for line_idx, line in enumerate(body):
+        screen.put_cells(top + 1 + line_idx, left, line, inner)
+      if inner < width - left:
+        for row in range(top, top + pane_h):
+          screen.put(row, left + inner, '│', 1, GRAY)
+
+    label = f'{now:8.2f}s '
+    screen.put(height - 2, 0, label + self.timeline.render(width - len(label), now), width, GRAY)
+    screen.put(height - 1, 0, self.status, width, GOLD)
+
+  def draw(self, now, force=False):
+    '''Repaint changed cells, at most once per period unless forced
+    '''
+    if not force and now < self.next_draw:
+      return
+    self.next_draw = now + self.period
+
+    width, height = get_terminal_size()
+    if self.screen is None or (self.screen.width, self.screen.height) != (width, height):
+      self.screen = Screen(width, height)
+      stdout.write('\033[2J')
+
+    self.compose(now)
+    stdout.write(self.screen.diff())
+    stdout.flush()
@@ -77,6 +77,16 @@ class StackResolver:
 
     return ptr
 
+  def footprint(self):
+    '''(address, size) of RAM ranges read at any depth, address of stack
+    entry moves with depth so one poll doesn't show all of it
+    '''
+    reach = ((1 << 8 * self.depth.size) - 1) * self.direction
+    offsets = (0, reach, self.shift, reach + self.shift)
+    low = max(0, self.stack.address + min(offsets))
+    high = self.stack.address + max(offsets) + self.stack.size
+    return [(self.depth.address, self.depth.size), (low, high - low)]
+
 
 class TableResolver:
   ''' Table[Index] + Offset resolver.
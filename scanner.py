@@ -0,0 +1,333 @@
+#!/usr/bin/env -S python3 -u
+'''Sequence pointer discovery.
+Takes rapid snapshots of RAM window while the tune plays, then ranks every
+address as byte, LE/BE word and vertical word with stride by how much its
+value behaves like sequence read pointer: holds still for a few ticks,
+advances by small positive step, occasionally jumps elsewhere.
+
+Analysis is done on whole capture at once, all address/kind combinations are
+expressed as (low byte, high byte) column pairs and scored together.
+'''
+
+import argparse
+from sys import stdout
+
+import numpy as np
+
+from cmd_parser import CustomFormatter, parse_addr
+from memory_reader import Memory
+from pointer_logger import resolve_address
+from snapshot import open_snapshot, capture, save_capture, load_capture
+from util import int_autobase
+
+
+# Kind codes used in candidate arrays, index into this tuple
+KINDS = ('b', 'w', 'W', 'v', 'V')
+BYTE, WORD_LE, WORD_BE, VWORD_LE, VWORD_BE = range(len(KINDS))
+
+
+def build_candidates(size, strides):
+  '''Describe every readable value in the window as column pair.
+  Returns address, low column, high column, kind and stride arrays. Bytes use
+  column `size` as their high part, which is expected to be all zeroes.
+  '''
+  addr = np.arange(size)
+  parts = [
+    (addr, addr, np.full(size, size), BYTE, 0),
+    (addr[:-1], addr[:-1], addr[1:], WORD_LE, 0),
+    (addr[:-1], addr[1:], addr[:-1], WORD_BE, 0),
+  ]
+
+  for stride in strides:
+    if stride <= 0 or stride >= size:
+      continue
+    parts.append((addr[:-stride], addr[:-stride], addr[stride:], VWORD_LE, stride))
+    parts.append((addr[:-stride], addr[stride:], addr[:-stride], VWORD_BE, stride))
+
+  return (
+    np.concatenate([x[0] for x in parts]),
+    np.concatenate([x[1] for x in parts]),
+    np.concatenate([x[2] for x in parts]),
+    np.concatenate([np.full(len(x[0]), x[3], dtype=np.uint8) for x in parts]),
+    np.concatenate([np.full(len(x[0]), x[4], dtype=np.int32) for x in parts]),
+  )
+
+
+def score_series(values, jump_threshold):
+  '''Score (frames, candidates) value matrix column-wise.
+  Returns score, step and jump counts per column.
+  '''
+  delta = np.diff(values, axis=0)
+  moved = np.count_nonzero(delta, axis=0)
+  steps = np.count_nonzero((delta > 0) & (delta <= jump_threshold), axis=0)
+  jumps = moved - steps
+
+  ticks = max(len(delta), 1)
+  step_ratio = steps / np.maximum(moved, 1)
+  # Pointers idle between commands, counters and timers change every tick
+  idle = 1 - moved / ticks
+  # Sequence is expected to loop or jump at some point, reward that a bit
+  jumped = np.where(jumps > 0, 1.0, 0.5)
+
+  score = step_ratio * idle * np.log1p(steps) * jumped
+  return score, steps, jumps
+
+
+def scan_pointers(frames, strides, jump_threshold, min_steps, chunk=0x1000):
+  '''Rank all byte/word candidates in the capture.
+  '''
+  count, size = frames.shape
+  addr, low, high, kind, stride = build_candidates(size, strides)
+
+  # Pointer is only interesting if its low byte moves, this drops most of RAM
+  active = np.count_nonzero(frames[1:] != frames[:-1], axis=0)
+  active = np.append(active, 0)
+  keep = active[low] >= min_steps
+  addr, low, high, kind, stride = addr[keep], low[keep], high[keep], kind[keep], stride[keep]
+
+  # Copy out only columns that candidates use, one contiguous row per column,
+  # the zero column for byte high parts included
+  columns, inverse = np.unique(np.concatenate([low, high]), return_inverse=True)
+  series = np.zeros((len(columns), count), dtype=np.uint8)
+  real = columns < size
+  series[real] = np.take(frames, columns[real], axis=1).T
+  low_row, high_row = inverse[:len(low)], inverse[len(low):]
+
+  # Values are built a chunk of candidates at a time, whole matrix won't fit in cache
+  score = np.empty(len(addr))
+  steps = np.empty(len(addr), dtype=np.int64)
+  jumps = np.empty(len(addr), dtype=np.int64)
+  span = np.empty(len(addr), dtype=np.int32)
+  for pos in range(0, len(addr), chunk):
+    part = slice(pos, pos + chunk)
+    values = series[low_row[part]].astype(np.int32) | (series[high_row[part]].astype(np.int32) << 8)
+    score[part], steps[part], jumps[part] = score_series(values.T, jump_threshold)
+    span[part] = values.max(axis=1) - values.min(axis=1)
+
+  return dict(
+    addr=addr, kind=kind, stride=stride, low=low, high_moved=active[high],
+    score=score, steps=steps, jumps=jumps, span=span)
+
+
+def scan_stacks(frames, jump_threshold, min_steps, max_depth=0x20, depth_count=8):
+  '''Find STACK:DEPTH pairs, where depth is small byte and word at
+  stack+depth (or stack-depth) behaves like a sequence pointer.
+  '''
+  count, size = frames.shape
+  values = frames.astype(np.int32)
+
+  # Depth is a byte that changes rarely within small range
+  moved = np.count_nonzero(np.diff(values, axis=0), axis=0)
+  span = values.max(axis=0) - values.min(axis=0)
+  depth_ok = (moved > 0) & (moved < count // 4) & (span <= max_depth)
+  depths = np.flatnonzero(depth_ok)
+  depths = depths[np.argsort(moved[depths])[:depth_count]]
+
+  results = []
+  rows = np.arange(count)[:, None]
+  for depth in depths:
+    series = values[:, depth]
+    for direction in (1, -1):
+      offsets = series * direction
+      # Only keep bases that stay inside the window for all frames
+      bases = np.arange(
+        max(0, -offsets.min()),
+        min(size, size - 1 - offsets.max()))
+      if not len(bases):
+        continue
+
+      idx = bases[None, :] + offsets[:, None]
+      ptrs = values[rows, idx] | (values[rows, idx + 1] << 8)
+      score, steps, jumps = score_series(ptrs, jump_threshold)
+      score[steps < min_steps] = 0
+
+      best = np.argmax(score)
+      results.append((score[best], steps[best], jumps[best], bases[best], depth, direction))
+
+  results.sort(key=lambda x: -x[0])
+  return results
+
+
+def format_pointer(start, addr, kind, stride):
+  label = KINDS[kind]
+  if label in 'vV':
+    return f'0x{start + addr:x},{label},{stride}'
+  if label == 'w':
+    return f'0x{start + addr:x}'
+  return f'0x{start + addr:x},{label}'
+
+
+def best_per_address(result, pointers):
+  '''Same low byte shows up in many kinds with equal score, keep the one with
+  moving high byte, then simplest kind. Returns kept indices and alternatives.
+  '''
+  pointers = np.asarray(pointers, dtype=np.int64)
+  if not len(pointers):
+    return pointers, {}
+
+  order = np.lexsort((
+    result['kind'][pointers],
+    -result['high_moved'][pointers],
+    -result['score'][pointers],
+    result['low'][pointers]))
+  pointers = pointers[order]
+
+  low = result['low'][pointers]
+  first = np.ones(len(pointers), dtype=bool)
+  first[1:] = low[1:] != low[:-1]
+
+  alternatives = {}
+  for head, rest in zip(np.flatnonzero(first), np.split(pointers, np.flatnonzero(first)[1:])):
+    alternatives[pointers[head]] = rest[1:]
+
+  kept = pointers[first]
+  kept = kept[np.argsort(-result['score'][kept], kind='stable')]
+  return kept, alternatives
+
+
+def print_results(result, start, top, stacks=None):
+
+  order = np.argsort(-result['score'])
+  order = order[result['score'][order] > 0]
+  is_byte = result['kind'][order] == BYTE
+  pointers, alternatives = best_per_address(result, order[~is_byte])
+  offsets = order[is_byte]
+
+  stdout.write(f'{"score":>8s} {"steps":>6s} {"jumps":>6s} {"span":>6s}  settings\n')
+  for idx in pointers[:top]:
+    others = alternatives[idx]
+    stdout.write(
+      f'{result["score"][idx]:8.3f} {result["steps"][idx]:6d} {result["jumps"][idx]:6d} '
+      f'{result["span"][idx]:6x}  -M ptr '
+      f'{format_pointer(start, result["addr"][idx], result["kind"][idx], result["stride"][idx])}'
+      + (f'  (+{len(others)} same low byte)\n' if len(others) else '\n'))
+
+  if len(offsets):
+    stdout.write('\nByte offsets, usable as ptr INDEX or table/order OFFSET_POINTER:\n')
+    for idx in offsets[:top]:
+      stdout.write(
+        f'{result["score"][idx]:8.3f} {result["steps"][idx]:6d} {result["jumps"][idx]:6d} '
+        f'{result["span"][idx]:6x}  0x{start + result["addr"][idx]:x}\n')
+
+  if stacks:
+    stdout.write('\n')
+    for score, steps, jumps, base, depth, direction in stacks[:top]:
+      if not score:
+        continue
+      flags = ':n' if direction < 0 else ''
+      stdout.write(
+        f'{score:8.3f} {steps:6d} {jumps:6d} {"":6s}  '
+        f'-M stack 0x{start + base:x}:0x{start + depth:x}{flags}\n')
+
+
+def get_parser():
+
+  parser = argparse.ArgumentParser(
+    description='Capture RAM window while music plays and rank addresses '
+                'that look like sequence read pointers.',
+    formatter_class=CustomFormatter)
+
+  parser.add_argument(
+    'filename',
+    type=str,
+    nargs='?',
+    help='Memory file to read from, same as for pointer_logger')
+  parser.add_argument(
+    'ram_ptr',
+    type=parse_addr,
+    nargs='?',
+    help='Emulator RAM offset, same format as for pointer_logger')
+  parser.add_argument(
+    '-s', '--start',
+    type=int_autobase,
+    default=0,
+    help='Window start, relative to RAM offset')
+  parser.add_argument(
+    '-n', '--size',
+    type=int_autobase,
+    default=0x10000,
+    help='Window size in bytes')
+  parser.add_argument(
+    '-d', '--duration',
+    type=float,
+    default=3,
+    help='Capture length in seconds')
+  parser.add_argument(
+    '-f', '--frequency',
+    type=int_autobase,
+    default=240,
+    help='Snapshot rate in Hz')
+  parser.add_argument(
+    '-j', '--jump-threshold',
+    type=int_autobase,
+    default=0x10,
+    help='Largest forward step that still counts as normal advance')
+  parser.add_argument(
+    '-S', '--strides',
+    type=str,
+    default='2:3:4:5:6:7:8',
+    help='Colon separated list of strides to try for vertical words')
+  parser.add_argument(
+    '-m', '--min-steps',
+    type=int_autobase,
+    default=4,
+    help='Ignore candidates that advanced fewer times than this')
+  parser.add_argument(
+    '-t', '--top',
+    type=int_autobase,
+    default=20,
+    help='Print this many best candidates')
+  parser.add_argument(
+    '-k', '--stack',
+    action='store_true',
+    help='Also search for STACK:DEPTH resolver settings, slower')
+  parser.add_argument(
+    '-D', '--soft-dirty',
+    action='store_true',
+    help='Only re-read pages the target wrote to since last snapshot.\n'
+         'Needs /proc/PID/mem target and kernel with soft-dirty tracking')
+  parser.add_argument(
+    '-o', '--save',
+    type=str,
+    help='Store capture into .npz file for later analysis')
+  parser.add_argument(
+    '-i', '--load',
+    type=str,
+    help='Analyze stored capture instead, filename and ram_ptr are not needed')
+
+  return parser
+
+
+def main():
+
+  parser = get_parser()
+  args = parser.parse_args()
+  if not args.load and (args.filename is None or args.ram_ptr is None):
+    parser.error('filename and ram_ptr are required unless --load is given')
+
+  if args.load:
+    frames, start = load_capture(args.load)
+  else:
+    ram_ptr = resolve_address(*args.ram_ptr, args.filename)
+    memory = Memory(args.filename, ram_ptr)
+    start = args.start
+
+    stdout.write(f'Capturing {args.size:#x} bytes at {args.frequency} Hz for {args.duration}s…\n')
+    snapshot = open_snapshot(memory, start, args.size, args.soft_dirty)
+    try:
+      frames = capture(snapshot, args.duration, args.frequency)
+    finally:
+      snapshot.close()
+      memory.close()
+
+    if args.save:
+      save_capture(args.save, frames, start)
+
+  strides = [int_autobase(x) for x in args.strides.split(':') if x]
+  result = scan_pointers(frames, strides, args.jump_threshold, args.min_steps)
+  stacks = scan_stacks(frames, args.jump_threshold, args.min_steps) if args.stack else None
+  print_results(result, start, args.top, stacks)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,249 @@
+'''Scrollback of recent steps.
+Steps are stored in preallocated arrays used as a ring: timestamps, channel,
+pointers, action and up to `width` raw bytes each, no Python object is kept
+per step. Memory is fixed at startup however long the session runs.
+
+Nothing is stored pre-formatted, so any range can be printed again with a
+different printer or grammar. Browser is the paused view over it:
+
+  space, q        resume
+  up/down, j/k    scroll by one step
+  PgUp/PgDn       scroll by page
+  g/G, Home/End   oldest/newest step
+  p               next printer
+'''
+
+import os
+import select
+import sys
+import termios
+import tty
+from shutil import get_terminal_size
+from sys import stdout
+
+import numpy as np
+
+from consts import GRAY, GOLD, BBLUE, RESET
+from renderer import Screen
+
+
+# Escape sequences of keys the browser understands
+KEYS = {
+  '\033[A': 'up', '\033[B': 'down', '\033[5~': 'pgup', '\033[6~': 'pgdn',
+  '\033[H': 'home', '\033[F': 'end', '\033[1~': 'home', '\033[4~': 'end',
+}
+
+
+class Scrollback:
+
+  capacity = None
+  width = None
+  names = None
+  name_width = None
+  codes = None
+  count = 0
+  times = None
+  channels = None
+  ptrs = None
+  diffs = None
+  actions = None
+  lengths = None
+  data = None
+
+  def __init__(self, capacity, names, width=32):
+    self.capacity = capacity
+    self.width = width
+    self.names = [str(x) for x in names]
+    self.codes = {name: idx for idx, name in enumerate(self.names)}
+    self.name_width = max(len(x) for x in self.names)
+
+    self.times = np.zeros(capacity, dtype=np.float64)
+    self.channels = np.zeros(capacity, dtype=np.uint8)
+    self.ptrs = np.zeros(capacity, dtype=np.int64)
+    self.diffs = np.zeros(capacity, dtype=np.int64)
+    self.actions = np.zeros(capacity, dtype=np.uint8)
+    self.lengths = np.zeros(capacity, dtype=np.uint16)
+    self.data = np.zeros((capacity, width), dtype=np.uint8)
+
+  def __len__(self):
+    return min(self.count, self.capacity)
+
+  @property
+  def nbytes(self):
+    return sum(x.nbytes for x in (
+      self.times, self.channels, self.ptrs, self.diffs, self.actions, self.lengths, self.data))
+
+  @property
+  def first(self):
+    '''Sequence number of the oldest step still kept
+    '''
+    return max(0, self.count - self.capacity)
+
+  def add(self, event):
+    idx = self.count % self.capacity
+    size = min(len(event.data), self.width)
+    self.times[idx] = event.time
+    self.channels[idx] = self.codes[str(event.channel)]
+    self.ptrs[idx] = event.ptr
+    self.diffs[idx] = event.diff
+    self.actions[idx] = event.action
+    self.lengths[idx] = size
+    self.data[idx, :size] = np.frombuffer(event.data, dtype=np.uint8, count=size)
+    self.count += 1
+
+  def get(self, number):
+    '''Step by sequence number: time, channel, ptr, diff, action, data
+    '''
+    if not self.first <= number < self.count:
+      raise IndexError(f'Step {number} is not in scrollback')
+    idx = number % self.capacity
+    return (
+      float(self.times[idx]), self.names[self.channels[idx]], int(self.ptrs[idx]),
+      int(self.diffs[idx]), int(self.actions[idx]), self.data[idx, :self.lengths[idx]].tobytes())
+
+  def format(self, number, printers):
+    '''Re-render one step, printers maps channel name to printer
+    '''
+    when, channel, ptr, diff, action, data = self.get(number)
+    printer = printers[channel]
+    printer(action, data)
+
+    head = f'{GRAY}{when:9.3f} {BBLUE}{channel:>{self.name_width}s} {GOLD}{ptr - diff:04x}{GRAY}{diff:+5x}{RESET}'
+    blanks = ' ' * (self.name_width + 20)
+    return [
+      f'{blanks if idx else head}│{printer.prefix}{row}{printer.suffix}'
+      for idx, row in enumerate(printer.result)]
+
+
+class Keys:
+  '''Non-blocking key reader, terminal is in cbreak mode while in use
+  '''
+
+  fd = None
+  saved = None
+
+  def __enter__(self):
+    if sys.stdin.isatty():
+      self.fd = sys.stdin.fileno()
+      self.saved = termios.tcgetattr(self.fd)
+      tty.setcbreak(self.fd)
+    return self
+
+  def __exit__(self, *_exc):
+    if self.saved is not None:
+      termios.tcsetattr(self.fd, termios.TCSADRAIN, self.saved)
+
+  def read(self):
+    '''Key pressed since last call or None, never waits
+    '''
+    if self.fd is None or not select.select([self.fd], [], [], 0)[0]:
+      return None
+    text = os.read(self.fd, 32).decode(errors='replace')
+    return KEYS.get(text, text[:1])
+
+
+class Browser:
+  '''Paused view over scrollback, anchored to a step so that new steps
+  arriving in the meantime do not move it
+  '''
+
+  scrollback = None
+  printers = None
+  choice = 0
+  anchor = None
+  screen = None
+  alternate = True
+  dirty = True
+
+  def __init__(self, scrollback, printers, alternatives=()):
+    '''printers is the channel name -> printer map used live,
+    alternatives are (label, printer) pairs applied to every channel
+    '''
+    self.scrollback = scrollback
+    self.printers = [('live', printers)]
+    for label, printer in alternatives:
+      self.printers.append((label, dict.fromkeys(scrollback.names, printer)))
+
+  def start(self, alternate=True):
+    self.alternate = alternate
+    self.anchor = self.scrollback.count - 1
+    self.screen = None
+    self.dirty = True
+    if alternate:
+      stdout.write('\033[?1049h\033[?25l')
+
+  def stop(self):
+    if self.alternate:
+      stdout.write('\033[?1049l\033[?25h')
+    stdout.flush()
+
+  def key(self, key):
+    '''Handle key, False once browsing is over
+    '''
+    first, last = self.scrollback.first, self.scrollback.count - 1
+    page = max(1, get_terminal_size()[1] - 2)
+    moves = {
+      'up': -1, 'k': -1, 'down': 1, 'j': 1, 'pgup': -page, 'pgdn': page,
+      'home': first - self.anchor, 'g': first - self.anchor,
+      'end': last - self.anchor, 'G': last - self.anchor,
+    }
+
+    if key in (' ', 'q'):
+      return False
+    if key in moves:
+      self.anchor = max(first, min(last, self.anchor + moves[key]))
+    elif key == 'p':
+      self.choice = (self.choice + 1) % len(self.printers)
+    else:
+      return True
+
+    self.dirty = True
+    return True
+
+  def draw(self):
+    if not self.dirty:
+      return
+    self.dirty = False
+
+    width, height = get_terminal_size()
+    if self.screen is None or (self.screen.width, self.screen.height) != (width, height):
+      self.screen = Screen(width, height)
+      stdout.write('\033[2J')
+    screen = self.screen
+    screen.clear()
+    scrollback = self.scrollback
+
+    # Paused before anything was stored, e.g. still waiting for start condition
+    if not len(scrollback):
+      screen.put(height - 1, 0, 'paused, no steps yet  [space] resume', width, GOLD)
+      stdout.write(screen.diff())
+      stdout.flush()
+      return
+
+    # Fill from anchored step upwards, it might have been overwritten since
+    self.anchor = max(self.anchor, self.scrollback.first)
+    label, printers = self.printers[self.choice]
+    lines = height - 1
+    rows = []
+    number = self.anchor
+    while len(rows) < lines and number >= self.scrollback.first:
+      rows[:0] = self.scrollback.format(number, printers)
+      number -= 1
+    rows = rows[-lines:]
+
+    # Near the oldest step there's room left for newer ones below
+    number = self.anchor + 1
+    while len(rows) < lines and number < self.scrollback.count:
+      rows.extend(self.scrollback.format(number, printers))
+      number += 1
+
+    for idx, row in enumerate(rows[:lines]):
+      screen.put(idx, 0, row, width)
+
+    screen.put(
+      height - 1, 0,
+      f'paused, step {self.anchor - scrollback.first + 1}/{len(scrollback)}, '
+      f'printer: {label}  [space] resume [↑↓ PgUp PgDn g G] scroll [p] printer',
+      width, GOLD)
+    stdout.write(screen.diff())
+    stdout.flush()
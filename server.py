@@ -0,0 +1,147 @@
+#!/usr/bin/env -S python3 -u
+'''Step event server.
+Polls the target once and publishes every pointer step to any number of
+subscribers over Unix domain socket, one JSON object per line:
+
+  {"t": 1.25, "channel": 0, "ptr": 33063, "old_ptr": 33061, "diff": 2,
+   "action": "FWRD", "bytes": "93fe", "info": "8125"}
+
+Each subscriber gets its own bounded queue. Subscriber that can't keep up is
+disconnected, poller never waits for anyone.
+'''
+
+import asyncio
+import json
+import os
+from sys import stderr
+
+from cmd_parser import get_parser
+from consts import ACTION_NAMES
+from locator import Locator, pid_from_filename
+from memory_reader import open_memory
+from pointer_logger import resolve_address
+from tracker import Tracker
+from util import int_autobase
+
+
+class StepServer:
+
+  path = None
+  queue_size = None
+  clients = None
+  dropped = 0
+
+  def __init__(self, path, queue_size=1024):
+    self.path = path
+    self.queue_size = queue_size
+    self.clients = set()
+
+  async def handle(self, _reader, writer):
+    queue = asyncio.Queue(self.queue_size)
+    client = (queue, writer)
+    self.clients.add(client)
+
+    try:
+      while True:
+        line = await queue.get()
+        if line is None:
+          break
+        writer.write(line)
+        await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+      pass
+    finally:
+      self.clients.discard(client)
+      writer.close()
+
+  def publish(self, event):
+    line = (json.dumps(event_dict(event), separators=(',', ':')) + '\n').encode()
+
+    for client in list(self.clients):
+      queue, writer = client
+      try:
+        queue.put_nowait(line)
+      except asyncio.QueueFull:
+        # Slow subscriber, cut it off instead of stalling the poller
+        self.clients.discard(client)
+        self.dropped += 1
+        writer.transport.abort()
+
+  async def run(self, tracker):
+    if os.path.exists(self.path):
+      os.unlink(self.path)
+    server = await asyncio.start_unix_server(self.handle, path=self.path)
+
+    async with server:
+      async for event in tracker:
+        self.publish(event)
+
+
+def event_dict(event):
+  return {
+    't': round(event.time, 6),
+    'channel': event.channel,
+    'ptr': event.ptr,
+    'old_ptr': event.old_ptr,
+    'diff': event.diff,
+    'action': ACTION_NAMES[event.action],
+    'bytes': event.data.hex(),
+    'info': event.info,
+  }
+
+
+async def subscribe(path):
+  '''Yield step events published by server at path
+  '''
+  reader, writer = await asyncio.open_unix_connection(path)
+  try:
+    while line := await reader.readline():
+      yield json.loads(line)
+  finally:
+    writer.close()
+
+
+def main():
+
+  parser = get_parser()
+  parser.description = 'Poll RAM pointer once and broadcast its steps over Unix socket.'
+  parser.add_argument(
+    '-s', '--socket',
+    type=str,
+    default='/tmp/ptr_log.sock',
+    help='Unix socket path to listen on')
+  parser.add_argument(
+    '-q', '--queue-size',
+    type=int_autobase,
+    default=1024,
+    help='Events buffered per subscriber before it is dropped')
+  args = parser.parse_args()
+
+  if args.data_ptr is None:
+    args.data_ptr = args.ram_ptr
+
+  locator = None
+  if args.signature or args.ram_size:
+    locator = Locator(
+      pid_from_filename(args.filename), args.signature, args.signature_offset, args.ram_size)
+
+  code = open_memory(args.filename, resolve_address(*args.ram_ptr, args.filename, locator))
+  data = open_memory(args.filename, resolve_address(*args.data_ptr, args.filename, locator), code)
+
+  tracker = Tracker(code, data, jump_threshold=args.jump_threshold,
+                    preview=args.preview, frequency=args.frequency)
+  tracker.add_channel(0, args.resolve_method, args.resolver_settings, shift=args.shift)
+  server = StepServer(args.socket, args.queue_size)
+
+  stderr.write(f'Serving steps on {args.socket}\n')
+  try:
+    asyncio.run(server.run(tracker))
+  except KeyboardInterrupt:
+    pass
+  finally:
+    if os.path.exists(args.socket):
+      os.unlink(args.socket)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,416 @@
+#!/usr/bin/env -S python3 -u
+'''Session files: one target, several named channels, one process.
+Session is JSON or TOML (by extension) and mirrors pointer_logger arguments.
+Top level values are defaults for every channel, environment variables are
+expanded in target and address strings:
+
+  {
+    "target": "/proc/$PID/mem",
+    "ram_ptr": "0x1025100",
+    "data_ptr": "0x1125100",
+    "frequency": 60,
+    "printer": "map",
+    "printer_settings": "grammars/dataeast_fc.json",
+    "channels": {
+      "sq1": {"method": "ptr", "settings": "0x33a,v,0xe"},
+      "sq2": {"method": "ptr", "settings": "0x33b,v,0xe"},
+      "tri": {"method": "ptr", "settings": "0x33c,v,0xe", "printer": "hex"}
+    }
+  }
+
+Everything is parsed and built once at startup, all channels share the same
+memory readers and are polled by a single loop.
+
+Several targets, e.g. the same tune in two emulators, go into "targets". Each
+target takes the same keys as the top level, which are its defaults, and gets
+its own readers and channels. Without "channels" of its own a target tracks
+the top level ones. Channels are named target.channel, targets are polled
+concurrently and their steps merged by time:
+
+  {
+    "frequency": 60,
+    "printer": "map",
+    "printer_settings": "grammars/dataeast_fc.json",
+    "channels": {"sq1": {"settings": "0x33a,v,0xe"}},
+    "targets": {
+      "nes": {"target": "/proc/$NES/mem", "ram_ptr": "0x1025100"},
+      "nsf": {"target": "gdb://localhost:1234", "ram_ptr": "0"}
+    }
+  }
+'''
+
+import argparse
+import copy
+import json
+import os
+import time
+from collections import deque
+from contextlib import nullcontext
+from shutil import get_terminal_size
+from sys import stdout
+
+from cmd_parser import CustomFormatter, parse_addr, parse_printer, subargs_parser
+from consts import GRAY, GOLD, BBLUE, RESET
+from locator import Locator, pid_from_filename
+from loop_detect import LoopDetector
+from memory_reader import open_memory
+from pointer_logger import resolve_address
+from registry import PRINTERS
+from renderer import PaneRenderer
+from scrollback import Browser, Keys, Scrollback
+from trace_store import TraceWriter
+from triggers import Edge, Trigger
+from tracker import Tracker, TrackerGroup
+from util import int_autobase
+
+
+# Values a channel inherits from the session when it does not set its own
+CHANNEL_DEFAULTS = {
+  'method': 'ptr',
+  'settings': '',
+  'printer': 'hex',
+  'printer_settings': '',
+  'shift': 0,
+}
+
+
+def load_session(filename):
+  if filename.endswith('.toml'):
+    import tomllib
+    with open(filename, 'rb') as handle:
+      return tomllib.load(handle)
+
+  with open(filename, 'r', encoding='utf-8') as handle:
+    return json.load(handle)
+
+
+def channel_specs(session, only=None, prefix=''):
+  '''Merge channel settings with session-wide defaults. Channels in only can be
+  given with or without target prefix.
+  '''
+  result = []
+  for name, channel in session['channels'].items():
+    if only and name not in only and prefix + name not in only:
+      continue
+    spec = {key: channel.get(key, session.get(key, value)) for key, value in CHANNEL_DEFAULTS.items()}
+    spec['name'] = prefix + name
+    result.append(spec)
+  return result
+
+
+def target_sessions(session):
+  '''Split multi-target session into name, single target session pairs
+  '''
+  if 'targets' not in session:
+    return [(None, session)]
+
+  defaults = {key: value for key, value in session.items() if key != 'targets'}
+  return [(name, defaults | target) for name, target in session['targets'].items()]
+
+
+def build_tracker(session, only=None, prefix=''):
+  '''Open readers and build every channel of the session
+  '''
+  filename = os.path.expandvars(session['target'])
+  ram_ptr = parse_addr(os.path.expandvars(str(session.get('ram_ptr', '0'))))
+  data_ptr = parse_addr(os.path.expandvars(str(session['data_ptr']))) \
+    if 'data_ptr' in session else ram_ptr
+
+  locator = None
+  if session.get('signature') or session.get('ram_size'):
+    locator = Locator(
+      pid_from_filename(filename),
+      session.get('signature'),
+      int_autobase(session.get('signature_offset', 0)),
+      int_autobase(session['ram_size']) if 'ram_size' in session else None)
+
+  code = open_memory(filename, resolve_address(*ram_ptr, filename, locator))
+  data = open_memory(filename, resolve_address(*data_ptr, filename, locator), code)
+
+  tracker = Tracker(
+    code, data,
+    jump_threshold=int_autobase(session.get('jump_threshold', 0x10)),
+    preview=int_autobase(session.get('preview', 4)),
+    frequency=int_autobase(session.get('frequency', 120)),
+    target=prefix[:-1] or None)
+
+  for spec in channel_specs(session, only, prefix):
+    p_args, p_kwargs = subargs_parser(spec['printer_settings'])
+    printer = PRINTERS[spec['printer']](*p_args, **p_kwargs)
+    tracker.add_channel(
+      spec['name'], spec['method'], spec['settings'], printer, int_autobase(spec['shift']))
+
+  return tracker
+
+
+def build_trackers(session, only=None):
+  '''Tracker for single target session, group of them for multi-target one
+  '''
+  targets = target_sessions(session)
+  if targets[0][0] is None:
+    return build_tracker(session, only)
+
+  trackers = []
+  for name, target in targets:
+    tracker = build_tracker(target, only, f'{name}.')
+    if tracker.channels:
+      trackers.append(tracker)
+    else:
+      tracker.close()
+  if not trackers:
+    raise ValueError('No channels to track')
+  return TrackerGroup(trackers)
+
+
+def format_event(event, width):
+  '''Rows for one step, same layout as pointer_logger with channel name in front
+  '''
+  blanks = ' ' * (width + len(event.info) + 6)
+  rows = []
+  prefix = f'{BBLUE}{event.channel:>{width}s} {GOLD}{event.info}{GRAY}{event.diff:+5x}{RESET}'
+  for idx, row in enumerate(event.lines):
+    rows.append(f'{blanks if idx else prefix}│{event.prefix}{row}{event.suffix}\n')
+  return rows
+
+
+def run(tracker, recorder=None, detector=None, stop_on_loop=False,
+        start_when=None, stop_when=None, mark_when=None, renderer=None,
+        browser=None, keys=None):
+  width = max(len(str(x.name)) for x in tracker.channels)
+  write = stdout.write
+  looped = False
+  paused = False
+  held = []
+
+  # Stopping on loop: recording lags behind by the steps loop detector needs
+  # to confirm it, so that the trace can end exactly where the loop does
+  lag = deque()
+  delay = 0
+  if recorder is not None and detector is not None and stop_on_loop:
+    delay = detector.window + detector.confirm
+  scrollback = browser.scrollback if browser is not None else None
+
+  # Marks go to status line in pane view, into output otherwise
+  def note(text):
+    if renderer is not None:
+      renderer.mark(text)
+    elif paused:
+      held.append(text)
+    else:
+      write(f'{GOLD}── {text} ──{RESET}\n')
+
+  # Conditions see every channel pointer by name and are checked once per
+  # tick, after all of its steps. RAM values are read by each tracker right
+  # after every step, not from here.
+  names = [str(x.name) for x in tracker.channels]
+  ptrs = dict.fromkeys(names, 0)
+  for trigger in (start_when, stop_when, mark_when):
+    if trigger is not None:
+      for key in trigger.ram():
+        tracker.watch(key)
+        ptrs[key] = 0
+  started = start_when is None
+  start = start_when.bind(None, names) if start_when is not None else None
+  stop = Edge(stop_when.bind(None, names)) if stop_when is not None else None
+  mark = Edge(mark_when.bind(None, names)) if mark_when is not None else None
+  triggers = start or stop or mark
+
+  # Leaving while paused must not leave the terminal in browser view
+  try:
+    for events in tracker.ticks():
+      if triggers:
+        for event in events:
+          ptrs[str(event.channel)] = event.ptr
+        if tracker.sample:
+          ptrs.update(tracker.sample)
+        if not started and start(ptrs):
+          started = True
+          note(f'start: {start_when}')
+        if mark is not None and mark(ptrs):
+          note(f'mark: {mark_when}')
+        if stop is not None and stop(ptrs):
+          note(f'stop: {stop_when}')
+          return
+
+      if not started:
+        events = ()
+      for event in events:
+        if recorder is not None:
+          lag.append(event)
+          while len(lag) > delay:
+            recorder.write(lag.popleft())
+        if scrollback is not None:
+          scrollback.add(event)
+        if renderer is not None:
+          renderer.update(event)
+        elif not paused:
+          for row in format_event(event, width):
+            write(row)
+
+        if detector is not None and not looped:
+          loop = detector.update(event.channel, event.ptr, event.time)
+          if loop is not None:
+            looped = True
+            note(
+              f'loop: {loop.end_time:.3f}s → {loop.start_time:.3f}s, '
+              f'{loop.end_time - loop.start_time:.3f}s, {loop.length} steps')
+            if recorder is not None:
+              recorder.mark('loop start', loop.start)
+              recorder.mark('loop end', loop.end)
+            if stop_on_loop:
+              # Steps held back past the loop end are not part of it
+              while lag and recorder.count < loop.end:
+                recorder.write(lag.popleft())
+              lag.clear()
+              return
+
+      # Polling goes on while paused, only the output is held back
+      key = keys.read() if keys is not None else None
+      if paused:
+        paused = browser.key(key) if key else True
+        if paused:
+          browser.draw()
+          continue
+        browser.stop()
+        if renderer is not None:
+          renderer.invalidate()
+        for text in held:
+          write(f'{GOLD}── {text} ──{RESET}\n')
+        held.clear()
+      elif key == ' ' and browser is not None:
+        paused = True
+        browser.start(alternate=renderer is None)
+        browser.draw()
+        continue
+
+      if renderer is not None:
+        renderer.draw(time.perf_counter() - tracker.started)
+  finally:
+    for event in lag:
+      recorder.write(event)
+    if paused:
+      browser.stop()
+
+
+def get_parser():
+
+  parser = argparse.ArgumentParser(
+    description='Track every channel described in session file at once.',
+    formatter_class=CustomFormatter)
+
+  parser.add_argument(
+    'session',
+    type=str,
+    help='Session file, .json or .toml')
+  parser.add_argument(
+    '-c', '--channels',
+    type=str,
+    help='Comma separated list of channels to track, all by default')
+  parser.add_argument(
+    '-r', '--record',
+    type=str,
+    metavar='FILE',
+    help='Also store every step in trace file, see trace_store.py')
+  parser.add_argument(
+    '-l', '--loop',
+    type=int_autobase,
+    default=0,
+    metavar='STEPS',
+    help='Detect tune loop by matching this many recent steps of all channels, 0 disables')
+  parser.add_argument(
+    '-L', '--stop-on-loop',
+    action='store_true',
+    help='Stop once loop is detected')
+  parser.add_argument(
+    '--start-when',
+    type=Trigger,
+    metavar='COND',
+    help='Hold output and recording back until condition is met,\n'
+         'channel names stand for their pointers, e.g. "sq1 in 0x8200..0x8300"')
+  parser.add_argument(
+    '--stop-when',
+    type=Trigger,
+    metavar='COND',
+    help='Stop once condition is met')
+  parser.add_argument(
+    '--mark-when',
+    type=Trigger,
+    metavar='COND',
+    help='Print mark line every time condition becomes true')
+  parser.add_argument(
+    '-u', '--ui',
+    choices=('lines', 'panes'),
+    default='lines',
+    help='Scrolling lines, or full screen with one pane per channel and timeline')
+  parser.add_argument(
+    '--fps',
+    type=int_autobase,
+    default=30,
+    help='Pane view repaint limit, independent of polling frequency')
+  parser.add_argument(
+    '-s', '--scrollback',
+    type=int_autobase,
+    default=0x10000,
+    metavar='STEPS',
+    help='Keep this many recent steps for browsing, space pauses and resumes.\n'
+         'Memory use is fixed, about 64 bytes per step. 0 disables')
+  parser.add_argument(
+    '-B', '--browse-printer',
+    type=parse_printer,
+    action='append',
+    default=[],
+    metavar='CLASS[:SETTINGS]',
+    help='Extra printer to re-render scrollback with, p cycles through them.\n'
+         'Can be repeated, e.g. -B hex -B map:grammars/dataeast_fc.json')
+
+  return parser
+
+
+def main():
+
+  args = get_parser().parse_args()
+  session = load_session(args.session)
+  only = args.channels.split(',') if args.channels else None
+  tracker = build_trackers(session, only)
+  recorder = None
+  if args.record:
+    recorder = TraceWriter(args.record, [str(x.name) for x in tracker.channels])
+
+  renderer = None
+  if args.ui == 'panes':
+    renderer = PaneRenderer(tracker.channels, args.fps)
+    renderer.start()
+  else:
+    term_w, _term_h = get_terminal_size()
+    for name, target in target_sessions(session):
+      channels = [str(x.name) for x in tracker.channels if name is None or x.name.startswith(f'{name}.')]
+      stdout.write(f'{os.path.expandvars(target["target"])}: ' + ', '.join(channels) + '\n')
+    stdout.write('═' * term_w + '\n')
+
+  detector = LoopDetector(args.loop) if args.loop else None
+
+  browser = None
+  if args.scrollback:
+    # Own printer copies, live ones may be busy in poll threads of several targets
+    scrollback = Scrollback(args.scrollback, [x.name for x in tracker.channels])
+    browser = Browser(
+      scrollback, {str(x.name): copy.deepcopy(x.printer) for x in tracker.channels}, args.browse_printer)
+
+  try:
+    with Keys() if browser is not None else nullcontext() as keys:
+      run(tracker, recorder, detector, args.stop_on_loop,
+          args.start_when, args.stop_when, args.mark_when, renderer, browser, keys)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    if renderer is not None:
+      renderer.stop()
+      if renderer.status:
+        stdout.write(f'{GOLD}── {renderer.status} ──{RESET}\n')
+    tracker.close()
+    if recorder is not None:
+      recorder.close()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env -S python3 -u
+'''Shared memory ring of RAM snapshots.
+The poller is the only writer and never waits for readers. Every slot carries
+sequence number that is odd while the slot is being written (seqlock), so
+readers in other processes can take frames zero-copy and afterwards check
+that the slot was not overwritten while they were using it.
+
+Layout:
+  header   64 bytes: magic, slot size, slot count, last published sequence
+  metadata 4 KiB: JSON with regions stored in every slot
+  slots    slot count * (32 byte slot header + slot size)
+'''
+
+import argparse
+import json
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from memory_reader import Memory
+from util import int_autobase, merge_regions
+
+
+MAGIC = 0x31474e4952525450  # 'PTRRING1'
+HEADER_SIZE = 64
+META_SIZE = 4096
+SLOT_HEADER = 32
+
+
+class SnapshotRing:
+
+  shm = None
+  owner = False
+  slot_size = None
+  slot_count = None
+  regions = None
+  header = None
+  slot_headers = None
+  slot_times = None
+  slot_data = None
+
+  def __init__(self, name, regions=None, slot_count=64, create=False):
+
+    if create:
+      self.regions = [tuple(x) for x in regions]
+      self.slot_size = sum(size for _start, size in self.regions)
+      self.slot_count = slot_count
+      total = HEADER_SIZE + META_SIZE + slot_count * (SLOT_HEADER + self.slot_size)
+      self.shm = shared_memory.SharedMemory(name, create=True, size=total)
+      self.owner = True
+    else:
+      self.shm = shared_memory.SharedMemory(name)
+      # Attaching process must not remove the segment when it exits
+      resource_tracker.unregister(self.shm._name, 'shared_memory')
+
+    self.header = np.ndarray(8, dtype=np.uint64, buffer=self.shm.buf)
+
+    if create:
+      meta = json.dumps({'regions': self.regions}).encode()
+      if len(meta) > META_SIZE:
+        raise ValueError('Too many regions for ring metadata')
+      self.shm.buf[HEADER_SIZE:HEADER_SIZE + len(meta)] = meta
+      self.header[1] = self.slot_size
+      self.header[2] = self.slot_count
+      self.header[3] = 0
+      self.header[0] = MAGIC
+    else:
+      if self.header[0] != MAGIC:
+        raise ValueError(f'{name} is not a snapshot ring')
+      self.slot_size = int(self.header[1])
+      self.slot_count = int(self.header[2])
+      meta = bytes(self.shm.buf[HEADER_SIZE:HEADER_SIZE + META_SIZE]).rstrip(b'\0')
+      self.regions = [tuple(x) for x in json.loads(meta)['regions']]
+
+    stride = SLOT_HEADER + self.slot_size
+    slots = np.ndarray(
+      (self.slot_count, stride), dtype=np.uint8,
+      buffer=self.shm.buf, offset=HEADER_SIZE + META_SIZE)
+    self.slot_headers = slots[:, :8].view(np.uint64)[:, 0]
+    self.slot_times = slots[:, 8:16].view(np.float64)[:, 0]
+    self.slot_data = slots[:, SLOT_HEADER:]
+
+  @property
+  def sequence(self):
+    '''Last published frame number, frames are numbered from 1
+    '''
+    return int(self.header[3])
+
+  def write(self, parts, timestamp=None):
+    '''Publish next frame made of byte strings, one per region
+    '''
+    seq = int(self.header[3]) + 1
+    slot = seq % self.slot_count
+
+    self.slot_headers[slot] = seq * 2 + 1
+    pos = 0
+    data = self.slot_data[slot]
+    for part in parts:
+      data[pos:pos + len(part)] = np.frombuffer(part, dtype=np.uint8)
+      pos += len(part)
+    self.slot_times[slot] = time.perf_counter() if timestamp is None else timestamp
+    self.slot_headers[slot] = seq * 2
+    self.header[3] = seq
+
+    return seq
+
+  def frame(self, seq):
+    '''Zero-copy view of frame data, or None if it is not there (anymore).
+    Call valid(seq) when done to make sure it was not overwritten meanwhile.
+    '''
+    slot = seq % self.slot_count
+    if self.slot_headers[slot] != seq * 2:
+      return None
+    return self.slot_data[slot]
+
+  def timestamp(self, seq):
+    return float(self.slot_times[seq % self.slot_count])
+
+  def valid(self, seq):
+    return self.slot_headers[seq % self.slot_count] == seq * 2
+
+  def split(self, frame):
+    '''Views of each region inside frame
+    '''
+    result = []
+    pos = 0
+    for _start, size in self.regions:
+      result.append(frame[pos:pos + size])
+      pos += size
+    return result
+
+  def follow(self, poll=0.001):
+    '''Yield (seq, frame view) for every new frame, skipping ahead when
+    reader falls more than a full ring behind.
+    '''
+    seq = self.sequence
+    while True:
+      last = self.sequence
+      if last <= seq:
+        time.sleep(poll)
+        continue
+
+      seq = max(seq + 1, last - self.slot_count + 1)
+      frame = self.frame(seq)
+      if frame is not None:
+        yield seq, frame
+
+  def close(self):
+    # Views must go before the buffer they point into
+    self.header = self.slot_headers = self.slot_times = self.slot_data = None
+    self.shm.close()
+    if self.owner:
+      self.shm.unlink()
+
+
+class RecordingMemory(Memory):
+  '''Forwards reads to memory and logs (start, size) of each into touched
+  '''
+
+  memory = None
+  touched = None
+
+  def __init__(self, memory):
+    self.memory = memory
+    self.base = memory.base
+    self.touched = []
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      self.touched.append((index.start, index.stop - index.start))
+    else:
+      self.touched.append((index, 1))
+    return self.memory[index]
+
+
+def record_regions(memory, call, pad=16):
+  '''Run call(reader) with reader that logs every slice it reads from memory
+  and return the ranges that were touched, together with any (start, size)
+  ranges call returns for reads one run doesn't show.
+  '''
+  recorder = RecordingMemory(memory)
+  extra = call(recorder) or []
+  return merge_regions(recorder.touched + list(extra), pad)
+
+
+def get_parser():
+
+  parser = argparse.ArgumentParser(
+    description='Follow snapshot ring written by pointer_logger --shm.')
+
+  parser.add_argument(
+    'name',
+    type=str,
+    help='Shared memory name')
+  parser.add_argument(
+    '-l', '--length',
+    type=int_autobase,
+    default=16,
+    help='Print this many bytes of each region')
+
+  return parser
+
+
+def main():
+
+  args = get_parser().parse_args()
+  ring = SnapshotRing(args.name)
+
+  try:
+    for seq, frame in ring.follow():
+      parts = [
+        f'{start:04x}: {bytes(view[:args.length]).hex(" ")}'
+        for (start, _size), view in zip(ring.regions, ring.split(frame))]
+      if ring.valid(seq):
+        print(f'{seq:8d} {" | ".join(parts)}')
+  except KeyboardInterrupt:
+    pass
+  finally:
+    ring.close()
+
+
+if __name__ == '__main__':
+  main()
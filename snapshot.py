@@ -0,0 +1,167 @@
+'''Whole-window RAM readers used by analysis tools.
+Resolvers poll a handful of bytes per tick, these instead copy a contiguous
+window of target memory into NumPy buffer so it can be processed in bulk.
+
+On Linux, SoftDirtySnapshot asks the kernel which pages were written since
+previous refresh (/proc/PID/clear_refs + /proc/PID/pagemap soft-dirty bit)
+and only re-reads those.
+'''
+
+import mmap
+import os
+import time
+from time import sleep
+
+import numpy as np
+
+from locator import pid_from_filename
+
+
+PAGE_SIZE = mmap.PAGESIZE
+SOFT_DIRTY_BIT = 55
+
+
+class Snapshot:
+  '''Preallocated copy of memory[start:start+size], updated by refresh()
+  '''
+
+  memory = None
+  start = None
+  size = None
+  buffer = None
+
+  def __init__(self, memory, start, size):
+    self.memory = memory
+    self.start = start
+    self.size = size
+    self.buffer = np.zeros(size, dtype=np.uint8)
+
+  def refresh(self):
+    raw = self.memory[self.start:self.start + self.size]
+    # Reads past the end of file or mapping come back short, keep the tail zeroed
+    self.buffer[:len(raw)] = np.frombuffer(raw, dtype=np.uint8)
+    return self.buffer
+
+  def close(self):
+    pass
+
+
+class SoftDirtySnapshot(Snapshot):
+  '''Snapshot of /proc/PID/mem window that only re-reads written pages.
+  Note that clearing soft-dirty bits is process-wide, two of these watching
+  the same process will hide changes from each other.
+  '''
+
+  pid = None
+  address = None
+  first_page = None
+  page_count = None
+  pagemap = None
+  dirty_pages = 0
+
+  def __init__(self, memory, start, size):
+    super().__init__(memory, start, size)
+
+    self.pid = pid_from_filename(memory.handle.name)
+    self.address = memory.base + start
+    self.first_page = self.address // PAGE_SIZE
+    self.page_count = (self.address + size - 1) // PAGE_SIZE - self.first_page + 1
+    self.pagemap = os.open(f'/proc/{self.pid}/pagemap', os.O_RDONLY)
+
+    # Start from full copy, everything after that is tracked by the kernel
+    self.clear()
+    super().refresh()
+    self.dirty_pages = self.page_count
+
+  def clear(self):
+    with open(f'/proc/{self.pid}/clear_refs', 'w') as handle:
+      handle.write('4')
+
+  def dirty(self):
+    '''Indices of pages in window written since last clear
+    '''
+    raw = os.pread(self.pagemap, self.page_count * 8, self.first_page * 8)
+    entries = np.frombuffer(raw, dtype=np.uint64)
+    return np.flatnonzero((entries >> np.uint64(SOFT_DIRTY_BIT)) & np.uint64(1))
+
+  def refresh(self):
+    pages = self.dirty()
+    # Clear before reading, so writes that happen during the read show up next time
+    self.clear()
+    self.dirty_pages = len(pages)
+    if not len(pages):
+      return self.buffer
+
+    # Read runs of neighbouring pages in one go
+    breaks = np.flatnonzero(np.diff(pages) != 1) + 1
+    for run in np.split(pages, breaks):
+      low = max((self.first_page + run[0]) * PAGE_SIZE, self.address)
+      high = min((self.first_page + run[-1] + 1) * PAGE_SIZE, self.address + self.size)
+      raw = self.memory[low - self.memory.base:high - self.memory.base]
+      at = low - self.address
+      self.buffer[at:at + len(raw)] = np.frombuffer(raw, dtype=np.uint8)
+
+    return self.buffer
+
+  def close(self):
+    os.close(self.pagemap)
+
+
+def soft_dirty_supported():
+  '''Check that kernel tracks soft-dirty bits by writing into own page
+  '''
+  page = mmap.mmap(-1, PAGE_SIZE)
+  view = np.frombuffer(page, dtype=np.uint8)
+  address = view.ctypes.data
+  try:
+    page[0] = 1
+    with open('/proc/self/clear_refs', 'w') as handle:
+      handle.write('4')
+    page[0] = 2
+    with open('/proc/self/pagemap', 'rb') as handle:
+      handle.seek(address // PAGE_SIZE * 8)
+      entry = int.from_bytes(handle.read(8), 'little')
+    return bool(entry >> SOFT_DIRTY_BIT & 1)
+  except OSError:
+    return False
+  finally:
+    # Mapping can't be closed while array still exports its buffer
+    del view
+    page.close()
+
+
+def open_snapshot(memory, start, size, soft_dirty=False):
+  '''Pick soft-dirty tracking snapshot when asked for and possible
+  '''
+  if soft_dirty and memory.handle.name.startswith('/proc/') and soft_dirty_supported():
+    return SoftDirtySnapshot(memory, start, size)
+  return Snapshot(memory, start, size)
+
+
+def capture(snapshot, duration, frequency):
+  '''Take duration*frequency snapshots at fixed rate into (frames, size) array
+  '''
+
+  count = max(2, int(duration * frequency))
+  frames = np.empty((count, snapshot.size), dtype=np.uint8)
+
+  period = 1 / frequency
+  next_time = time.perf_counter()
+
+  for idx in range(count):
+    frames[idx] = snapshot.refresh()
+
+    next_time += period
+    while time.perf_counter() < next_time:
+      sleep(0)
+
+  return frames
+
+
+def save_capture(filename, frames, start):
+  np.savez_compressed(filename, frames=frames, start=start)
+
+
+def load_capture(filename):
+  with np.load(filename) as archive:
+    return archive['frames'], int(archive['start'])
@@ -0,0 +1,346 @@
+#!/usr/bin/env -S python3 -u
+'''Parameter search for table and order resolvers.
+Uses RAM capture made by scanner.py and static data segment. Index and offset
+candidates are picked from the capture first, then every table address in the
+data segment is tested at once for each (index, offset, table kind) combo.
+
+Good table makes every observed table[index] + offset land inside plausible
+data, and when index changes pointer tends to continue right after previous
+block, as blocks are usually stored back to back.
+'''
+
+import argparse
+from sys import stdout
+
+import numpy as np
+
+from cmd_parser import CustomFormatter, parse_addr
+from memory_reader import Memory
+from pointer_logger import resolve_address
+from scanner import score_series
+from snapshot import load_capture
+from util import int_autobase
+
+
+def plausible_mask(data, min_run=16):
+  '''True for bytes that are not part of long run of identical values,
+  padding and unused space are rarely pointed at.
+  '''
+  starts = np.flatnonzero(np.diff(data, prepend=np.int16(-1)) != 0)
+  lengths = np.diff(np.append(starts, len(data)))
+  return np.repeat(lengths, lengths) < min_run
+
+
+def plausible_at(mask, ptr):
+  return (ptr < len(mask)) & mask[np.minimum(ptr, len(mask) - 1)]
+
+
+def table_words(data, stride, big_endian):
+  '''Value of every table entry candidate, entry N starts at byte N.
+  stride=0 means normal LE word, otherwise lo and hi are stride bytes apart.
+  '''
+  values = data.astype(np.int32)
+  gap = stride or 1
+  first, second = values[:-gap], values[gap:]
+  if big_endian:
+    return (first << 8) | second
+  return first | (second << 8)
+
+
+def series_candidates(frames, kinds):
+  '''Yield (address, kind, values) for byte and LE word value series.
+  Words are only produced where both bytes change, otherwise they would just
+  duplicate byte candidates.
+  '''
+  values = frames.astype(np.int32)
+  if 'b' in kinds:
+    yield np.arange(frames.shape[1]), 'b', values
+  if 'w' in kinds:
+    words = values[:, :-1] | (values[:, 1:] << 8)
+    moved = (values[1:] != values[:-1]).any(axis=0)
+    keep = np.flatnonzero(moved[:-1] & moved[1:])
+    yield keep, 'w', words[:, keep]
+
+
+def pick_pairs(frames, jump_threshold, pairs, kinds='bw', index_kinds='bw'):
+  '''Choose (index, offset) candidates whose changes line up.
+  Index changes rarely, offset steps forward and resets around index changes.
+  index_kinds limits index candidates, order resolver only has byte index.
+  '''
+  count = frames.shape[0]
+
+  indices = []
+  offsets = []
+  for address, kind, values in series_candidates(frames, kinds):
+    delta = np.diff(values, axis=0)
+    moved = np.count_nonzero(delta, axis=0)
+    span = values.max(axis=0) - values.min(axis=0)
+
+    rare = (moved > 0) & (moved <= count // 8) & (span < 0x1000) & (kind in index_kinds)
+    for col in np.flatnonzero(rare):
+      indices.append((address[col], kind, values[:, col]))
+
+    score, steps, _jumps = score_series(values, jump_threshold)
+    for col in np.argsort(-score)[:32]:
+      if score[col] > 0:
+        offsets.append((score[col], address[col], kind, values[:, col]))
+
+  if not indices or not offsets:
+    return []
+
+  # Changes of every index candidate against resets of every offset candidate
+  changed = np.array([np.diff(x[2]) != 0 for x in indices], dtype=np.float32)
+  resets = []
+  for _score, _address, _kind, series in offsets:
+    delta = np.diff(series)
+    reset = (delta < 0) | (delta > jump_threshold)
+    # Drivers may update index and offset on neighbouring ticks
+    reset[1:] |= reset[:-1].copy()
+    reset[:-1] |= reset[1:].copy()
+    resets.append(reset)
+  resets = np.array(resets, dtype=np.float32)
+
+  agreement = (changed @ resets.T) / changed.sum(axis=1)[:, None]
+  agreement *= np.array([x[0] for x in offsets])[None, :]
+
+  result = []
+  for flat in np.argsort(-agreement, axis=None):
+    i, o = np.unravel_index(flat, agreement.shape)
+    if agreement[i, o] <= 0 or len(result) >= pairs:
+      break
+    if indices[i][0] == offsets[o][1]:
+      continue
+    result.append((indices[i], offsets[o][1:]))
+
+  return result
+
+
+def slot_profile(slot_series, offset_series):
+  '''Collapse per-frame (slot, offset) series into distinct slots, offset
+  bounds per slot and slot transitions.
+  '''
+  slots, inverse = np.unique(slot_series, return_inverse=True)
+
+  low = np.full(len(slots), np.iinfo(np.int32).max)
+  high = np.full(len(slots), np.iinfo(np.int32).min)
+  np.minimum.at(low, inverse, offset_series)
+  np.maximum.at(high, inverse, offset_series)
+
+  change = np.flatnonzero(slot_series[1:] != slot_series[:-1])
+  transitions = (
+    inverse[change], offset_series[change],
+    inverse[change + 1], offset_series[change + 1])
+
+  return slots, low, high, transitions
+
+
+def score_tables(words, mask, tables, profile, scale, jump_threshold):
+  '''Score every table address in `tables` for given slot profile.
+  '''
+  slots, low, high, (prev_slot, prev_off, next_slot, next_off) = profile
+
+  pos = tables[None, :] + slots[:, None] * scale
+  inside = pos < len(words)
+  entries = words[np.minimum(pos, len(words) - 1)]
+
+  valid = inside \
+    & plausible_at(mask, entries + low[:, None]) \
+    & plausible_at(mask, entries + high[:, None])
+  in_range = valid.mean(axis=0)
+
+  if len(prev_slot):
+    delta = (entries[next_slot] + next_off[:, None]) - (entries[prev_slot] + prev_off[:, None])
+    smooth = ((delta > 0) & (delta <= jump_threshold)).mean(axis=0)
+  else:
+    smooth = np.zeros(len(tables))
+
+  if len(slots) > 1:
+    ordered = np.diff(entries, axis=0)
+    ascending = (ordered > 0).mean(axis=0)
+    distinct = (np.diff(np.sort(entries, axis=0), axis=0) != 0).mean(axis=0)
+  else:
+    ascending = distinct = np.zeros(len(tables))
+
+  score = in_range ** 4 * (smooth + 0.5 * ascending + 0.5 * distinct)
+  score[in_range < 0.9] = 0
+  return score
+
+
+def table_variants(method, strides):
+  '''(flags, stride, big endian, index scale) per supported table layout
+  '''
+  variants = [('', 0, False, 2)]
+  if method == 'table':
+    variants.append(('d', 0, False, 1))
+  for stride in strides:
+    variants.append(('', stride, False, 1))
+    variants.append(('B', stride, True, 1))
+  return variants
+
+
+def format_settings(method, table, index, offset, flags, stride, order_table=None):
+  parts = []
+  if method == 'order':
+    parts.extend([f'0x{order_table:x}', f'0x{table:x}', f'0x{index:x}', f'0x{offset:x}'])
+  else:
+    parts.extend([f'0x{table:x}', f'0x{index:x}', f'0x{offset:x}'])
+  if flags:
+    parts.append(f'flags={flags}')
+  if stride:
+    parts.append(f'data_table_stride={stride}')
+  return f'-M {method} ' + ':'.join(parts)
+
+
+def solve(frames, start, data, method, tables, strides, jump_threshold,
+          pairs=8, orders=None, max_patterns=0x80, max_orders=1024, table_probe=4, top=3):
+
+  mask = plausible_mask(data)
+  results = []
+
+  for (index_addr, index_kind, index_series), (offset_addr, offset_kind, offset_series) \
+      in pick_pairs(frames, jump_threshold, pairs, index_kinds='b' if method == 'order' else 'bw'):
+
+    flags = ('w' if index_kind == 'w' else '') + ('W' if offset_kind == 'w' else '')
+    index_addr += start
+    offset_addr += start
+
+    for vflags, stride, big_endian, scale in table_variants(method, strides):
+      words = table_words(data, stride, big_endian)
+      candidates = tables[tables + scale * table_probe < len(words)]
+      # First few entries of a real table point at data, drop the rest early
+      probe = words[candidates[None, :] + np.arange(table_probe)[:, None] * scale]
+      candidates = candidates[plausible_at(mask, probe).all(axis=0)]
+
+      if method == 'table':
+        profile = slot_profile(index_series, offset_series)
+        score = score_tables(words, mask, candidates, profile, scale, jump_threshold)
+        for col in np.argsort(-score)[:top]:
+          if score[col] > 0:
+            results.append((score[col], format_settings(
+              method, candidates[col], index_addr, offset_addr, flags + vflags, stride)))
+        continue
+
+      # Order table maps order index to pattern number, which is table slot
+      order_values, order_inverse = np.unique(index_series, return_inverse=True)
+      order_tables = orders if orders is not None else tables
+      order_tables = order_tables[order_tables + order_values.max() < len(data)]
+      patterns = data[order_tables[None, :] + order_values[:, None]].astype(np.int32)
+      usable = np.flatnonzero((patterns < max_patterns).all(axis=0))
+
+      # Many order tables yield the same pattern list, test each list once
+      # and prefer lists that visit more distinct patterns
+      _lists, first = np.unique(patterns[:, usable], axis=1, return_index=True)
+      usable = usable[first]
+      variety = (np.diff(np.sort(patterns[:, usable], axis=0), axis=0) != 0).sum(axis=0)
+      usable = usable[np.argsort(-variety, kind='stable')[:max_orders]]
+
+      for col in usable:
+        profile = slot_profile(patterns[:, col][order_inverse], offset_series)
+        score = score_tables(words, mask, candidates, profile, scale, jump_threshold)
+        # Padding before real order list maps every order to the same pattern
+        score *= len(profile[0]) / len(order_values)
+        best = np.argmax(score)
+        if score[best] > 0:
+          results.append((score[best], format_settings(
+            method, candidates[best], index_addr, offset_addr, flags + vflags, stride,
+            order_table=order_tables[col])))
+
+  results.sort(key=lambda x: -x[0])
+  return results
+
+
+def parse_range(tokens):
+  low, high = tokens.split(':')
+  return int_autobase(low), int_autobase(high)
+
+
+def get_parser():
+
+  parser = argparse.ArgumentParser(
+    description='Search table/order resolver settings using RAM capture '
+                'and data segment.',
+    formatter_class=CustomFormatter)
+
+  parser.add_argument(
+    'capture',
+    type=str,
+    help='RAM capture saved by scanner.py -o')
+  parser.add_argument(
+    'filename',
+    type=str,
+    help='File to read data segment from: ROM dump or memory file')
+  parser.add_argument(
+    '-r', '--data-ptr',
+    type=parse_addr,
+    default=parse_addr('0'),
+    help='Data segment location in filename, same format as ram_ptr')
+  parser.add_argument(
+    '-n', '--size',
+    type=int_autobase,
+    default=0x10000,
+    help='Data segment size')
+  parser.add_argument(
+    '-M', '--resolve-method',
+    type=str,
+    default='table',
+    choices=('table', 'order'),
+    help='Resolver to search settings for')
+  parser.add_argument(
+    '-T', '--tables',
+    type=parse_range,
+    help='LOW:HIGH range of data table addresses to try, whole segment by default')
+  parser.add_argument(
+    '-O', '--orders',
+    type=parse_range,
+    help='LOW:HIGH range of order table addresses to try, defaults to --tables')
+  parser.add_argument(
+    '-S', '--strides',
+    type=str,
+    default='',
+    help='Colon separated list of vertical table strides to try')
+  parser.add_argument(
+    '-j', '--jump-threshold',
+    type=int_autobase,
+    default=0x10,
+    help='Largest forward step that still counts as normal advance')
+  parser.add_argument(
+    '-p', '--pairs',
+    type=int_autobase,
+    default=8,
+    help='Number of index/offset candidate pairs to test')
+  parser.add_argument(
+    '-t', '--top',
+    type=int_autobase,
+    default=20,
+    help='Print this many best settings')
+
+  return parser
+
+
+def main():
+
+  args = get_parser().parse_args()
+
+  frames, start = load_capture(args.capture)
+
+  data_ptr = resolve_address(*args.data_ptr, args.filename)
+  memory = Memory(args.filename, data_ptr)
+  data = np.frombuffer(memory[0:args.size], dtype=np.uint8)
+  memory.close()
+
+  low, high = args.tables if args.tables else (0, len(data))
+  tables = np.arange(low, min(high, len(data)))
+  orders = np.arange(*args.orders) if args.orders else None
+  strides = [int_autobase(x) for x in args.strides.split(':') if x]
+
+  results = solve(
+    frames, start, data, args.resolve_method, tables, strides,
+    args.jump_threshold, pairs=args.pairs, orders=orders)
+
+  stdout.write(f'{"score":>8s}  settings\n')
+  for score, settings in results[:args.top]:
+    stdout.write(f'{score:8.3f}  {settings}\n')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,96 @@
+import os
+import threading
+
+import pytest
+
+from gdb_memory import GdbMemory, serve
+
+
+@pytest.fixture
+def stub(tmp_path):
+  filename = tmp_path / 'ram.bin'
+  filename.write_bytes(os.urandom(0x4000))
+  server = serve(str(filename), f'gdb://{tmp_path}/stub.sock')
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+
+  yield f'gdb://{tmp_path}/stub.sock', filename.read_bytes()
+  server.shutdown()
+  server.server_close()
+
+
+def recording(memory):
+  '''Remember ranges of every fetch made through memory's connection
+  '''
+  fetches = []
+  fetch = memory.link.fetch
+
+  def wrapper(ranges):
+    fetches.append(list(ranges))
+    return fetch(ranges)
+
+  memory.link.fetch = wrapper
+  return fetches
+
+
+def test_reads_match_file(stub):
+  url, data = stub
+  code = GdbMemory(url, 0)
+  ram = code.window(0x1000)
+
+  try:
+    for _tick in range(3):
+      code.tick()
+      assert code[0x10] == data[0x10:0x11]
+      assert code[0x20:0x24] == data[0x20:0x24]
+      assert ram[0x30:0x32] == data[0x1030:0x1032]
+      # Larger than one packet, split into several requests
+      assert code[0x100:0x3100] == data[0x100:0x3100]
+  finally:
+    ram.close()
+    code.close()
+
+
+def test_one_round_trip_per_stable_tick(stub):
+  url, data = stub
+  code = GdbMemory(url, 0)
+  ram = code.window(0x1000)
+
+  try:
+    for tick in range(6):
+      before = code.round_trips
+      code.tick()
+      ram.tick()
+      assert ram[0x10:0x12] == data[0x1010:0x1012]
+      assert ram[0x200] == data[0x1200:0x1201]
+      assert code[0x800:0x804] == data[0x800:0x804]
+      # Ranges are batched once they were read during both previous ticks
+      if tick >= 2:
+        assert code.round_trips - before == 1
+  finally:
+    ram.close()
+    code.close()
+
+
+def test_dropped_ranges_are_not_requested(stub):
+  url, data = stub
+  memory = GdbMemory(url, 0)
+  fetches = recording(memory)
+
+  def requested(address):
+    return any(start <= address < start + size for ranges in fetches for start, size in ranges)
+
+  try:
+    for _tick in range(3):
+      memory.tick()
+      memory[0x10:0x12]
+      memory[0x2000:0x2002]
+
+    for tick in range(3):
+      memory.tick()
+      fetches.clear()
+      assert memory[0x10:0x12] == data[0x10:0x12]
+      # Range is still in batch right after the tick that skipped it
+      assert requested(0x10) and requested(0x2000) == (tick == 0)
+  finally:
+    memory.close()
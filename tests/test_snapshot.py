@@ -0,0 +1,79 @@
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from memory_reader import Memory
+from snapshot import PAGE_SIZE, SoftDirtySnapshot, soft_dirty_supported
+
+
+PAGES = 8
+
+# Child maps PAGES pages, prints their address and writes page number + value
+# into the first byte of page for every 'PAGE VALUE' line it gets
+CHILD = f'''
+import ctypes, mmap, sys
+page = mmap.mmap(-1, {PAGES} * mmap.PAGESIZE)
+page[:] = bytes(len(page))
+print(ctypes.addressof(ctypes.c_char.from_buffer(page)), flush=True)
+for line in sys.stdin:
+  number, value = map(int, line.split())
+  page[number * mmap.PAGESIZE] = value
+  print('ok', flush=True)
+'''
+
+
+class CountingMemory(Memory):
+  '''Memory that remembers every range read from it
+  '''
+
+  reads = None
+
+  def __getitem__(self, index):
+    self.reads.append((index.start, index.stop) if type(index) == slice else (index, index + 1))
+    return super().__getitem__(index)
+
+
+@pytest.fixture
+def child():
+  process = subprocess.Popen(
+    [sys.executable, '-c', CHILD], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+  address = int(process.stdout.readline())
+
+  def write(number, value):
+    process.stdin.write(f'{number} {value}\n')
+    process.stdin.flush()
+    assert process.stdout.readline() == 'ok\n'
+
+  yield process.pid, address, write
+  process.stdin.close()
+  process.wait()
+
+
+@pytest.mark.skipif(not soft_dirty_supported(), reason='kernel does not track soft-dirty bits')
+def test_refresh_reads_only_dirty_pages(child):
+  pid, address, write = child
+  memory = CountingMemory(f'/proc/{pid}/mem', address)
+  memory.reads = []
+  snapshot = SoftDirtySnapshot(memory, 0, PAGES * PAGE_SIZE)
+
+  try:
+    assert snapshot.dirty_pages == PAGES
+    snapshot.refresh()
+    assert snapshot.dirty_pages == 0
+
+    write(1, 0x11)
+    write(2, 0x22)
+    write(5, 0x55)
+    memory.reads = []
+    buffer = snapshot.refresh()
+
+    assert snapshot.dirty_pages == 3
+    assert memory.reads == [(PAGE_SIZE, 3 * PAGE_SIZE), (5 * PAGE_SIZE, 6 * PAGE_SIZE)]
+    expected = np.frombuffer(memory[0:PAGES * PAGE_SIZE], dtype=np.uint8)
+    assert np.array_equal(buffer, expected)
+    assert buffer[[PAGE_SIZE, 2 * PAGE_SIZE, 5 * PAGE_SIZE]].tolist() == [0x11, 0x22, 0x55]
+  finally:
+    snapshot.close()
+    memory.close()
@@ -0,0 +1,335 @@
+#!/usr/bin/env -S python3 -u
+'''Align two recorded traces of a channel and report where they diverge.
+Steps of both traces are decoded with printer (grammar) into command streams,
+every distinct command line becomes a number and the streams are compared as
+number sequences, so it doesn't matter how commands were grouped into ticks.
+
+Alignment walks both streams at once. Equal runs are skipped with vectorized
+compares, at mismatch both streams are searched ahead within a band for the
+closest place where the next K commands match again (hashes of K-grams), band
+grows until something is found. What lies between is a divergence. Cost is
+linear in trace length plus band sizes at divergences, not quadratic like
+plain diff, and loops don't confuse it as they would unique-anchor diff.
+
+Reported:
+  changed   both sides differ, difflib of the two stretches
+  missing   commands only in A, "missing loop" when they repeat what precedes
+  extra     commands only in B, "extra loop" likewise
+  drift     time of matched commands in B against A, after aligning start
+'''
+
+import argparse
+import difflib
+from collections import namedtuple
+from sys import stdout
+
+import numpy as np
+
+from cmd_parser import CustomFormatter, subargs_parser
+from consts import GRAY, GOLD, BRED, BBLUE, RESET
+from registry import PRINTERS
+from trace_store import TraceReader
+from util import int_autobase
+
+
+K = 8
+BAND = 256
+MAX_BAND = 1 << 20
+
+Stream = namedtuple('Stream', 'ids times steps')
+Divergence = namedtuple('Divergence', 'kind a_start a_end b_start b_end a_time b_time')
+
+
+class Vocabulary:
+  '''Command line <-> number, shared by both streams
+  '''
+
+  ids = None
+  lines = None
+
+  def __init__(self):
+    self.ids = {}
+    self.lines = []
+
+  def __call__(self, line):
+    number = self.ids.get(line)
+    if number is None:
+      number = self.ids[line] = len(self.lines)
+      self.lines.append(line)
+    return number
+
+
+def decode(reader, channel, printer, vocabulary):
+  '''Command stream of channel: command numbers, time and step number of each
+  '''
+  name = reader.channels[reader.channel_code(channel)]
+  code = reader.channels.index(name)
+
+  # Same bytes decode the same way, tunes repeat a lot
+  memo = {}
+  ids, times, steps = [], [], []
+  step = 0
+
+  for number in range(len(reader.blocks)):
+    b_times, channels, _ptrs, _diffs, actions, offsets, blob = reader.block(number)
+    for pos in range(len(b_times)):
+      if channels[pos] != code:
+        continue
+      key = (actions[pos], blob[offsets[pos]:offsets[pos + 1]])
+      decoded = memo.get(key)
+      if decoded is None:
+        printer(*key)
+        decoded = memo[key] = [vocabulary(x) for x in printer.result]
+      ids.extend(decoded)
+      times.extend([b_times[pos]] * len(decoded))
+      steps.extend([step] * len(decoded))
+      step += 1
+
+  return Stream(
+    np.array(ids, dtype=np.int64),
+    np.array(times, dtype=np.int64) / 1e9,
+    np.array(steps, dtype=np.int64))
+
+
+def kgram_hashes(ids, k=K):
+  '''Hash of every k commands starting at each position, wrapping uint64 math
+  '''
+  size = max(len(ids) - k + 1, 0)
+  values = ids.astype(np.uint64) * np.uint64(0x9e3779b97f4a7c15) + np.uint64(1)
+  result = np.zeros(size, dtype=np.uint64)
+  with np.errstate(over='ignore'):
+    for offset in range(k):
+      result = result * np.uint64(0x100000001b3) ^ values[offset:offset + size]
+  return result
+
+
+def run_length(a, b, i, j, chunk=4096):
+  '''How many commands match from a[i], b[j] onwards
+  '''
+  length = 0
+  while i + length < len(a) and j + length < len(b):
+    size = min(chunk, len(a) - i - length, len(b) - j - length)
+    equal = a[i + length:i + length + size] == b[j + length:j + length + size]
+    if equal.all():
+      length += size
+      continue
+    return length + int(np.argmin(equal))
+  return length
+
+
+def resync(hash_a, hash_b, i, j, band):
+  '''Closest (x, y) with hash_a[i + x] == hash_b[j + y] within band,
+  by smallest x + y. None if there is none.
+  '''
+  window_a = hash_a[i:i + band]
+  window_b = hash_b[j:j + band]
+  common, at_a, at_b = np.intersect1d(window_a, window_b, return_indices=True)
+  if not len(common):
+    return None
+
+  # intersect1d gives first occurrence on both sides, which is what we want
+  best = np.argmin(at_a + at_b)
+  return int(at_a[best]), int(at_b[best])
+
+
+def is_repeat(ids, start, end):
+  '''Stretch is a repetition of the same amount of commands right before it
+  '''
+  size = end - start
+  return size > 0 and start >= size and np.array_equal(ids[start - size:start], ids[start:end])
+
+
+def align(a, b, k=K, band=BAND):
+  '''Matched pairs as (a start, b start, length) runs and list of divergences
+  '''
+  hash_a, hash_b = kgram_hashes(a.ids, k), kgram_hashes(b.ids, k)
+  runs, divergences = [], []
+  i = j = 0
+
+  while i < len(a.ids) and j < len(b.ids):
+    length = run_length(a.ids, b.ids, i, j)
+    if length:
+      runs.append((i, j, length))
+      i += length
+      j += length
+      continue
+
+    width = band
+    found = None
+    while found is None and width <= MAX_BAND:
+      found = resync(hash_a, hash_b, i, j, width)
+      width *= 2
+    if found is None:
+      break
+
+    # Hash collision right at the mismatch, step over it
+    x, y = found if found != (0, 0) else (1, 1)
+    divergences.append(classify(a, b, i, i + x, j, j + y))
+    i += x
+    j += y
+
+  # Whatever is left on either side didn't match anything
+  if i < len(a.ids) or j < len(b.ids):
+    divergences.append(classify(a, b, i, len(a.ids), j, len(b.ids)))
+
+  return runs, divergences
+
+
+def classify(a, b, a_start, a_end, b_start, b_end):
+  a_time = a.times[min(a_start, len(a.times) - 1)] if len(a.times) else 0.0
+  b_time = b.times[min(b_start, len(b.times) - 1)] if len(b.times) else 0.0
+
+  if a_end > a_start and b_end > b_start:
+    kind = 'changed'
+  elif a_end > a_start:
+    kind = 'missing loop' if is_repeat(a.ids, a_start, a_end) else 'missing'
+  else:
+    kind = 'extra loop' if is_repeat(b.ids, b_start, b_end) else 'extra'
+  return Divergence(kind, a_start, a_end, b_start, b_end, float(a_time), float(b_time))
+
+
+def drift(a, b, runs):
+  '''Time of B minus time of A for matched commands, start offset removed.
+  Returns A times, drifts and linear fit slope (relative tempo difference)
+  '''
+  if not runs:
+    return np.zeros(0), np.zeros(0), 0.0
+
+  a_idx = np.concatenate([np.arange(i, i + n) for i, _j, n in runs])
+  b_idx = np.concatenate([np.arange(j, j + n) for _i, j, n in runs])
+  a_times, b_times = a.times[a_idx], b.times[b_idx]
+  offset = b_times[0] - a_times[0]
+  drifts = b_times - a_times - offset
+
+  slope = 0.0
+  if len(a_times) > 1 and np.ptp(a_times) > 0:
+    slope = float(np.polyfit(a_times, drifts, 1)[0])
+  return a_times, drifts, slope
+
+
+def print_divergence(div, a, b, lines, context=4):
+  stdout.write(
+    f'{GOLD}{div.kind:>12s}{RESET} A {div.a_start}+{div.a_end - div.a_start} @{div.a_time:.3f}s'
+    f'  B {div.b_start}+{div.b_end - div.b_start} @{div.b_time:.3f}s\n')
+
+  left = [lines[x] for x in a.ids[div.a_start:div.a_end][:context * 4]]
+  right = [lines[x] for x in b.ids[div.b_start:div.b_end][:context * 4]]
+  if div.kind == 'changed':
+    for row in list(difflib.unified_diff(left, right, 'A', 'B', n=1, lineterm=''))[2:context * 4 + 2]:
+      color = BRED if row.startswith('-') else BBLUE if row.startswith('+') else GRAY
+      stdout.write(f'             {color}{row}{RESET}\n')
+  else:
+    sign, color = ('-', BRED) if div.a_end > div.a_start else ('+', BBLUE)
+    for row in (left or right)[:context]:
+      stdout.write(f'             {color}{sign}{row}{RESET}\n')
+    if len(left or right) > context:
+      stdout.write(f'             {GRAY}…{RESET}\n')
+
+
+def get_parser():
+
+  parser = argparse.ArgumentParser(
+    description='Align two recorded traces of a channel and list where they diverge.',
+    formatter_class=CustomFormatter)
+
+  parser.add_argument(
+    'trace_a',
+    type=str,
+    help='Reference trace, recorded with session.py --record')
+  parser.add_argument(
+    'trace_b',
+    type=str,
+    help='Trace to compare with it')
+  parser.add_argument(
+    '-c', '--channel',
+    type=str,
+    default='0',
+    help='Channel in trace A, by name or number')
+  parser.add_argument(
+    '-C', '--channel-b',
+    type=str,
+    help='Channel in trace B, same as in A by default')
+  parser.add_argument(
+    '-P', '--printer-class',
+    choices=PRINTERS,
+    default='map',
+    help='Printer decoding steps into commands')
+  parser.add_argument(
+    '-p', '--printer-settings',
+    type=str,
+    default='',
+    help='Printer settings, grammar file for map printer')
+  parser.add_argument(
+    '-k', '--kgram',
+    type=int_autobase,
+    default=K,
+    help='Commands that have to match again to end divergence')
+  parser.add_argument(
+    '-b', '--band',
+    type=int_autobase,
+    default=BAND,
+    help='Initial look-ahead when resynchronizing, doubled until match is found')
+  parser.add_argument(
+    '-m', '--max-report',
+    type=int_autobase,
+    default=20,
+    help='List at most this many divergences')
+  parser.add_argument(
+    '-d', '--drift',
+    type=float,
+    default=0.05,
+    help='Report places where timing drift changes by more than this many seconds')
+
+  return parser
+
+
+def main():
+
+  args = get_parser().parse_args()
+  s_args, s_kwargs = subargs_parser(args.printer_settings)
+  printer = PRINTERS[args.printer_class](*s_args, **s_kwargs)
+  vocabulary = Vocabulary()
+
+  reader_a, reader_b = TraceReader(args.trace_a), TraceReader(args.trace_b)
+  a = decode(reader_a, args.channel, printer, vocabulary)
+  b = decode(reader_b, args.channel_b or args.channel, printer, vocabulary)
+  reader_a.close()
+  reader_b.close()
+
+  runs, divergences = align(a, b, args.kgram, args.band)
+  matched = sum(n for _i, _j, n in runs)
+
+  stdout.write(
+    f'A: {len(a.ids)} commands in {a.steps[-1] + 1 if len(a.steps) else 0} steps, '
+    f'B: {len(b.ids)} commands in {b.steps[-1] + 1 if len(b.steps) else 0} steps, '
+    f'{len(vocabulary.lines)} distinct\n'
+    f'{matched} matched ({matched / max(len(a.ids), 1):.1%} of A), {len(divergences)} divergences\n')
+
+  kinds = {}
+  for div in divergences:
+    kinds[div.kind] = kinds.get(div.kind, 0) + 1
+  if kinds:
+    stdout.write('  ' + ', '.join(f'{kind}: {count}' for kind, count in sorted(kinds.items())) + '\n')
+
+  a_times, drifts, slope = drift(a, b, runs)
+  if len(drifts):
+    stdout.write(
+      f'drift: {drifts[-1]:+.3f}s at end, {drifts.min():+.3f}..{drifts.max():+.3f}s, '
+      f'B tempo {slope:+.3%} against A\n')
+
+    # Places where drift moved by more than threshold since last report
+    reported = 0.0
+    for when, value in zip(a_times, drifts):
+      if abs(value - reported) > args.drift:
+        stdout.write(f'  {GRAY}{when:10.3f}s{RESET} drift {value:+.3f}s\n')
+        reported = value
+
+  stdout.write('\n')
+  for div in divergences[:args.max_report]:
+    print_divergence(div, a, b, vocabulary.lines)
+  if len(divergences) > args.max_report:
+    stdout.write(f'{GRAY}… {len(divergences) - args.max_report} more{RESET}\n')
+
+
+if __name__ == '__main__':
+  main()
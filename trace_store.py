@@ -0,0 +1,342 @@
+#!/usr/bin/env -S python3 -u
+'''Columnar storage for recorded pointer steps.
+Events are grouped into blocks of up to BLOCK_SIZE. Inside block every field
+is its own column: timestamps and pointers delta-encoded, channel and action
+codes as bytes, consumed bytes in one shared blob. Block is zlib-compressed.
+
+File ends with index: per-block time range and file offset for seeking by
+time, marks (event number, text) like detected loop bounds, plus all pointers
+sorted with their event numbers for seeking by address. Both queries bisect, only matching blocks get decompressed.
+
+  magic | block | block | ... | index | index offset (8 bytes) | magic
+'''
+
+import argparse
+import json
+import struct
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple, OrderedDict
+from sys import stdout
+
+from consts import ACTION_NAMES
+from util import int_autobase
+
+
+MAGIC = b'PTRTRC01'
+BLOCK_SIZE = 4096
+
+TraceEvent = namedtuple('TraceEvent', 'index time channel ptr diff action data')
+
+# count, first time, last time, column byte sizes: times, ptrs, diffs, lengths
+BLOCK_HEADER = struct.Struct('<IqqIIII')
+
+
+def delta_encode(values):
+  result = array('q', values)
+  for idx in range(len(result) - 1, 0, -1):
+    result[idx] -= result[idx - 1]
+  return result
+
+
+def delta_decode(values):
+  result = array('q', values)
+  for idx in range(1, len(result)):
+    result[idx] += result[idx - 1]
+  return result
+
+
+class TraceWriter:
+
+  handle = None
+  channels = None
+  blocks = None
+  pointers = None
+  count = 0
+  pending = None
+  marks = None
+
+  def __init__(self, filename, channels=()):
+    self.handle = open(filename, 'wb')
+    self.handle.write(MAGIC)
+    self.channels = {str(name): idx for idx, name in enumerate(channels)}
+    self.blocks = []
+    self.pointers = array('q')
+    self.pending = []
+    self.marks = []
+
+  def channel_code(self, name):
+    name = str(name)
+    if name not in self.channels:
+      self.channels[name] = len(self.channels)
+    return self.channels[name]
+
+  def write(self, event):
+    '''Store StepEvent (or anything with the same fields)
+    '''
+    self.pending.append((
+      round(event.time * 1e9), self.channel_code(event.channel),
+      event.ptr, event.diff, event.action, bytes(event.data)))
+    self.pointers.append(event.ptr)
+    self.count += 1
+
+    if len(self.pending) >= BLOCK_SIZE:
+      self.flush()
+
+  def mark(self, text, index=None):
+    '''Note text at event number, next event by default, e.g. loop bounds
+    '''
+    self.marks.append((self.count if index is None else index, text))
+
+  def flush(self):
+    if not self.pending:
+      return
+
+    times, channels, ptrs, diffs, actions, data = zip(*self.pending)
+    columns = [
+      delta_encode(times).tobytes(),
+      delta_encode(ptrs).tobytes(),
+      array('q', diffs).tobytes(),
+      array('H', (len(x) for x in data)).tobytes(),
+    ]
+    payload = zlib.compress(
+      b''.join(columns) + bytes(channels) + bytes(actions) + b''.join(data))
+
+    self.blocks.append((self.handle.tell(), len(self.pending), times[0], times[-1]))
+    self.handle.write(BLOCK_HEADER.pack(
+      len(self.pending), times[0], times[-1], *(len(x) for x in columns)))
+    self.handle.write(struct.pack('<I', len(payload)))
+    self.handle.write(payload)
+    self.pending = []
+
+  def close(self):
+    self.flush()
+
+    order = sorted(range(len(self.pointers)), key=self.pointers.__getitem__)
+    index = {
+      'channels': sorted(self.channels, key=self.channels.get),
+      'count': self.count,
+      'blocks': self.blocks,
+      'marks': sorted(self.marks),
+    }
+    meta = json.dumps(index).encode()
+    sorted_ptrs = zlib.compress(array('q', (self.pointers[x] for x in order)).tobytes())
+    sorted_ids = zlib.compress(array('q', order).tobytes())
+
+    offset = self.handle.tell()
+    for part in (meta, sorted_ptrs, sorted_ids):
+      self.handle.write(struct.pack('<Q', len(part)))
+      self.handle.write(part)
+    self.handle.write(struct.pack('<Q', offset) + MAGIC)
+    self.handle.close()
+
+
+class TraceReader:
+
+  handle = None
+  channels = None
+  count = None
+  blocks = None
+  block_starts = None
+  block_times = None
+  sorted_ptrs = None
+  sorted_ids = None
+  marks = None
+  cache = None
+
+  def __init__(self, filename, cache_blocks=16):
+    self.handle = open(filename, 'rb')
+    if self.handle.read(len(MAGIC)) != MAGIC:
+      raise ValueError(f'{filename} is not a trace file')
+
+    self.handle.seek(-8 - len(MAGIC), 2)
+    offset, = struct.unpack('<Q', self.handle.read(8))
+    self.handle.seek(offset)
+
+    parts = []
+    for _idx in range(3):
+      size, = struct.unpack('<Q', self.handle.read(8))
+      parts.append(self.handle.read(size))
+
+    index = json.loads(parts[0])
+    self.channels = index['channels']
+    self.count = index['count']
+    self.blocks = index['blocks']
+    self.marks = [tuple(x) for x in index.get('marks', [])]
+    self.sorted_ptrs = array('q', zlib.decompress(parts[1]))
+    self.sorted_ids = array('q', zlib.decompress(parts[2]))
+
+    # First event number and first timestamp of every block, for bisecting
+    self.block_starts = array('q', [0])
+    for _offset, count, _first, _last in self.blocks:
+      self.block_starts.append(self.block_starts[-1] + count)
+    self.block_times = array('q', (x[2] for x in self.blocks))
+
+    self.cache = OrderedDict()
+    self.cache_blocks = cache_blocks
+
+  def block(self, number):
+    '''Decoded columns of block: times, channels, ptrs, diffs, actions,
+    data offsets and data blob
+    '''
+    if number in self.cache:
+      self.cache.move_to_end(number)
+      return self.cache[number]
+
+    offset, _count, _first, _last = self.blocks[number]
+    self.handle.seek(offset)
+    count, _first, _last, *sizes = BLOCK_HEADER.unpack(self.handle.read(BLOCK_HEADER.size))
+    size, = struct.unpack('<I', self.handle.read(4))
+    payload = zlib.decompress(self.handle.read(size))
+
+    pos = 0
+    columns = []
+    for kind, size in zip('qqqH', sizes):
+      columns.append(array(kind, payload[pos:pos + size]))
+      pos += size
+    times, ptrs, diffs, lengths = columns
+    channels = payload[pos:pos + count]
+    actions = payload[pos + count:pos + count * 2]
+    blob = payload[pos + count * 2:]
+
+    offsets = array('q', [0])
+    for length in lengths:
+      offsets.append(offsets[-1] + length)
+
+    block = (delta_decode(times), channels, delta_decode(ptrs), diffs, actions, offsets, blob)
+    self.cache[number] = block
+    if len(self.cache) > self.cache_blocks:
+      self.cache.popitem(last=False)
+    return block
+
+  def event(self, index):
+    number = bisect_right(self.block_starts, index) - 1
+    times, channels, ptrs, diffs, actions, offsets, blob = self.block(number)
+    pos = index - self.block_starts[number]
+    return TraceEvent(
+      index, times[pos] / 1e9, self.channels[channels[pos]], ptrs[pos], diffs[pos],
+      actions[pos], blob[offsets[pos]:offsets[pos + 1]])
+
+  def events(self, start=0, stop=None):
+    stop = self.count if stop is None else min(stop, self.count)
+    for index in range(start, stop):
+      yield self.event(index)
+
+  def channel_code(self, channel):
+    '''Channel can be given by name or by its number in the trace
+    '''
+    if str(channel) in self.channels:
+      return self.channels.index(str(channel))
+    return int_autobase(channel)
+
+  def seek_time(self, seconds):
+    '''Number of the first event at or after given time
+    '''
+    if seconds == float('inf'):
+      return self.count
+    target = round(seconds * 1e9)
+    number = max(0, bisect_right(self.block_times, target) - 1)
+    while number < len(self.blocks):
+      times = self.block(number)[0]
+      pos = bisect_left(times, target)
+      if pos < len(times):
+        return self.block_starts[number] + pos
+      number += 1
+    return self.count
+
+  def at_pointer(self, ptr, channel=None):
+    '''Every event that landed on ptr, in time order
+    '''
+    low = bisect_left(self.sorted_ptrs, ptr)
+    high = bisect_right(self.sorted_ptrs, ptr)
+    name = None if channel is None else self.channels[self.channel_code(channel)]
+
+    for index in sorted(self.sorted_ids[low:high]):
+      event = self.event(index)
+      if name is None or event.channel == name:
+        yield event
+
+  def between(self, start, stop, action=None, channel=None):
+    '''Events with start <= time < stop, optionally of given action and channel
+    '''
+    name = None if channel is None else self.channels[self.channel_code(channel)]
+    for index in range(self.seek_time(start), self.seek_time(stop)):
+      event = self.event(index)
+      if action is not None and event.action != action:
+        continue
+      if name is not None and event.channel != name:
+        continue
+      yield event
+
+  def close(self):
+    self.handle.close()
+
+
+def get_parser():
+
+  parser = argparse.ArgumentParser(
+    description='Query recorded trace file.')
+
+  parser.add_argument(
+    'filename',
+    type=str,
+    help='Trace file recorded with session.py --record')
+  parser.add_argument(
+    '-p', '--ptr',
+    type=int_autobase,
+    help='Only events that landed on this pointer')
+  parser.add_argument(
+    '-c', '--channel',
+    type=str,
+    help='Only events of this channel, by name or number')
+  parser.add_argument(
+    '-a', '--action',
+    type=str,
+    choices=list(ACTION_NAMES.values()),
+    help='Only events of this kind')
+  parser.add_argument(
+    '-s', '--start',
+    type=float,
+    default=0,
+    help='Only events after this many seconds')
+  parser.add_argument(
+    '-e', '--end',
+    type=float,
+    default=float('inf'),
+    help='Only events before this many seconds')
+
+  return parser
+
+
+def main():
+
+  args = get_parser().parse_args()
+  reader = TraceReader(args.filename)
+  action = None
+  if args.action:
+    action = next(code for code, name in ACTION_NAMES.items() if name == args.action)
+
+  if args.ptr is not None:
+    events = (
+      x for x in reader.at_pointer(args.ptr, args.channel)
+      if args.start <= x.time < args.end and (action is None or x.action == action))
+  else:
+    events = reader.between(args.start, args.end, action, args.channel)
+
+  marks = {}
+  for index, text in reader.marks:
+    marks.setdefault(index, []).append(text)
+
+  for event in events:
+    for text in marks.get(event.index, ()):
+      stdout.write(f'── {text} ──\n')
+    stdout.write(
+      f'{event.time:12.6f} {event.channel:>6s} {event.ptr:06x} {event.diff:+6x} '
+      f'{ACTION_NAMES[event.action]} {event.data.hex(" ")}\n')
+
+  reader.close()
+
+
+if __name__ == '__main__':
+  main()
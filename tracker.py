@@ -0,0 +1,299 @@
+'''Library-level pointer tracking.
+Tracker does what pointer_logger mainloop does, minus the terminal: polls one
+or more channels sharing the same memory readers and reports every pointer
+change as StepEvent. Printer is optional, without it no formatting is done.
+
+  tracker = Tracker(code, data)
+  tracker.add_channel('ch1', 'table', '0x66ec:0xef:0xf3:flags=d')
+  for event in tracker:
+    ...
+
+  async for event in tracker:
+    ...
+
+TrackerGroup runs several trackers (one per target) on a single asyncio loop
+and merges their steps into one time ordered stream.
+'''
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import namedtuple
+from time import sleep
+
+from cmd_parser import subargs_parser
+from consts import FWRD, FJMP, BJMP
+from memory_reader import Pointer
+from registry import RESOLVERS
+
+
+StepEvent = namedtuple(
+  'StepEvent',
+  'time channel ptr old_ptr diff action data info lines prefix suffix jump_addr')
+
+
+class Channel:
+  '''Single tracked pointer: resolver, optional printer and last position
+  '''
+
+  name = None
+  resolver = None
+  printer = None
+  shift = 0
+  ptr = None
+
+  def __init__(self, name, resolver, printer=None, shift=0):
+    self.name = name
+    self.resolver = resolver
+    self.printer = printer
+    self.shift = shift
+
+
+class Tracker:
+
+  code = None
+  data = None
+  channels = None
+  jump_threshold = None
+  preview = None
+  frequency = None
+  started = None
+  target = None
+  watches = None
+  sample = None
+
+  def __init__(self, code, data=None, channels=(), jump_threshold=0x10, preview=4, frequency=120,
+               target=None):
+    self.code = code
+    self.data = code if data is None else data
+    self.channels = list(channels)
+    self.jump_threshold = jump_threshold
+    self.preview = preview
+    self.frequency = frequency
+    self.started = time.perf_counter()
+    self.target = target
+    self.watches = {}
+
+  def add_channel(self, name, method, settings, printer=None, shift=0):
+    '''Build resolver by its command line name and settings string
+    '''
+    s_args, s_kwargs = subargs_parser(settings)
+    resolver = RESOLVERS[method](self.code, *s_args, **s_kwargs)
+    channel = Channel(name, resolver, printer, shift)
+    self.channels.append(channel)
+    return channel
+
+  def watch(self, key):
+    '''Read RAM value, key is (target, pointer spec), right after every step
+    into sample dict under that key. Reading it in the same thread as the
+    step keeps it consistent with it.
+    '''
+    target, spec = key
+    if target is not None and target != self.target:
+      raise ValueError(f'Unknown target {target}')
+    self.watches[key] = Pointer(self.code, spec, default_kind='b')
+    self.sample = {}
+
+  def poll(self, channel, now):
+    old_info = channel.resolver.info
+    ptr = channel.resolver(self.code, self.data) + channel.shift
+    old_ptr = channel.ptr
+    channel.ptr = ptr
+
+    # First poll only establishes the position
+    if old_ptr is None or ptr == old_ptr:
+      return None
+
+    diff = ptr - old_ptr
+    if diff > self.jump_threshold or diff < 0:
+      action = FJMP if diff > 0 else BJMP
+      tokens = self.data[old_ptr:old_ptr + self.preview]
+    else:
+      action = FWRD
+      tokens = self.data[old_ptr:old_ptr + diff]
+
+    lines = prefix = suffix = jump_addr = None
+    printer = channel.printer
+    if printer is not None:
+      printer(action, tokens)
+      lines = list(printer.result)
+      prefix, suffix, jump_addr = printer.prefix, printer.suffix, printer.jump_addr
+
+    return StepEvent(
+      now, channel.name, ptr, old_ptr, diff, action, bytes(tokens), old_info,
+      lines, prefix, suffix, jump_addr)
+
+  def step(self):
+    '''Poll every channel once, return list of events for channels that moved
+    '''
+    now = time.perf_counter() - self.started
+    self.code.tick()
+    if self.data is not self.code:
+      self.data.tick()
+    events = []
+    for channel in self.channels:
+      event = self.poll(channel, now)
+      if event is not None:
+        events.append(event)
+
+    if self.watches:
+      self.sample = {key: pointer() for key, pointer in self.watches.items()}
+    return events
+
+  def ticks(self):
+    '''Paced polling, yields list of events every tick, empty when nothing moved
+    '''
+    period = 1 / self.frequency
+    next_time = time.perf_counter()
+
+    while True:
+      yield self.step()
+
+      next_time += period
+      while time.perf_counter() < next_time:
+        sleep(0)
+
+  def __iter__(self):
+    for events in self.ticks():
+      yield from events
+
+  async def steps(self):
+    '''Async ticks(), sample belongs to the last list until the next one
+    is asked for
+    '''
+    # Reads are blocking syscalls, keep them off the event loop
+    loop = asyncio.get_running_loop()
+    period = 1 / self.frequency
+    next_time = loop.time()
+
+    while True:
+      yield await loop.run_in_executor(None, self.step)
+
+      next_time += period
+      delay = next_time - loop.time()
+      if delay < 0:
+        next_time = loop.time()
+        delay = 0
+      await asyncio.sleep(delay)
+
+  async def __aiter__(self):
+    async for events in self.steps():
+      for event in events:
+        yield event
+
+  def close(self):
+    self.code.close()
+    if self.data is not self.code:
+      self.data.close()
+
+
+class TrackerGroup:
+  '''Several trackers polled concurrently, each with its own readers and
+  channels. Every tracker runs as async iterator with blocking reads in the
+  default thread pool, steps are stamped with the same clock and handed out
+  in time order. Quacks like Tracker for ticks(), iteration and close().
+  '''
+
+  trackers = None
+  channels = None
+  frequency = None
+  started = None
+  sample = None
+
+  def __init__(self, trackers):
+    self.trackers = list(trackers)
+    self.channels = [x for tracker in self.trackers for x in tracker.channels]
+    self.frequency = max(x.frequency for x in self.trackers)
+    self.started = time.perf_counter()
+    for tracker in self.trackers:
+      tracker.started = self.started
+
+  def watch(self, key):
+    '''Same as Tracker.watch(), RAM of which target has to be said. sample
+    has latest values of every watch as of the last handed out tick.
+    '''
+    target, spec = key
+    if target is None:
+      raise ValueError(f'ram[{spec}] needs target in multi-target session, e.g. {self.trackers[0].target}.ram[{spec}]')
+    for tracker in self.trackers:
+      if tracker.target == target:
+        self.sample = {} if self.sample is None else self.sample
+        return tracker.watch(key)
+    raise ValueError(f'Unknown target {target}')
+
+  async def merged(self):
+    '''Lists of steps once per period of the fastest tracker. Steps are held
+    back for one period, so that a slower read of another target can't
+    deliver an earlier step after later ones were already handed out.
+    Watched RAM samples are held back the same way and go to sample.
+    '''
+    pending = []
+    samples = []
+    order = itertools.count()
+
+    async def pump(tracker):
+      async for events in tracker.steps():
+        for event in events:
+          heapq.heappush(pending, (event.time, next(order), event))
+        if tracker.sample is not None:
+          now = time.perf_counter() - self.started
+          heapq.heappush(samples, (now, next(order), tracker.sample))
+
+    tasks = [asyncio.create_task(pump(x)) for x in self.trackers]
+    loop = asyncio.get_running_loop()
+    period = 1 / self.frequency
+    next_time = loop.time()
+
+    try:
+      while True:
+        next_time += period
+        await asyncio.sleep(max(0, next_time - loop.time()))
+        for task in tasks:
+          if task.done():
+            task.result()  # Re-raise read errors here
+
+        horizon = time.perf_counter() - self.started - period
+        events = []
+        while pending and pending[0][0] <= horizon:
+          events.append(heapq.heappop(pending)[2])
+        while samples and samples[0][0] <= horizon:
+          self.sample.update(heapq.heappop(samples)[2])
+        yield events
+    finally:
+      for task in tasks:
+        task.cancel()
+      await asyncio.gather(*tasks, return_exceptions=True)
+
+  async def __aiter__(self):
+    async for events in self.merged():
+      for event in events:
+        yield event
+
+  def ticks(self):
+    '''Same as Tracker.ticks() for synchronous callers, event loop runs
+    only while waiting for the next tick
+    '''
+    loop = asyncio.new_event_loop()
+    stream = self.merged()
+    step = None
+    try:
+      while True:
+        step = asyncio.ensure_future(stream.__anext__(), loop=loop)
+        yield loop.run_until_complete(step)
+    finally:
+      # Interrupted mid-tick, let the stream clean up before closing it
+      if step is not None and not step.done():
+        step.cancel()
+        loop.run_until_complete(asyncio.gather(step, return_exceptions=True))
+      loop.run_until_complete(stream.aclose())
+      loop.run_until_complete(loop.shutdown_default_executor())
+      loop.close()
+
+  def __iter__(self):
+    for events in self.ticks():
+      yield from events
+
+  def close(self):
+    for tracker in self.trackers:
+      tracker.close()
@@ -0,0 +1,228 @@
+'''Trigger conditions for starting, stopping and marking capture.
+Condition text is parsed once into tree of closures, evaluating it every tick
+is a handful of function calls, no string handling or eval.
+
+  ptr in 0x8200..0x8300          pointer inside range, both ends inclusive
+  sq1 == 0x8123                  pointer of session channel sq1
+  nes.sq1 != nsf.sq1             channels of multi-target session
+  ram[0xf5] -> 3                 RAM byte changed to 3 during this tick
+  ram[0x33a,v,0xe] >= 0x9000     RAM value, same spec as resolver pointers
+  ram[0x10] changed              RAM value differs from previous tick
+  nes.ram[0xf5] == nsf.ram[0xf5] RAM of a target in multi-target session
+  not ptr < 0x8000 and (ram[0xf5] == 1 or ram[0xf6] == 1)
+
+Comparisons: == != < <= > >=, in LO..HI, -> VALUE, changed.
+Combined with not, and, or, parentheses.
+'''
+
+import operator
+import re
+
+from memory_reader import Pointer
+from util import int_autobase
+
+
+TOKEN = re.compile(r'\s*((?:[A-Za-z_]\w*\.)?ram\[[^\]]*\]|\.\.|->|==|!=|<=|>=|<|>|\(|\)|0x[0-9a-fA-F]+|\d+|\w+(?:\.[A-Za-z_]\w*)*)')
+
+OPERATORS = {
+  '==': operator.eq,
+  '!=': operator.ne,
+  '<': operator.lt,
+  '<=': operator.le,
+  '>': operator.gt,
+  '>=': operator.ge,
+}
+
+
+def tokenize(text):
+  tokens = []
+  pos = 0
+  text = text.strip()
+  while pos < len(text):
+    match = TOKEN.match(text, pos)
+    if not match:
+      raise ValueError(f'Unexpected input at "{text[pos:]}"')
+    tokens.append(match.group(1))
+    pos = match.end()
+  return tokens
+
+
+class Trigger:
+  '''Parsed condition, bind() it to memory reader to get the predicate
+  '''
+
+  text = None
+  tree = None
+
+  def __init__(self, text):
+    self.text = text
+    self.tokens = tokenize(text)
+    self.pos = 0
+    self.tree = self.parse_or()
+    if self.pos != len(self.tokens):
+      raise ValueError(f'Unexpected "{self.tokens[self.pos]}" in condition "{text}"')
+    del self.tokens, self.pos
+
+  def __repr__(self):
+    return self.text
+
+  # Recursive descent parser, produces nested tuples
+  def peek(self):
+    return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+  def take(self, expected=None):
+    token = self.peek()
+    if token is None or (expected is not None and token != expected):
+      raise ValueError(f'Expected {expected or "more"} in condition "{self.text}"')
+    self.pos += 1
+    return token
+
+  def parse_or(self):
+    node = self.parse_and()
+    while self.peek() == 'or':
+      self.take()
+      node = ('or', node, self.parse_and())
+    return node
+
+  def parse_and(self):
+    node = self.parse_not()
+    while self.peek() == 'and':
+      self.take()
+      node = ('and', node, self.parse_not())
+    return node
+
+  def parse_not(self):
+    if self.peek() == 'not':
+      self.take()
+      return ('not', self.parse_not())
+    if self.peek() == '(':
+      self.take()
+      node = self.parse_or()
+      self.take(')')
+      return node
+    return self.parse_comparison()
+
+  def parse_comparison(self):
+    value = self.parse_value()
+    token = self.take()
+
+    if token == 'in':
+      low = self.parse_value()
+      self.take('..')
+      return ('in', value, low, self.parse_value())
+    if token == '->':
+      return ('becomes', value, self.parse_value())
+    if token == 'changed':
+      return ('changed', value)
+    if token in OPERATORS:
+      return ('cmp', OPERATORS[token], value, self.parse_value())
+    raise ValueError(f'Unknown comparison "{token}" in condition "{self.text}"')
+
+  def parse_value(self):
+    token = self.take()
+    if token.endswith(']'):
+      target, _sep, spec = token[:-1].partition('ram[')
+      return ('ram', (target[:-1] or None, spec.strip()))
+    if token[0].isdigit():
+      return ('const', int_autobase(token))
+    if token in ('and', 'or', 'not', 'in', 'changed') or not token[0].isalpha() and token[0] != '_':
+      raise ValueError(f'Expected value, got "{token}" in condition "{self.text}"')
+    return ('ptr', token)
+
+  # Compilation into closures
+  def names(self, node=None):
+    '''Channel names condition refers to
+    '''
+    node = self.tree if node is None else node
+    if node[0] == 'ptr':
+      return {node[1]}
+    return set().union(*(self.names(x) for x in node[1:] if isinstance(x, tuple) and x[0] != 'ram'))
+
+  def ram(self, node=None):
+    '''(target, spec) of every RAM value condition refers to, target is None
+    when it is not given
+    '''
+    node = self.tree if node is None else node
+    if node[0] == 'ram':
+      return {node[1]}
+    return set().union(*(self.ram(x) for x in node[1:] if isinstance(x, tuple)))
+
+  def bind(self, reader, names=('ptr',)):
+    '''Predicate taking dict of channel name -> pointer, ptr for the single
+    pointer_logger channel. Call exactly once per tick, -> and changed compare
+    with the value from the previous call.
+
+    RAM values are read through reader, or without reader taken from the same
+    dict by their (target, spec) key, see Tracker.watch().
+    '''
+    unknown = self.names() - set(names)
+    if unknown:
+      raise ValueError(f'Unknown channel {", ".join(sorted(unknown))} in condition "{self.text}"')
+    targets = {target for target, _spec in self.ram() if target is not None}
+    if reader is not None and targets:
+      raise ValueError(f'Unknown target {", ".join(sorted(targets))} in condition "{self.text}"')
+    return self.compile(self.tree, reader)
+
+  def compile_value(self, node, reader):
+    kind, arg = node
+    if kind == 'const':
+      return lambda ptrs: arg
+    if kind == 'ptr' or reader is None:
+      return lambda ptrs: ptrs[arg]
+    pointer = Pointer(reader, arg[1], default_kind='b')
+    return lambda ptrs: pointer()
+
+  def compile(self, node, reader):
+    kind = node[0]
+
+    if kind in ('and', 'or'):
+      left, right = self.compile(node[1], reader), self.compile(node[2], reader)
+      # Both sides run every tick so -> and changed never miss an update
+      if kind == 'and':
+        return lambda ptrs: left(ptrs) & right(ptrs)
+      return lambda ptrs: left(ptrs) | right(ptrs)
+
+    if kind == 'not':
+      inner = self.compile(node[1], reader)
+      return lambda ptrs: not inner(ptrs)
+
+    if kind == 'in':
+      value, low, high = (self.compile_value(x, reader) for x in node[1:])
+      return lambda ptrs: low(ptrs) <= value(ptrs) <= high(ptrs)
+
+    if kind == 'cmp':
+      func, left, right = node[1], self.compile_value(node[2], reader), self.compile_value(node[3], reader)
+      return lambda ptrs: func(left(ptrs), right(ptrs))
+
+    value = self.compile_value(node[1], reader)
+    target = self.compile_value(node[2], reader) if kind == 'becomes' else None
+    previous = [None]
+
+    def edge(ptrs):
+      current = value(ptrs)
+      old, previous[0] = previous[0], current
+      if old is None:
+        return False
+      if target is None:
+        return current != old
+      wanted = target(ptrs)
+      return current == wanted and old != wanted
+
+    return edge
+
+
+class Edge:
+  '''Rising edge of a predicate: true only on the tick it turns true
+  '''
+
+  predicate = None
+  state = False
+
+  def __init__(self, predicate):
+    self.predicate = predicate
+
+  def __call__(self, ptrs):
+    state = bool(self.predicate(ptrs))
+    rising = state and not self.state
+    self.state = state
+    return rising
@@ -4,3 +4,16 @@ def int_autobase(i):
     return i
   else:
     return int(i, 0)
+
+
+def merge_regions(ranges, pad=0):
+  '''Merge (start, size) ranges, padded on both sides, into sorted list
+  '''
+  result = []
+  for start, size in sorted(ranges):
+    start, end = max(0, start - pad), start + size + pad
+    if result and start <= result[-1][1]:
+      result[-1][1] = max(result[-1][1], end)
+    else:
+      result.append([start, end])
+  return [(start, end - start) for start, end in result]